@@ -0,0 +1,4 @@
+"""Start the machine learning client: python -m machine_learning_client."""
+from machine_learning_client import serving
+
+serving.serve()
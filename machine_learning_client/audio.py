@@ -0,0 +1,288 @@
+"""Decoding uploads and recordings into audio shared by the analysis stages."""
+import subprocess
+import os
+import tempfile
+import threading
+
+# librosa stays a plain import: its own lazy loader already defers every
+# submodule until first use, so importing the package costs a few ms
+import librosa
+import soundfile as sf
+import numpy as np
+import soxr
+
+from machine_learning_client import config, metrics
+
+
+class AudioContext:
+    """
+    Decoded audio shared by every analysis stage of a single request.
+    The file is read once; resampled mono copies are cached per sample rate.
+    """
+
+    def __init__(self, audio, sr):
+        self.audio = audio
+        self.sr = sr
+        self._resampled = {}
+        self._lock = threading.Lock()
+        self._rate_locks = {}
+
+    @classmethod
+    def from_file(cls, audio_file):
+        """Decode an audio file once into a new context."""
+        audio, sr = sf.read(audio_file)
+        return cls(audio, sr)
+
+    @property
+    def duration(self):
+        """Length of the audio in seconds."""
+        return len(self.audio) / self.sr
+
+    def at_rate(self, sr):
+        """Return mono float32 audio at the given rate, as librosa.load would."""
+        # One lock per rate: stages wanting the same rate share one resample,
+        # while different rates are produced side by side
+        with self._lock:
+            rate_lock = self._rate_locks.setdefault(sr, threading.Lock())
+        with rate_lock:
+            if sr not in self._resampled:
+                self._resampled[sr] = self._resample(sr)
+            return self._resampled[sr]
+
+    def _resample(self, sr):
+        """Mix down to mono and resample to sr."""
+        with metrics.stage_timer("resample"):
+            y = np.asarray(self.audio, dtype=np.float32)
+            if y.ndim > 1:
+                y = librosa.to_mono(y.T)
+            if sr != self.sr:
+                y = librosa.resample(y, orig_sr=self.sr, target_sr=sr)
+            return y
+
+
+class AudioFile:
+    """
+    Decoded audio kept on disk and read back one block at a time, so the
+    streaming analysis never holds the whole signal in memory.
+    """
+
+    def __init__(self, path, block_seconds=None):
+        self.path = path
+        info = sf.info(path)
+        self.sr = info.samplerate
+        self.frames = info.frames
+        self.block_seconds = block_seconds or config.stream_block_seconds
+
+    @property
+    def duration(self):
+        """Length of the audio in seconds."""
+        return self.frames / self.sr
+
+    def blocks(self, sr=None):
+        """
+        Mono float32 blocks at sr. The resampler state carries over from one
+        block to the next, so joined together they equal AudioContext.at_rate.
+        """
+        resampler = None
+        if sr and sr != self.sr:
+            resampler = soxr.ResampleStream(self.sr, sr, 1, dtype="float32")
+        blocksize = max(1, int(self.sr * self.block_seconds))
+        for block in sf.blocks(
+            self.path, blocksize=blocksize, dtype="float32", always_2d=True
+        ):
+            block = block.mean(axis=1)
+            yield block if resampler is None else resampler.resample_chunk(block)
+        if resampler is not None:
+            yield resampler.resample_chunk(np.zeros(0, dtype=np.float32), last=True)
+
+
+def load_audio_at_rate(source, sr=44100):
+    """Get mono audio at a sample rate from an AudioContext or a file path."""
+    if isinstance(source, AudioContext):
+        return source.at_rate(sr)
+    y, _ = librosa.load(source, sr=sr)
+    return y
+
+
+def convert_webm_to_wav(webm_file, wav_file):
+    """Convert WebM audio file to WAV format."""
+    with metrics.stage_timer("ffmpeg"):
+        result = subprocess.run(
+            ["ffmpeg", "-i", webm_file, wav_file],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            check=False,
+        )
+    if result.returncode != 0:
+        print("ffmpeg error:", result.stderr.decode())
+        raise ValueError("Error converting WebM to WAV")
+
+
+def ffmpeg_pcm_command(sr):
+    """ffmpeg arguments that read audio on stdin and write mono float32 PCM."""
+    return [
+        "ffmpeg",
+        "-loglevel",
+        "error",
+        "-i",
+        "pipe:0",
+        "-f",
+        "f32le",
+        "-ac",
+        "1",
+        "-ar",
+        str(sr),
+        "pipe:1",
+    ]
+
+
+def decode_webm_to_pcm(audio_bytes, sr=44100):
+    """
+    Decode WebM bytes to mono float32 PCM by piping them through ffmpeg.
+    ffmpeg resamples to sr in the same pass, so nothing touches the disk.
+    """
+    with metrics.stage_timer("ffmpeg"):
+        result = subprocess.run(
+            ffmpeg_pcm_command(sr),
+            input=audio_bytes,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            check=False,
+        )
+    if result.returncode != 0:
+        print("ffmpeg error:", result.stderr.decode())
+        raise ValueError("Error decoding WebM audio")
+    return np.frombuffer(result.stdout, dtype=np.float32)
+
+
+class WebmStreamDecoder:
+    """
+    One ffmpeg process decoding a WebM stream that arrives in pieces. Each
+    piece is written to ffmpeg's stdin once, and a reader thread collects
+    the PCM it writes back, so no byte is decoded twice. Another thread keeps
+    the tail of ffmpeg's log, so a full stderr pipe never blocks it.
+    """
+
+    # Bytes of ffmpeg's log kept for the error message
+    log_tail_bytes = 8192
+
+    def __init__(self, sr=44100):
+        # The process outlives this call, so it cannot be opened in a with block
+        self.process = subprocess.Popen(  # pylint: disable=consider-using-with
+            ffmpeg_pcm_command(sr),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        self._pcm = bytearray()
+        self._log = bytearray()
+        self._lock = threading.Lock()
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+        self._log_reader = threading.Thread(target=self._read_log, daemon=True)
+        self._log_reader.start()
+
+    def _read(self):
+        while True:
+            data = self.process.stdout.read1(65536)
+            if not data:
+                break
+            with self._lock:
+                self._pcm.extend(data)
+
+    def _read_log(self):
+        while True:
+            data = self.process.stderr.read1(65536)
+            if not data:
+                break
+            self._log.extend(data)
+            del self._log[: -self.log_tail_bytes]
+
+    def _take(self):
+        with self._lock:
+            usable = len(self._pcm) - len(self._pcm) % 4
+            samples = np.frombuffer(bytes(self._pcm[:usable]), dtype=np.float32)
+            del self._pcm[:usable]
+        return samples
+
+    def write(self, data):
+        """
+        Send more WebM bytes to ffmpeg and return the samples decoded since
+        the last call. ffmpeg runs alongside, so the newest audio usually
+        comes back with a later call.
+        """
+        try:
+            self.process.stdin.write(data)
+            self.process.stdin.flush()
+        except BrokenPipeError as e:
+            raise ValueError("Error decoding WebM audio") from e
+        return self._take()
+
+    def finish(self):
+        """Close ffmpeg's input and return the samples it had left."""
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        self._reader.join()
+        self._log_reader.join()
+        if self.process.wait() != 0:
+            print("ffmpeg error:", self._log.decode(errors="replace"))
+            raise ValueError("Error decoding WebM audio")
+        return self._take()
+
+    def kill(self):
+        """Stop ffmpeg without waiting for the rest of the audio."""
+        self.process.kill()
+        self.process.wait()
+        self._reader.join()
+        self._log_reader.join()
+
+
+def decode_webm_to_wav(audio_bytes, wav_file, sr=44100):
+    """
+    Decode WebM bytes into a mono float32 WAV file at sr: the samples
+    decode_webm_to_pcm returns, written to disk instead of kept in memory.
+    """
+    with metrics.stage_timer("ffmpeg"):
+        result = subprocess.run(
+            ["ffmpeg", "-loglevel", "error", "-y", "-i", "pipe:0", "-ac", "1"]
+            + ["-ar", str(sr), "-c:a", "pcm_f32le", wav_file],
+            input=audio_bytes,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            check=False,
+        )
+    if result.returncode != 0:
+        print("ffmpeg error:", result.stderr.decode())
+        raise ValueError("Error decoding WebM audio")
+
+
+def decode_upload(audio_stream):
+    """Decode an uploaded WebM stream into an AudioContext."""
+    if config.decode_mode == "pipe":
+        audio = decode_webm_to_pcm(audio_stream.read(), sr=config.decode_sample_rate)
+        return AudioContext(audio, config.decode_sample_rate)
+
+    # Each request gets its own scratch directory, removed on exit
+    with tempfile.TemporaryDirectory(prefix="ml-request-") as workspace:
+        webm_file = os.path.join(workspace, "recording.webm")
+        wav_file = os.path.join(workspace, "recording.wav")
+
+        # Write audio to file and convert formats
+        with metrics.stage_timer("upload_write"):
+            write_audio_to_file(webm_file, audio_stream)
+        convert_webm_to_wav(webm_file, wav_file)
+        return AudioContext.from_file(wav_file)
+
+
+def clean_up_files(webm_file, wav_file):
+    """Remove temporary audio files."""
+    os.remove(webm_file)
+    os.remove(wav_file)
+
+
+def write_audio_to_file(file_name, audio_stream):
+    """function to write audio to file"""
+    with open(file_name, "wb") as file:
+        file.write(audio_stream.read())
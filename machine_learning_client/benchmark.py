@@ -0,0 +1,326 @@
+"""
+Benchmark the ML audio pipeline stage by stage and end to end.
+
+Every stage runs on tests/test_audio.wav and on generated melodies of the
+requested lengths. For each one the script reports throughput (audio
+seconds per wall second) and peak traced memory. S3 and MongoDB are
+replaced with mocks. Run it from the repository root:
+
+    python -m machine_learning_client.benchmark --save baseline.json
+    python -m machine_learning_client.benchmark --compare baseline.json
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from unittest.mock import MagicMock, patch
+import numpy as np
+import soundfile as sf
+from machine_learning_client import config, midi, ml, pitch, rhythm, uploads
+from machine_learning_client.audio import AudioContext, decode_upload
+
+SAMPLE_RATE = 44100
+DURATIONS = [5, 30, 120, 600]
+TEST_AUDIO = os.path.join(os.path.dirname(__file__), "tests", "test_audio.wav")
+STAGES = [
+    "decode",
+    "process_audio_chunks",
+    "smooth_pitch_data",
+    "filter_and_combine_notes",
+    "detect_note_onsets",
+    "estimate_note_durations",
+    "estimate_tempo",
+    "create_midi",
+    "end_to_end",
+]
+
+
+def generate_melody(seconds, sr=SAMPLE_RATE, seed=0):
+    """A sung-like melody of decaying harmonic notes with short rests."""
+    rng = np.random.default_rng(seed)
+    audio = np.zeros(int(seconds * sr), dtype=np.float32)
+    position = 0
+    while position < len(audio):
+        length = int(rng.uniform(0.2, 0.6) * sr)
+        frequency = 440.0 * 2 ** (rng.integers(-12, 13) / 12)
+        t = np.arange(min(length, len(audio) - position)) / sr
+        note = sum(0.4 / k * np.sin(2 * np.pi * k * frequency * t) for k in (1, 2, 3))
+        audio[position : position + len(t)] = note * np.exp(-2.0 * t)
+        position += length + int(rng.uniform(0.0, 0.15) * sr)
+    audio += 0.005 * rng.standard_normal(len(audio)).astype(np.float32)
+    return audio
+
+
+def encode_webm(audio, sr):
+    """Encode audio as the WebM/Opus the browser uploads, or None without ffmpeg."""
+    try:
+        result = subprocess.run(
+            ["ffmpeg", "-loglevel", "error", "-f", "f32le", "-ar", str(sr)]
+            + ["-ac", "1", "-i", "pipe:0", "-c:a", "libopus", "-f", "webm", "pipe:1"],
+            input=np.asarray(audio, dtype=np.float32).tobytes(),
+            capture_output=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout
+
+
+def measure(func, repeats, trace_memory=True):
+    """
+    Best wall time of func over repeats, then its peak traced memory from
+    one more run. Returns the last result, the seconds and the peak bytes.
+    """
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    peak = None
+    if trace_memory:
+        tracemalloc.start()
+        try:
+            result = func()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result, best, peak
+
+
+@contextmanager
+def stubbed_services():
+    """Patch S3, MongoDB and the result cache so nothing leaves the process."""
+    with patch.object(uploads, "s3", MagicMock()), patch.multiple(
+        ml, collection=MagicMock(), cache_collection=MagicMock()
+    ), patch.multiple(
+        config, s3_upload_mode="sync", result_cache_size=0, result_cache_persist=False
+    ):
+        yield
+
+
+def stage_pipeline(audio, sr, webm, inputs):
+    """
+    Every stage as (name, callable, available), in pipeline order. Stages
+    read the outputs of earlier ones from inputs.
+    """
+    return [
+        ("decode", lambda: decode_upload(io.BytesIO(webm)), webm is not None),
+        (
+            "process_audio_chunks",
+            lambda: pitch.process_audio_chunks(AudioContext(audio, sr)),
+            True,
+        ),
+        (
+            "smooth_pitch_data",
+            lambda: midi.smooth_pitch_data(
+                inputs["process_audio_chunks"], window_size=config.smoothing_window
+            ),
+            True,
+        ),
+        (
+            "filter_and_combine_notes",
+            lambda: midi.filter_and_combine_notes(inputs["smooth_pitch_data"]),
+            True,
+        ),
+        (
+            "detect_note_onsets",
+            lambda: rhythm.detect_note_onsets(
+                AudioContext(audio, sr), sr=config.analysis_sample_rate
+            ),
+            True,
+        ),
+        (
+            "estimate_note_durations",
+            lambda: rhythm.estimate_note_durations(
+                inputs["detect_note_onsets"],
+                AudioContext(audio, sr),
+                sr=config.analysis_sample_rate,
+            ),
+            True,
+        ),
+        (
+            "estimate_tempo",
+            lambda: rhythm.estimate_tempo(
+                AudioContext(audio, sr), sr=config.analysis_sample_rate
+            ),
+            True,
+        ),
+        (
+            "create_midi",
+            lambda: ml.create_midi(
+                inputs["filter_and_combine_notes"],
+                inputs["detect_note_onsets"],
+                inputs["estimate_note_durations"],
+                inputs["estimate_tempo"],
+                output_file="benchmark.mid",
+            ),
+            True,
+        ),
+        ("end_to_end", lambda: ml.transcribe_audio(webm), webm is not None),
+    ]
+
+
+def benchmark_signal(audio, sr, stages, repeats, trace_memory=True):
+    """Run the selected stages on one signal and collect their numbers."""
+    duration = len(audio) / sr
+    webm = encode_webm(audio, sr) if {"decode", "end_to_end"} & set(stages) else None
+    inputs = {}
+    results = {}
+    for name, func, available in stage_pipeline(audio, sr, webm, inputs):
+        # Later stages need earlier outputs even when only they are selected
+        needed = name in stages or any(
+            stage in stages and STAGES.index(stage) > STAGES.index(name)
+            for stage in stages
+        )
+        if not available or not needed:
+            continue
+        inputs[name], seconds, peak = measure(
+            func, repeats if name in stages else 1, trace_memory and name in stages
+        )
+        if name in stages:
+            results[name] = {
+                "seconds": round(seconds, 4),
+                "throughput": round(duration / seconds, 2) if seconds else None,
+                "peak_mb": round(peak / 2**20, 2) if peak is not None else None,
+            }
+    return {"audio_seconds": round(duration, 2), "stages": results}
+
+
+def run_benchmarks(durations, stages, repeats, trace_memory=True):
+    """Benchmark the test recording and every generated signal."""
+    signals = {os.path.basename(TEST_AUDIO): sf.read(TEST_AUDIO, dtype="float32")}
+    for seconds in durations:
+        signals[f"synthetic_{seconds:g}s"] = (generate_melody(seconds), SAMPLE_RATE)
+
+    report = {
+        "meta": {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "crepe_model_capacity": config.crepe_model_capacity,
+            "pitch_backend": config.pitch_backend,
+            "stage_workers": config.stage_workers,
+            "analysis_sample_rate": config.analysis_sample_rate,
+            "analysis_mode": config.analysis_mode,
+            "repeats": repeats,
+        },
+        "signals": {},
+    }
+    with tempfile.TemporaryDirectory() as root, stubbed_services():
+        with patch.object(ml.app, "root_path", root):
+            # Warm up so model loading is not counted against the first signal
+            pitch.process_audio_chunks(AudioContext(generate_melody(1), SAMPLE_RATE))
+            for name, (audio, sr) in signals.items():
+                print(f"Benchmarking {name}...", file=sys.stderr)
+                report["signals"][name] = benchmark_signal(
+                    audio, sr, stages, repeats, trace_memory
+                )
+    report["meta"]["max_rss_mb"] = max_rss_mb()
+    return report
+
+
+def max_rss_mb():
+    """Peak resident memory of the whole process, where the OS reports it."""
+    try:
+        import resource  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return None
+    scale = 1 if sys.platform == "darwin" else 1024
+    return round(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2**20, 1
+    )
+
+
+def compare_reports(baseline, report, tolerance):
+    """
+    Pair every stage with its baseline. A stage regresses when it is more
+    than tolerance slower. Returns rows of (signal, stage, base, new, ratio).
+    """
+    rows = []
+    for signal, result in report["signals"].items():
+        base_stages = baseline["signals"].get(signal, {}).get("stages", {})
+        for stage, numbers in result["stages"].items():
+            if stage in base_stages and base_stages[stage]["seconds"]:
+                ratio = numbers["seconds"] / base_stages[stage]["seconds"]
+                rows.append(
+                    (signal, stage, base_stages[stage]["seconds"], numbers["seconds"])
+                    + (ratio, ratio > 1 + tolerance)
+                )
+    return rows
+
+
+def print_report(report):
+    """Print throughput and memory for every signal and stage."""
+    print(f"{'signal':<20}{'stage':<26}{'seconds':>9}{'x realtime':>12}{'peak MB':>9}")
+    for signal, result in report["signals"].items():
+        for stage, numbers in result["stages"].items():
+            peak = "-" if numbers["peak_mb"] is None else f"{numbers['peak_mb']:.1f}"
+            print(
+                f"{signal:<20}{stage:<26}{numbers['seconds']:>9.3f}"
+                f"{numbers['throughput'] or 0:>12.1f}{peak:>9}"
+            )
+    print(f"Peak RSS: {report['meta']['max_rss_mb']} MB")
+
+
+def print_comparison(rows, tolerance):
+    """Print the comparison with a baseline and return whether it regressed."""
+    print(f"{'signal':<20}{'stage':<26}{'baseline':>9}{'now':>9}{'ratio':>7}")
+    for signal, stage, base, now, ratio, slower in rows:
+        flag = "  SLOWER" if slower else ""
+        print(f"{signal:<20}{stage:<26}{base:>9.3f}{now:>9.3f}{ratio:>7.2f}{flag}")
+    regressed = any(row[-1] for row in rows)
+    if regressed:
+        print(f"Some stages are more than {tolerance:.0%} slower than the baseline.")
+    return regressed
+
+
+def main():
+    """Parse arguments, run the benchmarks and save or compare the results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--durations", nargs="*", type=float, default=DURATIONS)
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument("--capacity", default=config.crepe_model_capacity)
+    parser.add_argument("--backend", default=config.pitch_backend)
+    parser.add_argument(
+        "--analysis-mode", choices=["memory", "stream"], default=config.analysis_mode
+    )
+    parser.add_argument("--no-memory", action="store_true", help="skip tracemalloc")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="compare against a saved JSON baseline")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args()
+
+    # Per-note info logging would otherwise dominate the cheap stages
+    logging.getLogger().setLevel(logging.WARNING)
+    config.crepe_model_capacity = args.capacity
+    config.pitch_backend = args.backend
+    config.analysis_mode = args.analysis_mode
+    report = run_benchmarks(
+        args.durations, args.stages, args.repeats, trace_memory=not args.no_memory
+    )
+    print_report(report)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            baseline = json.load(file)
+        rows = compare_reports(baseline, report, args.tolerance)
+        if print_comparison(rows, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
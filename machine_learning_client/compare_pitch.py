@@ -0,0 +1,258 @@
+"""
+Compare the pitch-detection backends in pitch.py on speed and accuracy.
+
+Accuracy is measured on synthetic harmonic tones with a known pitch, and
+agreement with a reference backend on tests/test_audio.wav. With --steps
+it instead compares CREPE frame steps, fixed or adaptive, against the
+10 ms baseline. Run it from the repository root:
+
+    python -m machine_learning_client.compare_pitch --json pitch_report.json
+    python -m machine_learning_client.compare_pitch --steps 20 40 adaptive
+"""
+import argparse
+import difflib
+import json
+import os
+import time
+from unittest.mock import patch
+import numpy as np
+import soundfile as sf
+from machine_learning_client import config, midi, pitch
+from machine_learning_client.benchmark import generate_melody
+
+SAMPLE_RATE = 44100
+TONE_NOTES = ["A2", "E3", "C4", "A4", "E5", "C6"]
+TEST_AUDIO = os.path.join(os.path.dirname(__file__), "tests", "test_audio.wav")
+
+
+def synthetic_tone(note, sr=SAMPLE_RATE, seconds=1.0, seed=0):
+    """A harmonic tone with a little noise, and its true frequency."""
+    frequency = 440.0 * 2 ** ((midi.pretty_midi.note_name_to_number(note) - 69) / 12)
+    t = np.arange(int(sr * seconds)) / sr
+    tone = sum(
+        0.5 / k * np.sin(2 * np.pi * k * frequency * t) for k in range(1, 4)
+    ) + 0.01 * np.random.default_rng(seed).standard_normal(len(t))
+    return tone.astype(np.float32), frequency
+
+
+def cents_error(frequency, target):
+    """Absolute distance in cents between detected and target frequencies."""
+    frequency = np.where(frequency > 0, frequency, 1e-3)
+    return np.abs(1200 * np.log2(frequency / target))
+
+
+def run_backend(backend, audio, sr):
+    """Run one backend and return its pitch arrays and the time it took."""
+    start = time.perf_counter()
+    result = pitch.detect_pitch(audio, sr, backend=backend)
+    return result, time.perf_counter() - start
+
+
+def score_tones(backend):
+    """Voicing recall, pitch error and speed over the synthetic tones."""
+    errors, voiced, elapsed, duration = [], [], 0.0, 0.0
+    for note in TONE_NOTES:
+        tone, frequency = synthetic_tone(note)
+        (_, detected, confidence), seconds = run_backend(backend, tone, SAMPLE_RATE)
+        mask = confidence >= config.min_confidence
+        voiced.append(mask.mean())
+        errors.append(cents_error(detected[mask], frequency))
+        elapsed += seconds
+        duration += len(tone) / SAMPLE_RATE
+    errors = np.concatenate(errors)
+    return {
+        "voiced_recall": float(np.mean(voiced)),
+        "median_cents_error": float(np.median(errors)) if len(errors) else None,
+        "within_50_cents": float(np.mean(errors < 50)) if len(errors) else None,
+        "realtime_factor": duration / elapsed,
+    }
+
+
+def score_recording(backend, audio, sr, reference):
+    """Speed on a real recording and agreement with the reference track."""
+    (_, frequency, confidence), seconds = run_backend(backend, audio, sr)
+    _, ref_frequency, ref_confidence = reference
+    both = (confidence >= config.min_confidence) & (
+        ref_confidence >= config.min_confidence
+    )
+    agree = cents_error(frequency[both], ref_frequency[both]) < 50
+    return {
+        "seconds": seconds,
+        "realtime_factor": len(audio) / sr / seconds,
+        "voiced_fraction": float(np.mean(confidence >= config.min_confidence)),
+        "agreement_with_reference": float(agree.mean()) if both.any() else None,
+    }
+
+
+def compare(backends, reference, audio_path=TEST_AUDIO):
+    """Build the comparison report for the given backends."""
+    audio, sr = sf.read(audio_path, dtype="float32")
+    # Warm up every backend so model loading and JIT compilation are not timed
+    for backend in backends:
+        run_backend(backend, synthetic_tone("A4")[0], SAMPLE_RATE)
+
+    reference_track, _ = run_backend(reference, audio, sr)
+    return {
+        "reference": reference,
+        "crepe_model_capacity": config.crepe_model_capacity,
+        "recording": os.path.basename(audio_path),
+        "recording_seconds": len(audio) / sr,
+        "backends": {
+            backend: {
+                "tones": score_tones(backend),
+                "recording": score_recording(backend, audio, sr, reference_track),
+            }
+            for backend in backends
+        },
+    }
+
+
+def run_step(step, audio, sr):
+    """
+    CREPE pitch at a fixed step in ms or "adaptive", the number of frames
+    the model evaluated and the seconds it took.
+    """
+    model_frames = []
+    run_pitch_model = pitch.run_pitch_model
+
+    def counting_model(frames, batch_size=None):
+        model_frames.append(len(frames))
+        return run_pitch_model(frames, batch_size=batch_size)
+
+    mode = "adaptive" if step == "adaptive" else "fixed"
+    step_size = 10 if step == "adaptive" else int(step)
+    with patch.object(pitch, "run_pitch_model", counting_model), patch.object(
+        config, "pitch_step_mode", mode
+    ):
+        start = time.perf_counter()
+        track = pitch.predict_pitch(audio, sr, step_size=step_size)
+        seconds = time.perf_counter() - start
+    return track, sum(model_frames), seconds
+
+
+def note_names(track):
+    """The note sequence the pipeline would write for a pitch track."""
+    notes = pitch.pitch_to_notes_data(
+        *track, confidence_threshold=config.min_confidence
+    )
+    return [note["note"] for note in midi.process_notes(notes)]
+
+
+def score_step(track, baseline):
+    """Agreement of a pitch track with the 10 ms baseline, frame by frame."""
+    times, frequency, confidence = track
+    base_times, base_frequency, base_confidence = baseline
+    nearest = pitch.nearest_index(times, base_times)
+    voiced = confidence[nearest] >= config.min_confidence
+    base_voiced = base_confidence >= config.min_confidence
+    both = voiced & base_voiced
+    close = cents_error(frequency[nearest][both], base_frequency[both]) < 50
+    return {
+        "voicing_agreement": float(np.mean(voiced == base_voiced)),
+        "pitch_agreement": float(close.mean()) if both.any() else None,
+        "note_similarity": difflib.SequenceMatcher(
+            None, note_names(track), note_names(baseline)
+        ).ratio(),
+    }
+
+
+def compare_steps(steps, audio_path=TEST_AUDIO, melody_seconds=30):
+    """Quality and speed of each step setting against the 10 ms baseline."""
+    signals = {
+        os.path.basename(audio_path): sf.read(audio_path, dtype="float32"),
+        f"melody_{melody_seconds}s": (generate_melody(melody_seconds), SAMPLE_RATE),
+    }
+    pitch.predict_pitch(synthetic_tone("A4")[0], SAMPLE_RATE)  # load the model
+    report = {"crepe_model_capacity": config.crepe_model_capacity, "signals": {}}
+    for name, (audio, sr) in signals.items():
+        report["signals"][name] = compare_signal_steps(steps, audio, sr)
+    return report
+
+
+def compare_signal_steps(steps, audio, sr):
+    """Scores for every step setting on one signal."""
+    baseline, base_frames, base_seconds = run_step(10, audio, sr)
+    results = {}
+    for step in steps:
+        track, model_frames, seconds = run_step(step, audio, sr)
+        results[str(step)] = {
+            "model_frames": model_frames,
+            "seconds": seconds,
+            "speedup": base_seconds / seconds,
+            "frame_reduction": base_frames / max(model_frames, 1),
+            **score_step(track, baseline),
+        }
+    return results
+
+
+def print_step_report(report):
+    """Print the step comparison as a table."""
+    print(
+        f"{'signal':<16}{'step':<10}{'frames':>8}{'speedup':>9}"
+        f"{'voicing':>9}{'pitch':>7}{'notes':>7}"
+    )
+    for signal, results in report["signals"].items():
+        for step, scores in results.items():
+            print(
+                f"{signal:<16}{step:<10}{scores['model_frames']:>8}"
+                f"{scores['speedup']:>9.2f}{scores['voicing_agreement']:>9.2f}"
+                f"{format_score(scores['pitch_agreement'], '.2f'):>7}"
+                f"{scores['note_similarity']:>7.2f}"
+            )
+    print("Agreement is measured against a 10 ms fixed step.")
+
+
+def print_report(report):
+    """Print the report as a table."""
+    print(
+        f"{'backend':<8}{'tone RTF':>10}{'recall':>8}{'cents':>8}{'<50c':>7}"
+        f"{'wav RTF':>10}{'voiced':>8}{'agree':>7}"
+    )
+    for backend, scores in report["backends"].items():
+        tones, recording = scores["tones"], scores["recording"]
+        print(
+            f"{backend:<8}{tones['realtime_factor']:>10.1f}"
+            f"{tones['voiced_recall']:>8.2f}"
+            f"{format_score(tones['median_cents_error'], '.1f'):>8}"
+            f"{format_score(tones['within_50_cents'], '.2f'):>7}"
+            f"{recording['realtime_factor']:>10.1f}"
+            f"{recording['voiced_fraction']:>8.2f}"
+            f"{format_score(recording['agreement_with_reference'], '.2f'):>7}"
+        )
+    print(f"Agreement is measured against the {report['reference']} backend.")
+
+
+def format_score(value, spec):
+    """Format a score that may be missing."""
+    return "-" if value is None else format(value, spec)
+
+
+def main():
+    """Parse arguments, run the comparison and print or save the report."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--backends", nargs="+", default=list(config.pitch_backend_names)
+    )
+    parser.add_argument("--reference", default="crepe")
+    parser.add_argument("--capacity", default=config.crepe_model_capacity)
+    parser.add_argument("--audio", default=TEST_AUDIO)
+    parser.add_argument(
+        "--steps", nargs="+", help="compare CREPE steps in ms and/or adaptive"
+    )
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    config.crepe_model_capacity = args.capacity
+    if args.steps:
+        report = compare_steps(args.steps, audio_path=args.audio)
+        print_step_report(report)
+    else:
+        report = compare(args.backends, args.reference, audio_path=args.audio)
+        print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Settings for the machine learning client, read from the environment."""
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+aws_access_key_id = os.getenv("AWS_ACCESS_KEY_ID")
+aws_secret_access_key = os.getenv("AWS_SECRET_ACCESS_KEY")
+s3_bucket_name = os.getenv("S3_BUCKET_NAME")
+
+host = os.getenv("HOST", "localhost")
+
+# "pipe" streams uploads through ffmpeg in memory, "file" uses temporary files
+decode_mode = os.getenv("DECODE_MODE", "pipe")
+decode_sample_rate = int(os.getenv("DECODE_SAMPLE_RATE", "44100"))
+
+# "memory" analyses the whole decoded signal at once; "stream" decodes to a
+# temporary file and reads it back in STREAM_BLOCK_SECONDS blocks, so memory
+# stays flat however long the recording is
+analysis_mode = os.getenv("ANALYSIS_MODE", "memory")
+stream_block_seconds = float(os.getenv("STREAM_BLOCK_SECONDS", "5"))
+# Voiced stretches longer than this are Viterbi-decoded in overlapping windows
+viterbi_window_seconds = float(os.getenv("VITERBI_WINDOW_SECONDS", "30"))
+
+# CREPE model size: tiny, small, medium, large or full (slower but more accurate)
+crepe_model_capacity = os.getenv("CREPE_MODEL_CAPACITY", "full")
+
+# Minimum CREPE confidence for a frame to count as a note
+min_confidence = float(os.getenv("CONFIDENCE_THRESHOLD", "0.74"))
+
+# Number of neighbouring frames used to smooth the pitch track
+smoothing_window = int(os.getenv("SMOOTHING_WINDOW", "5"))
+
+# Sample rate for onset, duration and tempo analysis; pitch always uses 16 kHz
+analysis_sample_rate = int(os.getenv("ANALYSIS_SAMPLE_RATE", "22050"))
+
+# Pitch frame step in ms, and "adaptive" to run the model every
+# PITCH_COARSE_STEP ms and only refine around changes in pitch or voicing
+pitch_step_size = int(os.getenv("PITCH_STEP_SIZE", "10"))
+pitch_step_mode = os.getenv("PITCH_STEP_MODE", "fixed")
+pitch_coarse_step = int(os.getenv("PITCH_COARSE_STEP", "40"))
+pitch_change_cents = float(os.getenv("PITCH_CHANGE_CENTS", "50"))
+
+# Voice-activity pre-pass: frames quieter than VAD_THRESHOLD_DB below the
+# loudest frame skip CREPE, but frames above VAD_FLOOR_DB are always analysed
+vad_enabled = os.getenv("VAD_ENABLED", "true").lower() == "true"
+vad_threshold_db = float(os.getenv("VAD_THRESHOLD_DB", "-45"))
+vad_floor_db = float(os.getenv("VAD_FLOOR_DB", "-60"))
+vad_padding_ms = int(os.getenv("VAD_PADDING_MS", "100"))
+
+# Pitch tracker: crepe, or the CPU-only DSP trackers pyin and yin
+pitch_backend = os.getenv("PITCH_BACKEND", "crepe")
+pitch_backend_names = ("crepe", "pyin", "yin")
+
+# Pitch range searched by the pyin and yin trackers (C2 to C7)
+pitch_fmin = float(os.getenv("PITCH_FMIN", "65.4"))
+pitch_fmax = float(os.getenv("PITCH_FMAX", "2093.0"))
+
+# Number of CREPE frames sent through the model per batch
+pitch_batch_size = int(os.getenv("PITCH_BATCH_SIZE", "256"))
+
+# "gunicorn" serves from SERVER_WORKERS processes, each with its own model;
+# "auto" picks the process count and TensorFlow threads with a startup benchmark
+server_mode = os.getenv("SERVER_MODE", "dev")
+server_workers = os.getenv("SERVER_WORKERS", "auto")
+http_threads = int(os.getenv("HTTP_THREADS", "4"))
+topology_cache = os.getenv("TOPOLOGY_CACHE", "")
+
+# Async jobs, recording sessions, live streams and upload statuses live in the
+# process that created them. "true" keeps those routes and serves from one
+# process; "sticky" allows more when the load balancer pins each client to one
+# worker; "false" turns the routes off so any number of workers is safe
+stateful_routes = os.getenv("STATEFUL_ROUTES", "true").lower()
+
+# Import TensorFlow, CREPE and the heavy librosa submodules in the gunicorn
+# master so forked workers share them; each worker still loads its own model
+server_preload = os.getenv("SERVER_PRELOAD", "true").lower() == "true"
+
+# TensorFlow threads per process; 0 lets TensorFlow use every core
+tf_intra_op_threads = int(os.getenv("TF_INTRA_OP_THREADS", "0"))
+tf_inter_op_threads = int(os.getenv("TF_INTER_OP_THREADS", "0"))
+
+# Pool of workers that run the transcription pipeline, one recording each.
+# 0 runs one per core, or one per process when the server splits the cores
+# between several worker processes
+ml_workers = int(os.getenv("ML_WORKERS", "0"))
+
+# Threads per recording for pitch, onset and tempo analysis; 1 runs them in turn
+stage_workers = int(os.getenv("STAGE_WORKERS", "3"))
+
+# "async" makes /process return a job ID by default instead of waiting
+process_mode = os.getenv("PROCESS_MODE", "sync")
+# Finished jobs kept for polling before the oldest are dropped
+job_history = int(os.getenv("JOB_HISTORY", "1000"))
+
+# Live pitch streams: PCM sample rate clients send, and how much audio may
+# wait for inference before new frames are refused. Each runs a worker
+# thread, so their number is capped and streams without new audio are closed
+stream_sample_rate = int(os.getenv("STREAM_SAMPLE_RATE", "16000"))
+stream_max_buffer_seconds = float(os.getenv("STREAM_MAX_BUFFER_SECONDS", "2"))
+max_live_streams = int(os.getenv("MAX_LIVE_STREAMS", "16"))
+stream_idle_seconds = float(os.getenv("STREAM_IDLE_SECONDS", "60"))
+
+# Recordings being uploaded segment by segment, by session ID. Each holds an
+# ffmpeg process, so their number is capped and idle ones are dropped
+max_recording_sessions = int(os.getenv("MAX_RECORDING_SESSIONS", "32"))
+session_idle_seconds = float(os.getenv("SESSION_IDLE_SECONDS", "300"))
+
+# Results for identical uploads: in-memory LRU plus an optional Mongo tier
+result_cache_size = int(os.getenv("RESULT_CACHE_SIZE", "256"))
+result_cache_persist = os.getenv("RESULT_CACHE_PERSIST", "false").lower() == "true"
+
+# Optional S3-compatible endpoint (e.g. MinIO) instead of AWS
+s3_endpoint_url = os.getenv("S3_ENDPOINT_URL")
+s3_max_pool_connections = int(os.getenv("S3_MAX_POOL_CONNECTIONS", "20"))
+
+# "background" returns the MIDI URL at once and uploads off the request path
+s3_upload_mode = os.getenv("S3_UPLOAD_MODE", "background")
+s3_upload_workers = int(os.getenv("S3_UPLOAD_WORKERS", "2"))
+s3_upload_queue_size = int(os.getenv("S3_UPLOAD_QUEUE_SIZE", "100"))
+s3_upload_retries = int(os.getenv("S3_UPLOAD_RETRIES", "5"))
+s3_upload_backoff = float(os.getenv("S3_UPLOAD_BACKOFF", "0.5"))
+
+# "memory" serializes MIDI into a buffer; "disk" writes it under static/ first
+midi_storage = os.getenv("MIDI_STORAGE", "memory")
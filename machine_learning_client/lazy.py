@@ -0,0 +1,33 @@
+"""Objects that are only created when first used."""
+import threading
+
+
+class LazyObject:
+    """
+    Stand-in for a module or client that is only created on first use.
+    Attribute and item access go to the real object, so callers and tests
+    can use it, or patch its attributes, as if it were the object itself.
+    """
+
+    def __init__(self, factory):
+        self.__dict__.update(_factory=factory, _target=None, _lock=threading.Lock())
+
+    def resolve(self):
+        """Create the real object on the first call and return it."""
+        if self._target is None:
+            with self._lock:
+                if self._target is None:
+                    self.__dict__["_target"] = self._factory()
+        return self._target
+
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self.resolve(), name, value)
+
+    def __delattr__(self, name):
+        delattr(self.resolve(), name)
+
+    def __getitem__(self, key):
+        return self.resolve()[key]
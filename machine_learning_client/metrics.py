@@ -0,0 +1,176 @@
+"""Pipeline metrics, exported in the Prometheus text format on /metrics."""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+
+
+class Histogram:
+    """Cumulative histogram of observed values, with fixed bucket bounds."""
+
+    def __init__(self, buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)):
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+
+    def observe(self, value):
+        """Record one value."""
+        with self.lock:
+            self._counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._sum += value
+
+    def snapshot(self):
+        """Cumulative counts per upper bound, plus the total count and sum."""
+        with self.lock:
+            cumulative = np.cumsum(self._counts).tolist()
+            return {
+                "buckets": dict(zip([*map(str, self.buckets), "+Inf"], cumulative)),
+                "count": cumulative[-1],
+                "sum": self._sum,
+            }
+
+
+class Counter:
+    """Monotonic counter, optionally split by one label value."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, label=None):
+        """Add amount to the count for label."""
+        with self.lock:
+            self._values[label] = self._values.get(label, 0) + amount
+
+    def snapshot(self):
+        """Current count per label."""
+        with self.lock:
+            return dict(self._values)
+
+
+class Gauge:
+    """Value that goes up and down, such as the number of running jobs."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        """Raise the value."""
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        """Lower the value."""
+        self.inc(-amount)
+
+    @contextmanager
+    def track(self):
+        """Count the enclosed block as in flight while it runs."""
+        self.inc()
+        try:
+            yield
+        finally:
+            self.dec()
+
+
+# Time from PCM arriving on a live stream to its note events being ready
+stream_latency = Histogram()
+
+# Pipeline metrics exposed on /metrics
+stage_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+stage_latency = {}
+stage_latency_lock = threading.Lock()
+request_count = Counter()
+error_count = Counter()
+audio_seconds = Counter()
+jobs_in_flight = Gauge()
+vad_frames = Counter()
+
+
+def observe_stage(stage, seconds):
+    """Record how long one run of a pipeline stage took."""
+    with stage_latency_lock:
+        histogram = stage_latency.get(stage)
+        if histogram is None:
+            histogram = stage_latency[stage] = Histogram(stage_buckets)
+    histogram.observe(seconds)
+
+
+@contextmanager
+def stage_timer(stage):
+    """Time the enclosed block into the stage's latency histogram."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+
+def render_histogram(name, snapshot, labels=""):
+    """Prometheus text lines for one histogram snapshot."""
+    prefix = f"{labels}," if labels else ""
+    lines = [
+        f'{name}_bucket{{{prefix}le="{bound}"}} {count}'
+        for bound, count in snapshot["buckets"].items()
+    ]
+    suffix = f"{{{labels}}}" if labels else ""
+    lines.append(f"{name}_sum{suffix} {snapshot['sum']}")
+    lines.append(f"{name}_count{suffix} {snapshot['count']}")
+    return lines
+
+
+def render_counter(name, counter, label_name):
+    """Prometheus text lines for one counter."""
+    return [
+        f'{name}{{{label_name}="{label}"}} {value}' if label else f"{name} {value}"
+        for label, value in sorted(counter.snapshot().items(), key=str)
+    ]
+
+
+def render_metrics(cache_counts):
+    """
+    All pipeline metrics in the Prometheus text exposition format, with the
+    result cache's lookup counts by outcome.
+    """
+    lines = [
+        "# HELP ml_stage_seconds Time spent in each pipeline stage.",
+        "# TYPE ml_stage_seconds histogram",
+    ]
+    with stage_latency_lock:
+        stages = sorted(stage_latency.items())
+    for stage, histogram in stages:
+        lines += render_histogram(
+            "ml_stage_seconds", histogram.snapshot(), f'stage="{stage}"'
+        )
+    lines += [
+        "# HELP ml_requests_total Requests handled, by endpoint.",
+        "# TYPE ml_requests_total counter",
+        *render_counter("ml_requests_total", request_count, "endpoint"),
+        "# HELP ml_errors_total Failed transcriptions, by exception type.",
+        "# TYPE ml_errors_total counter",
+        *render_counter("ml_errors_total", error_count, "type"),
+        "# HELP ml_audio_seconds_total Seconds of audio transcribed.",
+        "# TYPE ml_audio_seconds_total counter",
+        f"ml_audio_seconds_total {audio_seconds.snapshot().get(None, 0)}",
+        "# HELP ml_jobs_in_flight Transcriptions currently running.",
+        "# TYPE ml_jobs_in_flight gauge",
+        f"ml_jobs_in_flight {jobs_in_flight.value}",
+        "# HELP ml_result_cache_total Result cache lookups, by outcome.",
+        "# TYPE ml_result_cache_total counter",
+    ]
+    lines += [
+        f'ml_result_cache_total{{outcome="{outcome}"}} {count}'
+        for outcome, count in cache_counts.items()
+    ]
+    lines += [
+        "# HELP ml_vad_frames_total Pitch frames by voice-activity outcome.",
+        "# TYPE ml_vad_frames_total counter",
+        *render_counter("ml_vad_frames_total", vad_frames, "outcome"),
+        "# HELP ml_stream_latency_seconds Live stream PCM-to-event latency.",
+        "# TYPE ml_stream_latency_seconds histogram",
+        *render_histogram("ml_stream_latency_seconds", stream_latency.snapshot()),
+    ]
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,211 @@
+"""Note smoothing, filtering and MIDI assembly."""
+import io
+import importlib
+import logging
+from functools import partial
+import numpy as np
+
+from machine_learning_client import config, lazy, metrics
+
+
+# pretty_midi takes ~60 ms to import and only MIDI assembly needs it
+pretty_midi = lazy.LazyObject(partial(importlib.import_module, "pretty_midi"))
+
+
+def sort_notes_data(notes_data):
+    """function to sort notes data"""
+    return sorted(notes_data, key=lambda x: x["time"])
+
+
+def process_notes(notes_data):
+    """function to process notes"""
+    with metrics.stage_timer("smoothing"):
+        smoothed_notes = smooth_pitch_data(
+            notes_data, window_size=config.smoothing_window
+        )
+
+    with metrics.stage_timer("note_filter"):
+        return filter_and_combine_notes(smoothed_notes)
+
+
+def midi_to_bytes(filtered_notes, onsets, durations, tempo):
+    """Serialize the MIDI file into an in-memory buffer."""
+    with metrics.stage_timer("midi_write"):
+        buffer = io.BytesIO()
+        build_midi(filtered_notes, onsets, durations, tempo).write(buffer)
+        return buffer.getvalue()
+
+
+def window_bounds(n, window_size):
+    """Start and end of the centered window around each of n frames."""
+    index = np.arange(n)
+    start = np.maximum(index - window_size // 2, 0)
+    end = np.minimum(index + window_size // 2 + 1, n)
+    return start, end
+
+
+def moving_average(values, window_size=5):
+    """
+    Centered moving average that shrinks at the edges. The window is added
+    in order, zero padded, so results are bit-for-bit what sum() over each
+    window slice gives.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    half = window_size // 2
+    start, end = window_bounds(n, window_size)
+
+    padded = np.concatenate([np.zeros(half), values, np.zeros(half)])
+    total = np.zeros(n)
+    for offset in range(2 * half + 1):
+        total += padded[offset : offset + n]
+    return total / np.maximum(end - start, 1)
+
+
+def sliding_mode(values, window_size=5, chunk_elements=1 << 20):
+    """
+    Most frequent value in the centered window around each element. Ties go
+    to the value that appears first in the window. Windows are compared
+    pairwise in chunks of rows, so the (rows, window, window) comparison
+    never holds more than about chunk_elements entries at once.
+    """
+    values = np.asarray(values, dtype=np.int64)
+    n = len(values)
+    if n == 0:
+        return values
+    half = window_size // 2
+    width = 2 * half + 1
+
+    windows = np.lib.stride_tricks.sliding_window_view(np.pad(values, half), width)
+    in_window = np.lib.stride_tricks.sliding_window_view(
+        np.pad(np.ones(n, dtype=bool), half), width
+    )
+
+    modes = np.empty(n, dtype=np.int64)
+    rows = max(1, chunk_elements // (width * width))
+    for start in range(0, n, rows):
+        block = windows[start : start + rows]
+        valid = in_window[start : start + rows]
+        # How often each slot's value occurs in its window; padding never wins
+        counts = ((block[:, :, None] == block[:, None, :]) & valid[:, None, :]).sum(
+            axis=2
+        )
+        counts[~valid] = -1
+        # argmax picks the first slot holding a most frequent value
+        modes[start : start + len(block)] = block[
+            np.arange(len(block)), np.argmax(counts, axis=1)
+        ]
+    return modes
+
+
+def smooth_note_numbers(note_numbers, times, window_size=5):
+    """Smooth integer note numbers with a mode filter and average their times."""
+    return moving_average(times, window_size), sliding_mode(note_numbers, window_size)
+
+
+def smooth_pitch_data(notes_data, window_size=5):
+    """smoothing pitch data."""
+    notes = [note["note"] for note in notes_data]
+    names = list(dict.fromkeys(notes))
+    code_of = {name: code for code, name in enumerate(names)}
+
+    avg_times, avg_codes = smooth_note_numbers(
+        [code_of[note] for note in notes],
+        [note["time"] for note in notes_data],
+        window_size=window_size,
+    )
+    return [
+        {"time": avg_time, "note": names[code]}
+        for avg_time, code in zip(avg_times.tolist(), avg_codes.tolist())
+    ]
+
+
+def filter_and_combine_notes(notes_data):
+    """
+    Combine consecutive frames of the same note into segments that keep
+    the times of their first and last frames.
+    """
+    filtered_notes = []
+    for note in notes_data:
+        if filtered_notes and filtered_notes[-1]["note"] == note["note"]:
+            filtered_notes[-1]["end_time"] = note["time"]
+        else:
+            filtered_notes.append(
+                {
+                    "note": note["note"],
+                    "start_time": note["time"],
+                    "end_time": note["time"],
+                }
+            )
+
+    logging.info("Filtered notes: %s", filtered_notes)
+    return filtered_notes
+
+
+def build_midi(filtered_notes, onsets, durations, tempo):
+    """
+    Build the PrettyMIDI object for the notes without writing it anywhere.
+    """
+    logging.info("Received notes for MIDI creation: %s", filtered_notes)
+    logging.info("Starting to create MIDI file.")
+    if tempo <= 0:
+        logging.warning("Invalid tempo detected. Setting default tempo.")
+        tempo = 120
+    midi_data = pretty_midi.PrettyMIDI(initial_tempo=tempo)
+    instrument = create_midi_instrument(filtered_notes, onsets, durations)
+    midi_data.instruments.append(instrument)
+    return midi_data
+
+
+def assemble_note_events(filtered_notes, onsets, durations):
+    """
+    Give each onset the pitch of the note segment that overlaps its note
+    the most, matching by time rather than position. Segments are ordered
+    and don't overlap, so their starts and ends are both sorted and the
+    candidates for each note are found by binary search. Onsets with no
+    sung pitch under them are left out.
+    """
+    starts = np.array([note["start_time"] for note in filtered_notes], dtype=float)
+    ends = np.array([note["end_time"] for note in filtered_notes], dtype=float)
+    onsets = np.asarray(onsets, dtype=float)
+    note_ends = onsets + np.asarray(durations, dtype=float)
+    # Segments [first, last) end at or after the onset and start by the note end
+    first = np.searchsorted(ends, onsets, side="left")
+    last = np.searchsorted(starts, note_ends, side="right")
+
+    events = []
+    for onset, note_end, lo, hi in zip(onsets, note_ends, first, last):
+        if lo >= hi:
+            logging.info("No pitch found for onset at %s", onset)
+            continue
+        overlap = np.minimum(ends[lo:hi], note_end) - np.maximum(starts[lo:hi], onset)
+        best = lo + int(np.argmax(overlap))
+        events.append(
+            {
+                "note": filtered_notes[best]["note"],
+                "start_time": float(onset),
+                "end_time": float(note_end),
+            }
+        )
+    return events
+
+
+def create_midi_instrument(filtered_notes, onsets, durations):
+    """
+    Create a MIDI instrument and add notes to it.
+    """
+    instrument_program = pretty_midi.instrument_name_to_program("Acoustic Grand Piano")
+    instrument = pretty_midi.Instrument(program=instrument_program)
+    for event in assemble_note_events(filtered_notes, onsets, durations):
+        logging.info("Adding note: %s", event)
+        note_number = pretty_midi.note_name_to_number(event["note"])
+
+        # Create and append the note
+        note = pretty_midi.Note(
+            velocity=100,
+            pitch=note_number,
+            start=event["start_time"],
+            end=event["end_time"],
+        )
+        instrument.notes.append(note)
+    return instrument
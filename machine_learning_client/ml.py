@@ -1,120 +1,74 @@
 """Module for the machine learning client."""
-import subprocess
 import os
+import io
+import hashlib
+import json
+import queue
 import logging
+import tempfile
+import threading
+import time
 import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from datetime import datetime
-import librosa
-from dotenv import load_dotenv
-
-# import io (commented out because import is unused currently)
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
-import crepe
-import pretty_midi
-import soundfile as sf
 import numpy as np
-import boto3
-from botocore.exceptions import NoCredentialsError
 from pymongo import MongoClient
+from pymongo.errors import PyMongoError
 from bson import ObjectId
 from werkzeug.exceptions import BadRequest
 
-app = Flask(__name__)
+from machine_learning_client import (
+    audio,
+    config,
+    lazy,
+    metrics,
+    midi,
+    pitch,
+    rhythm,
+    sessions,
+    streaming,
+    uploads,
+)
 
-load_dotenv()
+
+app = Flask(__name__)
 
 logging.basicConfig(level=logging.INFO)
 
 CORS(app)
 
-aws_access_key_id = os.getenv("AWS_ACCESS_KEY_ID")
-aws_secret_access_key = os.getenv("AWS_SECRET_ACCESS_KEY")
-s3_bucket_name = os.getenv("S3_BUCKET_NAME")
-
-host = os.getenv("HOST", "localhost")
-
-s3 = boto3.client(
-    "s3",
-    aws_access_key_id=aws_access_key_id,
-    aws_secret_access_key=aws_secret_access_key,
-)
-
-# Connect to MongoDB
-client = MongoClient("db", 27017)
-db = client["database"]
-collection = db["midis"]
-
-
-def frequency_to_note_name(frequency):
-    """Convert a frequency in Hertz to a musical note name."""
-    if frequency <= 0:
-        return None
-    frequency = float(frequency)
-    note_number = pretty_midi.hz_to_note_number(frequency)
 
-    return pretty_midi.note_number_to_name(int(note_number))
+def pipeline_workers():
+    """Recordings transcribed in parallel: ML_WORKERS, or one per core."""
+    return config.ml_workers or os.cpu_count() or 1
 
 
-def convert_webm_to_wav(webm_file, wav_file):
-    """Convert WebM audio file to WAV format."""
-    result = subprocess.run(
-        ["ffmpeg", "-i", webm_file, wav_file],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        check=False,
+# Built on first use, once serving.serve has settled the number of ML workers
+worker_pool = lazy.LazyObject(
+    lambda: ThreadPoolExecutor(max_workers=pipeline_workers(), thread_name_prefix="ml")
+)
+stage_pool = lazy.LazyObject(
+    lambda: ThreadPoolExecutor(
+        max_workers=max(1, config.stage_workers) * pipeline_workers(),
+        thread_name_prefix="stage",
     )
-    if result.returncode != 0:
-        print("ffmpeg error:", result.stderr.decode())
-        raise ValueError("Error converting WebM to WAV")
-
-
-def process_audio_chunks(audio, sr):
-    """Process audio data in chunks and return notes data."""
-    confidence_threshold = 0.74
-    chunk_size = 1024 * 10
-    notes_data = []
-
-    for start in range(0, len(audio), chunk_size):
-        audio_chunk = audio[start : (start + chunk_size)]
-        time, frequency, confidence, _ = crepe.predict(audio_chunk, sr, viterbi=True)
-
-        for t, f, c in zip(time, frequency, confidence):
-            if c >= confidence_threshold:
-                note_name = frequency_to_note_name(f)
-                notes_data.append(
-                    {
-                        "time": float(t),
-                        "note": note_name,
-                        "confidence": round(float(c), 2),
-                    }
-                )
-    print(notes_data)
-    return notes_data
-
-
-def clean_up_files(webm_file, wav_file):
-    """Remove temporary audio files."""
-    os.remove(webm_file)
-    os.remove(wav_file)
-
-
-def write_audio_to_file(file_name, audio_stream):
-    """function to write audio to file"""
-    with open(file_name, "wb") as file:
-        file.write(audio_stream.read())
-
-
-def sort_notes_data(notes_data):
-    """function to sort notes data"""
-    return sorted(notes_data, key=lambda x: x["time"])
-
+)
+jobs = OrderedDict()
+jobs_lock = threading.Lock()
+result_cache = OrderedDict()
+result_cache_lock = threading.Lock()
+result_cache_stats = {"hits": 0, "persistent_hits": 0, "misses": 0}
 
-def process_notes(notes_data):
-    """function to process notes"""
-    smoothed_notes = smooth_pitch_data(notes_data)
 
-    return filter_and_combine_notes(smoothed_notes)
+# Connect to MongoDB on first use, after any fork, as pymongo is not fork-safe
+client = lazy.LazyObject(partial(MongoClient, "db", 27017))
+db = lazy.LazyObject(lambda: client["database"])
+collection = lazy.LazyObject(lambda: db["midis"])
+cache_collection = lazy.LazyObject(lambda: db["result_cache"])
 
 
 def generate_midi_url(filtrd_comb_notes, onsets, drtns, tempo):
@@ -123,38 +77,83 @@ def generate_midi_url(filtrd_comb_notes, onsets, drtns, tempo):
         filtrd_comb_notes, onsets, drtns, tempo, output_file="output.mid"
     )
     # drtns = durations; had to edit because of pylint 0_0
-    midi_url = f"http://{host}:5002/static/{midi_filename}"
+    midi_url = f"http://{config.host}:5002/static/{midi_filename}"
 
     return midi_url
 
 
-def create_and_store_midi_in_s3(filtrd_comb_notes, onsets, drtns, tempo):
+def create_and_store_midi_in_s3(
+    filtrd_comb_notes, onsets, drtns, tempo, on_stored=None
+):
     """Function to generate midi url after uploading to AWS S3."""
     unique_id = str(uuid.uuid4())
     midi_filename = f"output_{unique_id}.mid"
     create_midi(filtrd_comb_notes, onsets, drtns, tempo, output_file=midi_filename)
 
     try:
-        local_midi_file_path = f"static/{midi_filename}"
-
-        s3.upload_file(local_midi_file_path, s3_bucket_name, midi_filename)
+        local_midi_file_path = os.path.join(app.root_path, "static", midi_filename)
+
+        uploads.retry_upload(
+            midi_filename,
+            partial(
+                uploads.s3.upload_file,
+                local_midi_file_path,
+                config.s3_bucket_name,
+                midi_filename,
+            ),
+        )
 
-        midi_url = f"https://{s3_bucket_name}.s3.amazonaws.com/{midi_filename}"
+        midi_url = f"https://{config.s3_bucket_name}.s3.amazonaws.com/{midi_filename}"
         if os.path.exists(local_midi_file_path):
             os.remove(local_midi_file_path)
             print(f"Successfully deleted local file: {local_midi_file_path}")
         else:
             print(f"Local file not found for deletion: {local_midi_file_path}")
 
+        if on_stored is not None:
+            on_stored(midi_url)
         return midi_url
     except FileNotFoundError:
         print("The MIDI file was not found")
         raise
-    except NoCredentialsError:
+    except uploads.botocore_exceptions.NoCredentialsError:
         print("AWS credentials not available")
         raise
 
 
+def render_midi(filtrd_comb_notes, onsets, drtns, tempo):
+    """Return the MIDI file as bytes, going through static/ in "disk" mode."""
+    if config.midi_storage != "disk":
+        return midi.midi_to_bytes(filtrd_comb_notes, onsets, drtns, tempo)
+
+    midi_filename = create_midi(
+        filtrd_comb_notes,
+        onsets,
+        drtns,
+        tempo,
+        output_file=f"output_{uuid.uuid4()}.mid",
+    )
+    local_midi_file_path = os.path.join(app.root_path, "static", midi_filename)
+    with open(local_midi_file_path, "rb") as file:
+        data = file.read()
+    os.remove(local_midi_file_path)
+    return data
+
+
+def store_midi(filtrd_comb_notes, onsets, drtns, tempo, on_stored=None):
+    """
+    Store the MIDI file in S3 using the configured upload and storage modes.
+    on_stored is called with the URL once the file is actually in S3.
+    """
+    if config.s3_upload_mode != "background" and config.midi_storage == "disk":
+        return create_and_store_midi_in_s3(
+            filtrd_comb_notes, onsets, drtns, tempo, on_stored=on_stored
+        )
+    return uploads.store_midi_bytes(
+        render_midi(filtrd_comb_notes, onsets, drtns, tempo), on_stored=on_stored
+    )
+
+
 def store_in_db(user_id, username, midi_url):
     """Function to save to the database."""
     if not username:
@@ -171,10 +170,462 @@ def store_in_db(user_id, username, midi_url):
         "created_at": datetime.utcnow(),  # Store the current UTC time
     }
 
-    collection.insert_one(data)
+    with metrics.stage_timer("mongo_insert"):
+        collection.insert_one(data)
     logging.info("Inserted file by: %s", username)
 
 
+def finish_recording_session(recording):
+    """Complete the transcription of a segmented recording."""
+    times, frequency, confidence = recording.finish()
+    notes_data = pitch.pitch_to_notes_data(
+        times, frequency, confidence, confidence_threshold=config.min_confidence
+    )
+    audio_ctx = audio.AudioContext(recording.audio, recording.sr)
+    with metrics.jobs_in_flight.track():
+        return complete_transcription(audio_ctx, notes_data)
+
+
+def result_cache_key(audio_bytes, backend=None):
+    """Hash of the upload plus every setting that changes the transcription."""
+    digest = hashlib.sha256(audio_bytes)
+    settings = (
+        backend or config.pitch_backend,
+        (
+            config.vad_enabled,
+            config.vad_threshold_db,
+            config.vad_floor_db,
+            config.vad_padding_ms,
+        ),
+        (
+            config.pitch_step_size,
+            config.pitch_step_mode,
+            config.pitch_coarse_step,
+            config.pitch_change_cents,
+        ),
+        config.min_confidence,
+        config.crepe_model_capacity,
+        # File mode keeps the source rate and channels, pipe mode does not
+        (config.decode_mode, config.decode_sample_rate),
+        config.analysis_sample_rate,
+        (config.pitch_fmin, config.pitch_fmax),
+        (
+            config.analysis_mode,
+            config.stream_block_seconds,
+            config.viterbi_window_seconds,
+        ),
+        config.smoothing_window,
+    )
+    digest.update(repr(settings).encode())
+    return digest.hexdigest()
+
+
+def remember_result(key, midi_url):
+    """Put a result in the in-memory LRU, evicting the least recently used."""
+    with result_cache_lock:
+        result_cache[key] = midi_url
+        result_cache.move_to_end(key)
+        while len(result_cache) > config.result_cache_size:
+            result_cache.popitem(last=False)
+
+
+def lookup_cached_result(key):
+    """
+    Return the cached MIDI URL for a key, or None on a miss. A URL whose
+    upload has since failed counts as a miss, so the upload is tried again.
+    """
+    outcome = "hits"
+    with result_cache_lock:
+        midi_url = result_cache.get(key)
+        if midi_url is not None:
+            result_cache.move_to_end(key)
+
+    if midi_url is None and config.result_cache_persist:
+        outcome = "persistent_hits"
+        try:
+            doc = cache_collection.find_one({"_id": key})
+        except PyMongoError as e:
+            logging.error("Result cache lookup failed: %s", e)
+            doc = None
+        if doc:
+            midi_url = doc["midi_url"]
+            remember_result(key, midi_url)
+
+    if midi_url is not None and upload_failed(midi_url):
+        logging.warning("Cached %s never reached S3, transcribing again", midi_url)
+        with result_cache_lock:
+            result_cache.pop(key, None)
+        midi_url = None
+
+    with result_cache_lock:
+        result_cache_stats[outcome if midi_url is not None else "misses"] += 1
+    return midi_url
+
+
+def upload_failed(midi_url):
+    """True when this process gave up uploading the object at midi_url."""
+    status = uploads.get_upload_status(midi_url.rsplit("/", 1)[-1])
+    return status is not None and status["status"] == "failed"
+
+
+def store_cached_result(key, midi_url):
+    """Save a result in memory and, if enabled, in Mongo."""
+    remember_result(key, midi_url)
+    if config.result_cache_persist:
+        try:
+            cache_collection.update_one(
+                {"_id": key},
+                {"$set": {"midi_url": midi_url, "created_at": datetime.utcnow()}},
+                upsert=True,
+            )
+        except PyMongoError as e:
+            logging.error("Result cache store failed: %s", e)
+
+
+def create_job():
+    """Register a queued job and return its ID."""
+    job_id = uuid.uuid4().hex
+    with jobs_lock:
+        jobs[job_id] = {
+            "job_id": job_id,
+            "status": "queued",
+            "stage": None,
+            "midi_url": None,
+            "error": None,
+        }
+        while len(jobs) > config.job_history:
+            jobs.popitem(last=False)
+    return job_id
+
+
+def update_job(job_id, **fields):
+    """Update a job's fields; does nothing for synchronous requests."""
+    if job_id is None:
+        return
+    with jobs_lock:
+        if job_id in jobs:
+            jobs[job_id].update(fields)
+
+
+def get_job(job_id):
+    """Return a copy of a job's state, or None if it is unknown."""
+    with jobs_lock:
+        job = jobs.get(job_id)
+        return dict(job) if job else None
+
+
+def run_job(job_id, audio_bytes, user_id, backend=None):
+    """Worker entry point for asynchronous /process requests."""
+    update_job(job_id, status="running")
+    midi_url = transcribe_audio(audio_bytes, job_id=job_id, backend=backend)
+    if user_id:
+        update_job(job_id, stage="store")
+        store_in_db(user_id, find_username(user_id), midi_url)
+    return midi_url
+
+
+def finish_job(job_id, future):
+    """Record the outcome of a finished job."""
+    error = future.exception()
+    if error is not None:
+        logging.error("Job %s failed: %s", job_id, error)
+        metrics.error_count.inc(label=type(error).__name__)
+        update_job(job_id, status="failed", error=str(error))
+    else:
+        update_job(job_id, status="done", stage="done", midi_url=future.result())
+
+
+def transcribe_audio(audio_bytes, job_id=None, backend=None):
+    """
+    Run the full pipeline on one uploaded recording and return its MIDI URL.
+    Uses no shared files, so several recordings can run at the same time.
+    """
+    # Identical uploads with identical settings reuse the earlier MIDI file
+    cache_key = result_cache_key(audio_bytes, backend=backend)
+    midi_url = lookup_cached_result(cache_key)
+    if midi_url is not None:
+        logging.info("Result cache hit: %s", midi_url)
+        return midi_url
+
+    # The result is only cached once the MIDI file has reached S3
+    return store_midi(
+        *analyze_upload(audio_bytes, job_id=job_id, backend=backend),
+        on_stored=partial(store_cached_result, cache_key),
+    )
+
+
+def transcribe_audio_to_midi(audio_bytes, backend=None):
+    """Run the full pipeline on one recording and return the MIDI file bytes."""
+    return midi.midi_to_bytes(*analyze_upload(audio_bytes, backend=backend))
+
+
+def analyze_upload(audio_bytes, job_id=None, backend=None):
+    """Decode an upload and return the notes, onsets, durations and tempo."""
+    with metrics.jobs_in_flight.track():
+        # Decode once and share the buffer across every analysis stage
+        timings = {}
+        update_job(job_id, stage="decode")
+        if config.analysis_mode == "stream":
+            with tempfile.TemporaryDirectory(prefix="ml-request-") as workspace:
+                wav_file = os.path.join(workspace, "recording.wav")
+                timed_stage(
+                    timings,
+                    "decode",
+                    audio.decode_webm_to_wav,
+                    audio_bytes,
+                    wav_file,
+                    sr=config.decode_sample_rate,
+                )
+                return analyze_stream(
+                    audio.AudioFile(wav_file),
+                    job_id=job_id,
+                    backend=backend,
+                    timings=timings,
+                )
+
+        audio_ctx = timed_stage(
+            timings, "decode", audio.decode_upload, io.BytesIO(audio_bytes)
+        )
+
+        return analyze_transcription(
+            audio_ctx, job_id=job_id, backend=backend, timings=timings
+        )
+
+
+def complete_transcription(audio_ctx, notes_data, job_id=None):
+    """Turn decoded audio and its detected notes into a stored MIDI file URL."""
+    return store_midi(*analyze_transcription(audio_ctx, notes_data, job_id=job_id))
+
+
+def timed_stage(timings, name, func, *args, **kwargs):
+    """Call one pipeline stage and record how long it took in seconds."""
+    start = time.perf_counter()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        seconds = time.perf_counter() - start
+        timings[name] = round(seconds, 4)
+        metrics.observe_stage(name, seconds)
+
+
+def run_stages(stages, timings):
+    """
+    Run independent stages side by side on the stage pool and wait for all
+    of them. TensorFlow and librosa's numerical code release the GIL, so the
+    threads really do use separate cores. Returns each result by name.
+    """
+    if config.stage_workers <= 1:
+        return {name: timed_stage(timings, name, func) for name, func in stages.items()}
+    futures = {
+        name: stage_pool.submit(timed_stage, timings, name, func)
+        for name, func in stages.items()
+    }
+    return {name: future.result() for name, future in futures.items()}
+
+
+def analyze_transcription(
+    audio_ctx, notes_data=None, job_id=None, backend=None, timings=None
+):
+    """
+    Return the notes, onsets, durations and tempo for the MIDI file.
+    Pitch tracking (unless notes_data is given), onset detection and tempo
+    estimation only need the decoded audio, so they run concurrently.
+    """
+    timings = {} if timings is None else timings
+    metrics.audio_seconds.inc(audio_ctx.duration)
+    stages = {}
+    if notes_data is None:
+        stages["pitch"] = partial(
+            pitch.process_audio_chunks, audio_ctx, backend=backend
+        )
+    stages["onsets"] = partial(
+        rhythm.detect_note_onsets, audio_ctx, sr=config.analysis_sample_rate
+    )
+    stages["tempo"] = partial(
+        rhythm.estimate_tempo, audio_ctx, sr=config.analysis_sample_rate
+    )
+
+    update_job(job_id, stage="analysis")
+    results = timed_stage(timings, "analysis", run_stages, stages, timings)
+    notes_data = results.get("pitch", notes_data)
+    onsets = results["onsets"]
+
+    notes_data_sorted = midi.sort_notes_data(notes_data)
+    logging.info("Chunked notes data for jsonify: %s", notes_data_sorted)
+
+    # Estimate note durations once the onsets are known
+    update_job(job_id, stage="durations")
+    durations = timed_stage(
+        timings,
+        "durations",
+        rhythm.estimate_note_durations,
+        onsets,
+        audio_ctx,
+        sr=config.analysis_sample_rate,
+    )
+
+    update_job(job_id, stage="midi")
+    notes = timed_stage(timings, "notes", midi.process_notes, notes_data)
+
+    logging.info("Stage timings: %s", timings)
+    update_job(job_id, timings=timings)
+    return notes, onsets, durations, results["tempo"]
+
+
+def analyze_stream(audio_file, job_id=None, backend=None, timings=None):
+    """
+    analyze_transcription for an AudioFile. Every stage reads the file block
+    by block, so memory does not grow with the length of the recording.
+    """
+    timings = {} if timings is None else timings
+    metrics.audio_seconds.inc(audio_file.duration)
+    stages = {
+        "pitch": partial(streaming.stream_audio_notes, audio_file, backend=backend),
+        "rhythm": partial(
+            streaming.stream_onsets_and_tempo,
+            audio_file,
+            sr=config.analysis_sample_rate,
+        ),
+        "envelope": partial(
+            streaming.stream_amplitude_envelope,
+            audio_file,
+            sr=config.analysis_sample_rate,
+        ),
+    }
+
+    update_job(job_id, stage="analysis")
+    results = timed_stage(timings, "analysis", run_stages, stages, timings)
+    onsets, tempo = results["rhythm"]
+
+    update_job(job_id, stage="durations")
+    durations = timed_stage(
+        timings,
+        "durations",
+        rhythm.durations_from_envelope,
+        onsets,
+        *results["envelope"],
+        sr=config.analysis_sample_rate,
+    )
+
+    update_job(job_id, stage="midi")
+    notes = timed_stage(timings, "notes", midi.process_notes, results["pitch"])
+
+    logging.info("Stage timings: %s", timings)
+    update_job(job_id, timings=timings)
+    return notes, onsets, durations, tempo
+
+
+@app.before_request
+def count_request():
+    """Count every request by the endpoint that handles it."""
+    metrics.request_count.inc(label=request.endpoint or "unknown")
+
+
+# Endpoints whose follow-up requests must reach the process that served the first
+stateful_endpoints = frozenset(
+    {
+        "job_status",
+        "create_recording_session",
+        "add_recording_segment",
+        "discard_recording_session",
+        "finish_recording",
+        "create_live_stream",
+        "push_live_frames",
+        "close_live_stream",
+        "live_stream_events",
+        "upload_status",
+    }
+)
+
+
+@app.before_request
+def refuse_stateful_routes():
+    """Refuse per-process routes and async jobs when STATEFUL_ROUTES=false."""
+    if config.stateful_routes != "false":
+        return None
+    if request.endpoint in stateful_endpoints:
+        return jsonify({"error": "Not available with STATEFUL_ROUTES=false"}), 404
+    if (
+        request.endpoint == "process_data"
+        and request.values.get("mode", config.process_mode) == "async"
+    ):
+        return jsonify({"error": "Async jobs need STATEFUL_ROUTES"}), 400
+    return None
+
+
+@app.teardown_request
+def count_unhandled_error(error):
+    """Count exceptions that escaped a route, by type."""
+    if error is not None:
+        metrics.error_count.inc(label=type(error).__name__)
+
+
+@app.route("/metrics", endpoint="metrics")
+def export_metrics():
+    """Route exposing pipeline metrics in Prometheus text format."""
+    with result_cache_lock:
+        cache_counts = dict(result_cache_stats)
+    return Response(
+        metrics.render_metrics(cache_counts), mimetype="text/plain; version=0.0.4"
+    )
+
+
+@app.route("/ready")
+def ready():
+    """Readiness probe: 200 once the pitch model is loaded and warmed up."""
+    if not pitch.model_ready.is_set():
+        return jsonify({"status": "loading"}), 503
+    return jsonify({"status": "ready", "model_capacity": config.crepe_model_capacity})
+
+
+@app.route("/cache/stats")
+def cache_stats():
+    """Route exposing result cache hit and miss counters."""
+    with result_cache_lock:
+        return jsonify(dict(result_cache_stats, size=len(result_cache)))
+
+
+def wants_inline_midi():
+    """True when the client asked for the MIDI file in the response body."""
+    if request.values.get("response") == "midi":
+        return True
+    return request.accept_mimetypes.best == "audio/midi"
+
+
+def transcribe_and_respond(audio_bytes, user_id, backend):
+    """Run the pipeline on the worker pool and build the /process response."""
+    # Return the MIDI file itself instead of a URL when asked for it
+    if wants_inline_midi():
+        midi_bytes = worker_pool.submit(
+            transcribe_audio_to_midi, audio_bytes, backend=backend
+        ).result()
+        if user_id:
+            store_in_db(
+                user_id, find_username(user_id), uploads.store_midi_bytes(midi_bytes)
+            )
+        return Response(
+            midi_bytes,
+            mimetype="audio/midi",
+            headers={"Content-Disposition": "inline; filename=transcription.mid"},
+        )
+
+    # Run the pipeline on the worker pool and wait for its result
+    midi_url = worker_pool.submit(
+        transcribe_audio, audio_bytes, backend=backend
+    ).result()
+
+    # logging.info("MIDI URL generated:", {midi_url})
+
+    if midi_url is None:
+        app.logger.error("Failed to generate or store MIDI file in S3")
+        return jsonify({"error": "MIDI generation failed"}), 500
+
+    if user_id:
+        store_in_db(user_id, find_username(user_id), midi_url)
+
+    return jsonify({"midi_url": midi_url})
+
+
 @app.route("/process", methods=["POST"])
 def process_data():
     """Route to process the data."""
@@ -194,63 +645,223 @@ def process_data():
         if file.content_type != "audio/webm":
             return jsonify({"error": "Unsupported Media Type"}), 415
 
-        webm_file = "temp_recording.webm"
-        wav_file = "temp_recording.wav"
+        # Pitch tracker for this request, defaulting to the deployment's
+        backend = request.values.get("pitch_backend", config.pitch_backend)
+        if backend not in config.pitch_backend_names:
+            return jsonify({"error": f"Unknown pitch backend: {backend}"}), 400
 
-        # Write audio to file and convert formats
-        write_audio_to_file(webm_file, request.files["audio"])
-        convert_webm_to_wav(webm_file, wav_file)
+        with metrics.stage_timer("upload"):
+            audio_bytes = file.read()
 
-        # Process audio chunks to get notes data
-        audio, sr = sf.read(wav_file)
-        notes_data = process_audio_chunks(audio, sr)
-        notes_data_sorted = sort_notes_data(notes_data)
-        logging.info("Chunked notes data for jsonify: %s", notes_data_sorted)
+        # Asynchronous mode: queue the job and let the client poll for it
+        if request.values.get("mode", config.process_mode) == "async":
+            job_id = create_job()
+            future = worker_pool.submit(
+                run_job, job_id, audio_bytes, request.form.get("user_id"), backend
+            )
+            future.add_done_callback(lambda done: finish_job(job_id, done))
+            return (
+                jsonify({"job_id": job_id, "status_url": f"/jobs/{job_id}"}),
+                202,
+            )
 
-        # Further processing on notes data
-        # filtered_and_combined_notes = process_notes(notes_data)
+        return transcribe_and_respond(audio_bytes, user_id, backend)
+        # store file in database, grab from there and show.
 
-        # Load the audio file first to get y and sr
-        y, sr = librosa.load(wav_file, sr=44100)
+    except IOError as e:
+        app.logger.error("IO error occurred: %s", e)
+        metrics.error_count.inc(label=type(e).__name__)
+        return jsonify({"error": str(e)}), 500
+    except ValueError as e:
+        app.logger.error("Value error occurred: %s", e)
+        metrics.error_count.inc(label=type(e).__name__)
+        return jsonify({"error": str(e)}), 500
 
-        # Detect onsets
-        onsets = detect_note_onsets(wav_file)
 
-        # Estimate note durations
-        durations = estimate_note_durations(onsets, y, sr=44100)
+@app.route("/sessions", methods=["POST"])
+def create_recording_session():
+    """Route to start a recording that will be uploaded in segments."""
+    sessions.start_idle_reaper()
+    session_id = uuid.uuid4().hex
+    with sessions.recording_sessions_lock:
+        if len(sessions.recording_sessions) >= config.max_recording_sessions:
+            response = jsonify({"error": "Too many open recording sessions"})
+            response.headers["Retry-After"] = "5"
+            return response, 503
+        sessions.recording_sessions[session_id] = sessions.RecordingSession(
+            sr=config.decode_sample_rate
+        )
+    return jsonify({"session_id": session_id}), 201
 
-        # Estimate tempo
-        tempo = estimate_tempo(wav_file)
 
-        # Clean up temporary files
-        clean_up_files(webm_file, wav_file)
+@app.route("/sessions/<session_id>/segments", methods=["POST"])
+def add_recording_segment(session_id):
+    """Route to upload the next WebM or raw float32 PCM segment of a recording."""
+    with sessions.recording_sessions_lock:
+        recording = sessions.recording_sessions.get(session_id)
+    if recording is None:
+        return jsonify({"error": "Session not found"}), 404
+    if "audio" not in request.files:
+        return jsonify({"error": "No audio file found in the request"}), 400
 
-        # midi_url = generate_midi_url(
-        #     filtered_and_combined_notes, onsets, durations, tempo
-        # )
+    file = request.files["audio"]
+    try:
+        # mimetype drops parameters such as MediaRecorder's ";codecs=opus"
+        if file.mimetype == "audio/webm":
+            worker_pool.submit(recording.add_webm, file.read()).result()
+        elif file.mimetype == "audio/pcm":
+            samples = np.frombuffer(file.read(), dtype=np.float32)
+            worker_pool.submit(recording.add_pcm, samples).result()
+        else:
+            return jsonify({"error": "Unsupported Media Type"}), 415
+    except (IOError, ValueError) as e:
+        app.logger.error("Segment error occurred: %s", e)
+        return jsonify({"error": str(e)}), 500
 
-        midi_url = create_and_store_midi_in_s3(
-            process_notes(notes_data), onsets, durations, tempo
-        )
+    return jsonify(
+        {
+            "session_id": session_id,
+            "seconds": recording.duration,
+            "frames": recording.frames_done,
+        }
+    )
 
-        # logging.info("MIDI URL generated:", {midi_url})
 
-        if midi_url is None:
-            app.logger.error("Failed to generate or store MIDI file in S3")
-            return jsonify({"error": "MIDI generation failed"}), 500
+@app.route("/sessions/<session_id>", methods=["DELETE"])
+def discard_recording_session(session_id):
+    """Route to drop a recording session, and its ffmpeg process, unfinished."""
+    with sessions.recording_sessions_lock:
+        recording = sessions.recording_sessions.pop(session_id, None)
+    if recording is None:
+        return jsonify({"error": "Session not found"}), 404
+    recording.close()
+    return jsonify({"session_id": session_id, "status": "discarded"})
 
-        if user_id:
-            store_in_db(user_id, find_username(user_id), midi_url)
 
-        return jsonify({"midi_url": midi_url})
-        # store file in database, grab from there and show.
+@app.route("/sessions/<session_id>/finish", methods=["POST"])
+def finish_recording(session_id):
+    """Route to finish a segmented recording and get its MIDI URL."""
+    with sessions.recording_sessions_lock:
+        recording = sessions.recording_sessions.pop(session_id, None)
+    if recording is None:
+        return jsonify({"error": "Session not found"}), 404
 
-    except IOError as e:
-        app.logger.error("IO error occurred: %s", e)
+    try:
+        midi_url = worker_pool.submit(finish_recording_session, recording).result()
+    except (IOError, ValueError) as e:
+        app.logger.error("Session error occurred: %s", e)
         return jsonify({"error": str(e)}), 500
+
+    user_id = request.form.get("user_id")
+    if user_id:
+        store_in_db(user_id, find_username(user_id), midi_url)
+    return jsonify({"midi_url": midi_url})
+
+
+@app.route("/streams", methods=["POST"])
+def create_live_stream():
+    """Route to open a live pitch stream for raw float32 PCM frames."""
+    sessions.start_idle_reaper()
+    stream_id = uuid.uuid4().hex
+    with sessions.live_streams_lock:
+        if len(sessions.live_streams) >= config.max_live_streams:
+            response = jsonify({"error": "Too many open live streams"})
+            response.headers["Retry-After"] = "5"
+            return response, 503
+        sessions.live_streams[stream_id] = sessions.LivePitchStream(
+            sr=config.stream_sample_rate,
+            max_buffer_seconds=config.stream_max_buffer_seconds,
+        )
+    return (
+        jsonify({"stream_id": stream_id, "sample_rate": config.stream_sample_rate}),
+        201,
+    )
+
+
+@app.route("/streams/<stream_id>/frames", methods=["POST"])
+def push_live_frames(stream_id):
+    """Route to push PCM frames; answers 429 when inference is falling behind."""
+    with sessions.live_streams_lock:
+        stream = sessions.live_streams.get(stream_id)
+    if stream is None:
+        return jsonify({"error": "Stream not found"}), 404
+
+    try:
+        accepted = stream.push(np.frombuffer(request.get_data(), dtype=np.float32))
     except ValueError as e:
-        app.logger.error("Value error occurred: %s", e)
-        return jsonify({"error": str(e)}), 500
+        return jsonify({"error": str(e)}), 409
+    if not accepted:
+        response = jsonify(
+            {"error": "Stream buffer full", "pending": stream.pending_samples}
+        )
+        response.headers["Retry-After"] = "1"
+        return response, 429
+    return jsonify({"pending": stream.pending_samples}), 202
+
+
+@app.route("/streams/<stream_id>/close", methods=["POST"])
+def close_live_stream(stream_id):
+    """Route to end a live stream once the client stops sending audio."""
+    with sessions.live_streams_lock:
+        stream = sessions.live_streams.get(stream_id)
+    if stream is None:
+        return jsonify({"error": "Stream not found"}), 404
+    stream.close()
+    return jsonify({"stream_id": stream_id, "status": "closing"})
+
+
+@app.route("/streams/<stream_id>/events")
+def live_stream_events(stream_id):
+    """Server-sent events with each detected note, ending when the stream closes."""
+    with sessions.live_streams_lock:
+        stream = sessions.live_streams.get(stream_id)
+    if stream is None:
+        return jsonify({"error": "Stream not found"}), 404
+
+    def generate():
+        # Also runs when the client disconnects (GeneratorExit), so a stream
+        # nobody listens to any more does not keep its worker thread
+        try:
+            while True:
+                try:
+                    event = stream.events.get(timeout=15)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                if event is None:
+                    yield "event: end\ndata: {}\n\n"
+                    return
+                yield f"data: {json.dumps(event)}\n\n"
+        finally:
+            stream.close()
+            with sessions.live_streams_lock:
+                sessions.live_streams.pop(stream_id, None)
+
+    return Response(generate(), mimetype="text/event-stream")
+
+
+@app.route("/streams/latency")
+def live_stream_latency():
+    """Route exposing the latency histogram of the streaming path."""
+    return jsonify(metrics.stream_latency.snapshot())
+
+
+@app.route("/uploads/<key>")
+def upload_status(key):
+    """Route to check whether a MIDI file has reached S3."""
+    status = uploads.get_upload_status(key)
+    if status is None:
+        return jsonify({"error": "Upload not found"}), 404
+    return jsonify(status)
+
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    """Route to poll the status, stage and result of an asynchronous job."""
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
 
 
 def find_username(user_id):
@@ -271,185 +882,16 @@ def find_username(user_id):
     return ""
 
 
-def smooth_pitch_data(notes_data, window_size=5):
-    """smoothing pitch data."""
-    smoothed_data = []
-    for i in range(len(notes_data)):
-        start = max(i - window_size // 2, 0)
-        end = min(i + window_size // 2 + 1, len(notes_data))
-        window = notes_data[start:end]
-
-        avg_time = sum(note["time"] for note in window) / len(window)
-        note_counts = {}
-        for note in window:
-            note_counts[note["note"]] = note_counts.get(note["note"], 0) + 1
-        avg_note = max(note_counts, key=note_counts.get)
-
-        smoothed_data.append({"time": avg_time, "note": avg_note})
-    return smoothed_data
-
-
-def filter_and_combine_notes(notes_data):
-    """function to filter and combine notes."""
-    filtered_notes = []
-    last_note = None
-    # last_note_start_time = None
-
-    # Correcting the enumeration here
-    # for index, note in enumerate(notes_data):
-    for note in notes_data:
-        if last_note is not None and note["note"] != last_note:
-            # end_time = max(note["time"], last_note_start_time + minimum_note_duration)
-            filtered_notes.append(
-                {
-                    "note": last_note,
-                    # "start_time": last_note_start_time,
-                    # "end_time": end_time,
-                }
-            )
-            last_note = note["note"]
-            # last_note_start_time = note["time"]
-        elif last_note is None:
-            last_note = note["note"]
-            # last_note_start_time = note["time"]
-
-    if last_note is not None:
-        # end_time = max(
-        #    notes_data[-1]["time"], last_note_start_time + minimum_note_duration
-        # )
-        filtered_notes.append(
-            {
-                "note": last_note,
-                # "start_time": last_note_start_time,
-                # "end_time": end_time,
-            }
-        )
-
-    logging.info("Filtered notes: %s", filtered_notes)
-    return filtered_notes
-
-
-def detect_note_onsets(audio_file):
-    """
-    Detect when notes begin or onset.
-    """
-    # y, sr = librosa.load(audio_file, sr=44100)
-    y, _ = librosa.load(audio_file, sr=44100)
-    onsets = librosa.onset.onset_detect(y=y, sr=44100, units="time")
-    logging.info("onsets: %s", onsets)  # Lazy formatting used here
-    return onsets
-
-
-def estimate_note_durations(onsets, y, sr=44100, threshold=0.025):
-    """
-    Estimate note durations using onsets and amplitude envelope.
-    """
-    amp_env = calculate_amplitude_envelope(y, sr)
-    min_duration = 0.05
-    durations = []
-
-    # Iterate over onsets using enumerate
-    for i, onset in enumerate(onsets[:-1]):  # Exclude the last onset for now
-        onset_sample = int(onset * sr)
-        next_onset_sample = int(onsets[i + 1] * sr)
-
-        end_sample = next_onset_sample
-        for j in range(onset_sample, next_onset_sample, 512):
-            # 512 is the hop length used in envelope calculation
-            if amp_env[j // 512] < threshold:
-                end_sample = j
-                break
-
-        # Calculate duration with a minimum duration constraint
-        duration = max((end_sample - onset_sample) / sr, min_duration)
-        durations.append(duration)
-
-    # Handle the last onset separately
-    if len(onsets) > 0:
-        last_onset_sample = int(onsets[-1] * sr)
-        end_sample = len(y)
-        for j in range(last_onset_sample, end_sample, 512):
-            if amp_env[j // 512] < threshold:
-                end_sample = j
-                break
-
-        duration = max((end_sample - last_onset_sample) / sr, min_duration)
-        durations.append(duration)
-
-    logging.info("durations: %s", durations)
-    return durations
-
-
-def estimate_tempo(audio_file):
-    """
-    Estimating tempo for better time mapping
-    """
-    y, sr = librosa.load(audio_file, sr=44100)
-    tempo, _ = librosa.beat.beat_track(y=y, sr=sr)
-
-    logging.info("tempo: %s", tempo)
-    return tempo
-
-
-def calculate_amplitude_envelope(y, frame_size=1024, hop_length=512):
-    """
-    Calculate a smoother amplitude envelope of an audio signal using RMS.
-    """
-    amplitude_envelope = []
-    for i in range(0, len(y), hop_length):
-        frame = y[i : i + frame_size]
-        rms = np.sqrt(np.mean(frame**2))
-        amplitude_envelope.append(rms)
-    return np.array(amplitude_envelope)
-
-
 def create_midi(filtered_notes, onsets, durations, tempo, output_file="output.mid"):
     """
     Creating midi file using all the information.
     """
-    logging.info("Received notes for MIDI creation: %s", filtered_notes)
-    logging.info("Starting to create MIDI file.")
-    if tempo <= 0:
-        logging.warning("Invalid tempo detected. Setting default tempo.")
-        tempo = 120
     static_dir = os.path.join(app.root_path, "static")
     if not os.path.exists(static_dir):
         os.makedirs(static_dir)
     midi_file_path = os.path.join(static_dir, output_file)
-    midi_data = pretty_midi.PrettyMIDI(initial_tempo=tempo)
-    instrument = create_midi_instrument(filtered_notes, onsets, durations)
-    midi_data.instruments.append(instrument)
-    midi_data.write(midi_file_path)
+    with metrics.stage_timer("midi_write"):
+        midi_data = midi.build_midi(filtered_notes, onsets, durations, tempo)
+        midi_data.write(midi_file_path)
     logging.info("MIDI file written to %s", midi_file_path)
     return output_file
-
-
-def create_midi_instrument(filtered_notes, onsets, durations):
-    """
-    Create a MIDI instrument and add notes to it.
-    """
-    instrument_program = pretty_midi.instrument_name_to_program("Acoustic Grand Piano")
-    instrument = pretty_midi.Instrument(program=instrument_program)
-    for note_info, onset, duration in zip(filtered_notes, onsets, durations):
-        logging.info("Adding note: %s", note_info)
-        logging.info("Adding onset: %s", str(onset))
-        logging.info("Adding duration: %s", str(duration))
-
-        note_number = pretty_midi.note_name_to_number(note_info["note"])
-
-        logging.info("Note number: %s", note_number)
-
-        # Use onset and duration for start and end times
-        start_time = onset
-        end_time = start_time + duration
-
-        # Create and append the note
-        note = pretty_midi.Note(
-            velocity=100, pitch=note_number, start=start_time, end=end_time
-        )
-        instrument.notes.append(note)
-    return instrument
-
-
-if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5002)
@@ -0,0 +1,434 @@
+"""Pitch model loading, framing, voice activity and pitch detection."""
+import importlib
+import logging
+import threading
+import time
+from functools import partial
+import librosa
+import numpy as np
+
+from machine_learning_client import config, lazy, metrics, midi
+from machine_learning_client.audio import AudioContext
+
+
+# TensorFlow takes seconds to import, so it is only imported when the pitch
+# model is first needed or when a gunicorn master preloads it
+crepe = lazy.LazyObject(partial(importlib.import_module, "crepe"))
+
+# CREPE's input rate, which every backend analyses at; a plain constant so
+# the pYIN and YIN backends run without crepe or TensorFlow installed
+PITCH_SAMPLE_RATE = 16000
+
+# Set once the model has loaded and answered its warm-up inference
+model_ready = threading.Event()
+
+
+def load_pitch_model(model_capacity=None):
+    """
+    Load the CREPE model once and run a warm-up inference on silence,
+    so the first request does not pay for graph building and weight loading.
+    """
+    model_capacity = model_capacity or config.crepe_model_capacity
+    if model_capacity not in ("tiny", "small", "medium", "large", "full"):
+        raise ValueError(f"Unknown CREPE model capacity: {model_capacity}")
+
+    start = time.perf_counter()
+    crepe.core.build_and_load_model(model_capacity)
+    load_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    crepe.predict(
+        np.zeros(16000, dtype=np.float32),
+        16000,
+        model_capacity=model_capacity,
+        viterbi=True,
+        verbose=0,
+    )
+    warmup_time = time.perf_counter() - start
+
+    model_ready.set()
+    logging.info(
+        "Loaded CREPE %s model in %.2fs, warm-up inference took %.2fs",
+        model_capacity,
+        load_time,
+        warmup_time,
+    )
+    return load_time, warmup_time
+
+
+# Note names for every MIDI note number, so lookups avoid pretty_midi per frame
+pitch_classes = ("C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B")
+
+
+def note_number_to_name(number):
+    """pretty_midi.note_number_to_name, without importing pretty_midi."""
+    return f"{pitch_classes[number % 12]}{number // 12 - 1}"
+
+
+note_name_table = np.array(
+    [note_number_to_name(number) for number in range(128)], dtype=object
+)
+
+
+def frequency_to_note_name(frequency):
+    """Convert a frequency in Hertz to a musical note name."""
+    if frequency <= 0:
+        return None
+    frequency = float(frequency)
+    note_number = midi.pretty_midi.hz_to_note_number(frequency)
+
+    return midi.pretty_midi.note_number_to_name(int(note_number))
+
+
+def frequencies_to_note_numbers(frequencies):
+    """Vectorized hz_to_note_number, truncated to ints like frequency_to_note_name."""
+    frequencies = np.asarray(frequencies, dtype=np.float64)
+    positive = np.where(frequencies > 0, frequencies, 440.0)
+    note_numbers = 12 * (np.log2(positive) - np.log2(440.0)) + 69
+    return np.trunc(note_numbers).astype(np.int64)
+
+
+def frequencies_to_note_names(frequencies):
+    """Convert an array of frequencies to note names, None where not positive."""
+    frequencies = np.asarray(frequencies, dtype=np.float64)
+    note_numbers = frequencies_to_note_numbers(frequencies)
+    in_table = (note_numbers >= 0) & (note_numbers < 128)
+    names = note_name_table[np.clip(note_numbers, 0, 127)]
+    for index in np.flatnonzero(~in_table):
+        names[index] = note_number_to_name(int(note_numbers[index]))
+    names[frequencies <= 0] = None
+    return names
+
+
+def pitch_to_notes_data(times, frequency, confidence, confidence_threshold=0.74):
+    """
+    Turn pitch tracker output into notes data, keeping frames whose
+    confidence reaches the threshold and that have a pitch.
+    """
+    confidence = np.asarray(confidence)
+    frequency = np.asarray(frequency)
+    voiced = (confidence >= confidence_threshold) & (frequency > 0)
+    note_names = frequencies_to_note_names(frequency[voiced])
+    return [
+        {"time": t, "note": note, "confidence": round(c, 2)}
+        for t, note, c in zip(
+            np.asarray(times, dtype=np.float64)[voiced].tolist(),
+            note_names.tolist(),
+            confidence[voiced].astype(np.float64).tolist(),
+        )
+    ]
+
+
+def frame_audio(audio, sr, step_size=10):
+    """
+    Resample audio to 16 kHz and cut the whole signal into the normalized,
+    centered 1024-sample frames CREPE expects, one every step_size ms.
+    """
+    return normalize_frames(
+        pitch_windows(resample_for_pitch(audio, sr), step_size=step_size)
+    )
+
+
+def pitch_windows(audio, step_size=10):
+    """
+    The raw centered 1024-sample windows of 16 kHz audio, one every
+    step_size ms, as a strided view that copies nothing.
+    """
+    hop_length = int(PITCH_SAMPLE_RATE * step_size / 1000)
+    return np.lib.stride_tricks.sliding_window_view(np.pad(audio, 512), 1024)[
+        ::hop_length
+    ]
+
+
+def resample_for_pitch(audio, sr):
+    """Mono float32 audio at the 16 kHz rate every pitch tracker works at."""
+    audio = np.asarray(audio, dtype=np.float32)
+    if audio.ndim > 1:
+        audio = audio.mean(axis=1)
+    if sr != PITCH_SAMPLE_RATE:
+        audio = librosa.resample(audio, orig_sr=sr, target_sr=PITCH_SAMPLE_RATE)
+    return audio
+
+
+def normalize_frames(frames, index=None):
+    """
+    Copy frames, or only the ones index selects, to float32 with zero mean
+    and unit variance, as CREPE expects.
+    """
+    if index is None:
+        frames = frames.astype(np.float32)
+    else:
+        # Fancy indexing already copies, so normalize that copy in place
+        frames = frames[index].astype(np.float32, copy=False)
+    frames -= frames.mean(axis=1, keepdims=True)
+    frames /= np.clip(frames.std(axis=1, keepdims=True), 1e-8, None)
+    return frames
+
+
+def run_pitch_model(frames, batch_size=None):
+    """Run the CREPE model over prepared frames and return its activation."""
+    if len(frames) == 0:
+        return np.zeros((0, 360), dtype=np.float32)
+    model = crepe.core.build_and_load_model(config.crepe_model_capacity)
+    return model.predict(
+        frames, batch_size=batch_size or config.pitch_batch_size, verbose=0
+    )
+
+
+def pitch_from_activation(activation, step_size=10, viterbi=True):
+    """Decode a CREPE activation matrix into time, frequency and confidence."""
+    confidence = activation.max(axis=1)
+    if viterbi:
+        cents = crepe.core.to_viterbi_cents(activation)
+    else:
+        cents = crepe.core.to_local_average_cents(activation)
+    frequency = 10 * 2 ** (cents / 1200)
+    frequency[np.isnan(frequency)] = 0
+    times = np.arange(len(confidence)) * step_size / 1000.0
+    return times, frequency, confidence
+
+
+def predict_pitch(audio, sr, step_size=None, batch_size=None, viterbi=True):
+    """
+    Run CREPE over the whole signal in one batched pass.
+    Returns time, frequency and confidence arrays with timestamps
+    measured from the start of the recording.
+    Frames the voice-activity pre-pass finds silent skip the model and
+    get zero frequency and confidence. With PITCH_STEP_MODE=adaptive the
+    model only sees every few frames, plus the frames around pitch changes.
+    """
+    step_size = step_size or config.pitch_step_size
+    # Silent windows are dropped before any frame is copied or normalized
+    windows = pitch_windows(resample_for_pitch(audio, sr), step_size=step_size)
+    active = vad_mask(frame_rms(windows), step_size=step_size)
+    if config.pitch_step_mode == "adaptive":
+        activation = adaptive_activation(windows, active, step_size, batch_size)
+    else:
+        activation = run_pitch_model(
+            normalize_frames(windows, active), batch_size=batch_size
+        )
+    if active.all():
+        return pitch_from_activation(activation, step_size=step_size, viterbi=viterbi)
+
+    times = np.arange(len(windows)) * step_size / 1000.0
+    return (times, *decode_voiced_regions(activation, active, step_size, viterbi))
+
+
+def decode_voiced_regions(activation, active, step_size=10, viterbi=True):
+    """
+    Frequency and confidence for every frame from the activation of the
+    active ones. Each voiced region is decoded on its own, so the Viterbi
+    path restarts after every pause instead of being stitched across it.
+    """
+    frequency = np.zeros(len(active))
+    confidence = np.zeros(len(active), dtype=activation.dtype)
+    offset = 0
+    for start, stop in voiced_regions(active):
+        region = activation[offset : offset + stop - start]
+        _, frequency[start:stop], confidence[start:stop] = pitch_from_activation(
+            region, step_size=step_size, viterbi=viterbi
+        )
+        offset += stop - start
+    return frequency, confidence
+
+
+def adaptive_activation(frames, active, step_size=10, batch_size=None):
+    """
+    Activation for the active frames, running the model every
+    pitch_coarse_step ms and then on every frame between two coarse frames
+    whose pitch or voicing differ. Frames left out reuse the activation of
+    the nearest frame the model did see. frames are raw windows; only the
+    ones the model sees get normalized.
+    """
+    index = np.flatnonzero(active)
+    if len(index) == 0:
+        return run_pitch_model(normalize_frames(frames, index), batch_size=batch_size)
+    coarse = index[:: max(1, config.pitch_coarse_step // step_size)]
+    if coarse[-1] != index[-1]:
+        coarse = np.append(coarse, index[-1])
+    coarse_activation = run_pitch_model(
+        normalize_frames(frames, coarse), batch_size=batch_size
+    )
+
+    fine = frames_to_refine(coarse, coarse_activation, active)
+    fine_activation = run_pitch_model(
+        normalize_frames(frames, fine), batch_size=batch_size
+    )
+    logging.info(
+        "Adaptive pitch step: model ran on %d of %d frames",
+        len(coarse) + len(fine),
+        len(index),
+    )
+
+    seen = np.concatenate((coarse, fine))
+    order = np.argsort(seen)
+    seen_activation = np.concatenate((coarse_activation, fine_activation))[order]
+    return seen_activation[nearest_index(seen[order], index)]
+
+
+def frames_to_refine(coarse, coarse_activation, active):
+    """
+    Active frames between neighbouring coarse frames that differ in voicing,
+    or are both voiced more than pitch_change_cents apart.
+    """
+    cents = crepe.core.to_local_average_cents(coarse_activation)
+    voiced = coarse_activation.max(axis=1) >= config.min_confidence
+    moved = np.abs(np.diff(cents)) > config.pitch_change_cents
+    changed = (voiced[:-1] != voiced[1:]) | (voiced[:-1] & voiced[1:] & moved)
+    refine = np.zeros(len(active), dtype=bool)
+    for left, right in zip(coarse[:-1][changed], coarse[1:][changed]):
+        refine[left + 1 : right] = True
+    return np.flatnonzero(refine & active)
+
+
+def nearest_index(sorted_values, values):
+    """Position in sorted_values of the entry closest to each value."""
+    after = np.clip(np.searchsorted(sorted_values, values), 0, len(sorted_values) - 1)
+    before = np.clip(after - 1, 0, len(sorted_values) - 1)
+    use_before = values - sorted_values[before] < sorted_values[after] - values
+    return np.where(use_before, before, after)
+
+
+def voiced_frames(audio, step_size=10):
+    """
+    Energy-based voice-activity mask over the CREPE frames of 16 kHz audio.
+    A frame counts as active when its RMS is within vad_threshold_db of the
+    loudest frame, or above the vad_floor_db level so quiet singing is kept.
+    Active regions are widened by vad_padding_ms on both sides.
+    """
+    return vad_mask(
+        frame_rms(pitch_windows(audio, step_size=step_size)), step_size=step_size
+    )
+
+
+def frame_rms(frames, chunk_frames=4096):
+    """
+    RMS level of each raw, unnormalized frame. Frames are squared a chunk
+    at a time, so a strided view over a long signal is never copied whole.
+    """
+    rms = np.empty(len(frames), dtype=np.float32)
+    for start in range(0, len(frames), chunk_frames):
+        chunk = frames[start : start + chunk_frames]
+        rms[start : start + len(chunk)] = np.sqrt(np.mean(np.square(chunk), axis=1))
+    return rms
+
+
+def vad_mask(rms, step_size=10):
+    """The voiced_frames mask for frames with the given RMS levels."""
+    if not config.vad_enabled or len(rms) == 0:
+        return np.ones(len(rms), dtype=bool)
+
+    threshold = min(
+        rms.max() * 10 ** (config.vad_threshold_db / 20),
+        10 ** (config.vad_floor_db / 20),
+    )
+    active = rms > threshold
+    padding = config.vad_padding_ms // step_size
+    if padding:
+        active = np.convolve(active, np.ones(2 * padding + 1), mode="same") > 0
+
+    skipped = len(active) - int(active.sum())
+    metrics.vad_frames.inc(skipped, label="skipped")
+    metrics.vad_frames.inc(len(active) - skipped, label="analysed")
+    logging.info("VAD skipped %.0f%% of pitch frames", 100 * skipped / len(active))
+    return active
+
+
+def voiced_regions(active):
+    """Start and stop indices of each run of True in a boolean mask."""
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], active.astype(int), [0]))))
+    return zip(edges[::2], edges[1::2])
+
+
+def predict_pitch_pyin(audio, sr, step_size=10):
+    """
+    Track pitch with librosa's probabilistic YIN. The voicing probability
+    is used as confidence; frames pYIN decides are unvoiced get a frequency
+    and confidence of 0, as their probability can still be high.
+    """
+    audio = resample_for_pitch(audio, sr)
+    hop_length = int(PITCH_SAMPLE_RATE * step_size / 1000)
+    if len(audio) == 0:
+        return np.zeros(0), np.zeros(0), np.zeros(0)
+    frequency, voiced, confidence = librosa.pyin(
+        audio,
+        fmin=config.pitch_fmin,
+        fmax=config.pitch_fmax,
+        sr=PITCH_SAMPLE_RATE,
+        frame_length=1024,
+        hop_length=hop_length,
+    )
+    voiced &= ~np.isnan(frequency)
+    times = np.arange(len(frequency)) * step_size / 1000
+    return times, np.where(voiced, frequency, 0.0), np.where(voiced, confidence, 0.0)
+
+
+def predict_pitch_yin(audio, sr, step_size=10):
+    """
+    Track pitch with librosa's YIN. Confidence is the normalized
+    autocorrelation of each frame at the detected period.
+    """
+    audio = resample_for_pitch(audio, sr)
+    hop_length = int(PITCH_SAMPLE_RATE * step_size / 1000)
+    if len(audio) == 0:
+        return np.zeros(0), np.zeros(0), np.zeros(0)
+    frequency = librosa.yin(
+        audio,
+        fmin=config.pitch_fmin,
+        fmax=config.pitch_fmax,
+        sr=PITCH_SAMPLE_RATE,
+        frame_length=1024,
+        hop_length=hop_length,
+    )
+    frames = librosa.util.frame(
+        np.pad(audio, 512), frame_length=1024, hop_length=hop_length
+    )
+    confidence = frame_periodicity(frames, PITCH_SAMPLE_RATE / frequency)
+    times = np.arange(len(frequency)) * step_size / 1000
+    return times, frequency, confidence
+
+
+def frame_periodicity(frames, periods):
+    """
+    Normalized autocorrelation of each frame (one per column) at a lag of
+    its period in samples: close to 1 for clean pitched sound, 0 for silence.
+    """
+    length = frames.shape[0]
+    lags = np.clip(np.round(periods).astype(int), 1, length - 1)
+    index = np.arange(length)[:, None] + lags
+    valid = index < length
+    head = frames * valid
+    shifted = np.take_along_axis(frames, np.minimum(index, length - 1), axis=0) * valid
+    energy = np.sqrt((head**2).sum(axis=0) * (shifted**2).sum(axis=0))
+    return np.clip((head * shifted).sum(axis=0) / np.maximum(energy, 1e-8), 0, 1)
+
+
+def detect_pitch(audio, sr, backend=None):
+    """
+    Run the chosen pitch tracker. Every backend returns time, frequency and
+    confidence arrays on the same 10 ms grid.
+    """
+    backend = backend or config.pitch_backend
+    if backend == "crepe":
+        return predict_pitch(audio, sr)
+    if backend == "pyin":
+        return predict_pitch_pyin(audio, sr)
+    if backend == "yin":
+        return predict_pitch_yin(audio, sr)
+    raise ValueError(f"Unknown pitch backend: {backend}")
+
+
+def process_audio_chunks(audio, sr=None, backend=None):
+    """
+    Run pitch detection over the audio and return notes data.
+    Accepts either a raw signal with its sample rate or an AudioContext.
+    """
+    if isinstance(audio, AudioContext):
+        sr = PITCH_SAMPLE_RATE
+        audio = audio.at_rate(sr)
+    times, frequency, confidence = detect_pitch(audio, sr, backend=backend)
+    notes_data = pitch_to_notes_data(
+        times, frequency, confidence, confidence_threshold=config.min_confidence
+    )
+    logging.debug("Notes data: %s", notes_data)
+    return notes_data
@@ -0,0 +1,93 @@
+"""Onset, note duration and tempo detection."""
+import logging
+import librosa
+import numpy as np
+
+from machine_learning_client import audio
+
+
+def detect_note_onsets(audio_file, sr=44100):
+    """
+    Detect when notes begin or onset.
+    audio_file may be a path or an already decoded AudioContext.
+    """
+    y = audio.load_audio_at_rate(audio_file, sr=sr)
+    onsets = librosa.onset.onset_detect(y=y, sr=sr, units="time")
+    logging.info("onsets: %s", onsets)  # Lazy formatting used here
+    return onsets
+
+
+def find_note_ends(amp_env, onset_samples, limit_samples, threshold, hop_length=512):
+    """
+    For each onset, the sample of the first envelope hop below threshold,
+    or its limit sample when the envelope stays loud until then.
+    """
+    # First quiet hop at or after each onset, found by binary search
+    quiet_hops = np.flatnonzero(amp_env < threshold)
+    first_hop = onset_samples // hop_length
+    position = np.searchsorted(quiet_hops, first_hop)
+    quiet_hop = np.append(quiet_hops, len(amp_env))[position]
+    quiet_sample = onset_samples + (quiet_hop - first_hop) * hop_length
+
+    return np.where(quiet_sample < limit_samples, quiet_sample, limit_samples)
+
+
+def estimate_note_durations(onsets, y, sr=44100, threshold=0.025):
+    """
+    Estimate note durations using onsets and amplitude envelope.
+    y may be a signal sampled at sr or an AudioContext.
+    """
+    if isinstance(y, audio.AudioContext):
+        y = y.at_rate(sr)
+    # The envelope has always been taken over sr-sample frames every 512 samples
+    amp_env = calculate_amplitude_envelope(y, sr)
+    return durations_from_envelope(onsets, amp_env, len(y), sr, threshold)
+
+
+def durations_from_envelope(onsets, amp_env, n_samples, sr=44100, threshold=0.025):
+    """Note durations from the onsets and amplitude envelope of n_samples of audio."""
+    min_duration = 0.05
+
+    onset_samples = (np.asarray(onsets, dtype=np.float64) * sr).astype(np.int64)
+    next_onset_samples = np.append(onset_samples[1:], n_samples)
+    end_samples = find_note_ends(amp_env, onset_samples, next_onset_samples, threshold)
+
+    # Calculate duration with a minimum duration constraint
+    durations = np.maximum((end_samples - onset_samples) / sr, min_duration).tolist()
+
+    logging.info("durations: %s", durations)
+    return durations
+
+
+def estimate_tempo(audio_file, sr=44100):
+    """
+    Estimating tempo for better time mapping
+    audio_file may be a path or an already decoded AudioContext.
+    """
+    y = audio.load_audio_at_rate(audio_file, sr=sr)
+    tempo, _ = librosa.beat.beat_track(y=y, sr=sr)
+
+    logging.info("tempo: %s", tempo)
+    return tempo
+
+
+def calculate_amplitude_envelope(y, frame_size=1024, hop_length=512):
+    """
+    Calculate a smoother amplitude envelope of an audio signal using RMS.
+    One frame starts every hop_length samples; frames at the end are shorter.
+    """
+    return envelope_from_squares(
+        np.square(np.asarray(y, dtype=np.float64)), frame_size, hop_length
+    )
+
+
+def envelope_from_squares(squares, frame_size=1024, hop_length=512):
+    """calculate_amplitude_envelope from the squared samples."""
+    starts = np.arange(0, len(squares), hop_length)
+
+    # Zero padding gives every start a full-length strided frame
+    frames = np.lib.stride_tricks.sliding_window_view(
+        np.append(squares, np.zeros(frame_size)), frame_size
+    )[::hop_length][: len(starts)]
+    lengths = np.minimum(frame_size, len(squares) - starts)
+    return np.sqrt(frames.sum(axis=1) / lengths)
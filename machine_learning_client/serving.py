@@ -0,0 +1,245 @@
+"""TensorFlow thread layout, autotuning and the gunicorn server."""
+import os
+import importlib
+import json
+import queue
+import logging
+import multiprocessing
+import time
+from functools import partial
+import librosa
+import numpy as np
+
+from machine_learning_client import config, lazy, ml, pitch
+
+
+# TensorFlow is only imported when a gunicorn master preloads it or the
+# threads are configured; gunicorn only when serving through it
+tf = lazy.LazyObject(partial(importlib.import_module, "tensorflow"))
+gunicorn_base = lazy.LazyObject(partial(importlib.import_module, "gunicorn.app.base"))
+
+
+def configure_tensorflow_threads(intra_op=0, inter_op=0):
+    """
+    Set TensorFlow's thread pools before it runs anything in this process.
+    Zero leaves a pool at TensorFlow's default of one thread per core.
+    """
+    if intra_op:
+        tf.config.threading.set_intra_op_parallelism_threads(intra_op)
+    if inter_op:
+        tf.config.threading.set_inter_op_parallelism_threads(inter_op)
+
+
+def candidate_layouts(cores):
+    """(processes, threads) layouts that use every core, from 1 x cores down."""
+    layouts = []
+    workers = 1
+    while workers < cores:
+        layouts.append((workers, cores // workers))
+        workers *= 2
+    layouts.append((cores, 1))
+    return layouts
+
+
+def tuning_clip(seconds=5):
+    """A 16 kHz clip of half-second tones for timing the pitch model."""
+    t = np.arange(pitch.PITCH_SAMPLE_RATE // 2) / pitch.PITCH_SAMPLE_RATE
+    notes = [
+        np.sin(2 * np.pi * 220 * 2 ** (k % 12 / 12) * t) for k in range(seconds * 2)
+    ]
+    return (0.5 * np.concatenate(notes)).astype(np.float32)
+
+
+def measure_layout_worker(threads, seconds, repeats, barrier, results):
+    """One process of a layout under test: load the model, then time it."""
+    configure_tensorflow_threads(threads, 1)
+    pitch.load_pitch_model()
+    clip = tuning_clip(seconds)
+    barrier.wait()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        pitch.predict_pitch(clip, pitch.PITCH_SAMPLE_RATE)
+    results.put(time.perf_counter() - start)
+
+
+def measure_layout(workers, threads, seconds=5, repeats=2, timeout=600):
+    """
+    Throughput, in audio seconds per wall second, of workers processes with
+    threads TensorFlow threads each, all running the pitch model at once.
+    """
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(workers)
+    results = context.Queue()
+    processes = [
+        context.Process(
+            target=measure_layout_worker,
+            args=(threads, seconds, repeats, barrier, results),
+            daemon=True,
+        )
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        elapsed = max(results.get(timeout=timeout) for _ in processes)
+    except queue.Empty:
+        logging.warning("Layout %d x %d timed out", workers, threads)
+        return 0.0
+    finally:
+        for process in processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+    return workers * repeats * seconds / elapsed
+
+
+def autotune_topology(cores=None):
+    """
+    Benchmark every candidate layout and return the (processes, threads)
+    pair with the best throughput. The choice is kept in TOPOLOGY_CACHE,
+    when set, for later starts on the same host and model.
+    """
+    cores = cores or os.cpu_count() or 1
+    key = f"{cores}:{config.crepe_model_capacity}"
+    if config.topology_cache and os.path.exists(config.topology_cache):
+        with open(config.topology_cache, encoding="utf-8") as file:
+            cached = json.load(file)
+        if key in cached:
+            return tuple(cached[key])
+
+    scores = {}
+    for workers, threads in candidate_layouts(cores):
+        scores[(workers, threads)] = measure_layout(workers, threads)
+        logging.info(
+            "Layout %d processes x %d threads: %.1fx realtime",
+            workers,
+            threads,
+            scores[(workers, threads)],
+        )
+    best = max(scores, key=scores.get)
+
+    if config.topology_cache:
+        cached = {}
+        if os.path.exists(config.topology_cache):
+            with open(config.topology_cache, encoding="utf-8") as file:
+                cached = json.load(file)
+        cached[key] = list(best)
+        with open(config.topology_cache, "w", encoding="utf-8") as file:
+            json.dump(cached, file)
+    return best
+
+
+def serving_topology():
+    """
+    Number of worker processes and TensorFlow threads for each of them.
+    While stateful routes are on without sticky routing, a second process
+    would lose jobs and sessions, so one process gets every core.
+    """
+    cores = os.cpu_count() or 1
+    if config.stateful_routes == "true":
+        if config.server_workers not in ("auto", "1"):
+            raise ValueError(
+                f"SERVER_WORKERS={config.server_workers} would split jobs, sessions and "
+                "streams across processes; set STATEFUL_ROUTES=sticky behind "
+                "sticky routing, or STATEFUL_ROUTES=false"
+            )
+        return 1, config.tf_intra_op_threads or cores
+
+    if config.server_workers == "auto":
+        workers, threads = autotune_topology()
+    else:
+        workers = int(config.server_workers)
+        threads = config.tf_intra_op_threads or max(1, cores // workers)
+    if workers > 1 and config.stateful_routes == "sticky":
+        logging.warning(
+            "Serving %d processes with per-process jobs and sessions; "
+            "clients must stick to one worker",
+            workers,
+        )
+    return workers, threads
+
+
+def preload_modules():
+    """
+    Import TensorFlow, CREPE and librosa and compile librosa's onset and beat
+    code, so forked workers share all of it copy-on-write. Nothing here starts
+    TensorFlow's runtime: a model built before the fork hangs the workers.
+    """
+    start = time.perf_counter()
+    pitch.crepe.resolve()
+    tf.resolve()
+    noise = np.random.default_rng(0).standard_normal(config.analysis_sample_rate)
+    librosa.onset.onset_detect(y=noise, sr=config.analysis_sample_rate)
+    librosa.beat.beat_track(y=noise, sr=config.analysis_sample_rate)
+    logging.info("Preloaded modules in %.2fs", time.perf_counter() - start)
+
+
+def pitch_server(application, options):
+    """
+    gunicorn application serving the Flask app from worker processes. The
+    class is built on first call, so only SERVER_MODE=gunicorn imports gunicorn.
+    """
+
+    class PitchServer(gunicorn_base.BaseApplication):
+        """gunicorn application serving the Flask app from worker processes."""
+
+        def __init__(self, application, options):
+            self.application = application
+            self.options = options
+            super().__init__()
+
+        def init(self, parser, opts, args):
+            """Settings come from load_config rather than the command line."""
+
+        def load_config(self):
+            """Apply the options to gunicorn's configuration."""
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            """Return the WSGI app to serve."""
+            return self.application
+
+    return PitchServer(application, options)
+
+
+def serve():
+    """
+    Serve the app. The default is Flask's built-in server. SERVER_MODE=gunicorn
+    forks worker processes that each set their TensorFlow thread budget and
+    load their own copy of the model before taking requests. With
+    SERVER_PRELOAD the master imports the heavy modules before forking.
+    """
+    if config.server_mode != "gunicorn":
+        configure_tensorflow_threads(
+            config.tf_intra_op_threads, config.tf_inter_op_threads
+        )
+        pitch.load_pitch_model()
+        ml.app.run(host="0.0.0.0", port=5002, threaded=True)
+        return
+
+    workers, threads = serving_topology()
+    logging.info("Serving with %d processes x %d threads", workers, threads)
+    if workers > 1 and not config.ml_workers:
+        # The processes already split the cores: one recording at a time each
+        config.ml_workers = 1
+    if config.server_preload:
+        preload_modules()
+
+    def post_worker_init(worker):
+        configure_tensorflow_threads(threads, config.tf_inter_op_threads or 1)
+        pitch.load_pitch_model()
+        worker.log.info("Worker %s ready", worker.pid)
+
+    pitch_server(
+        ml.app,
+        {
+            "bind": "0.0.0.0:5002",
+            "workers": workers,
+            "worker_class": "gthread",
+            "threads": config.http_threads,
+            "timeout": 600,
+            "preload_app": config.server_preload,
+            "post_worker_init": post_worker_init,
+        },
+    ).run()
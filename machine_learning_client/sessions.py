@@ -0,0 +1,257 @@
+"""Recording sessions and live pitch streams kept between requests."""
+import queue
+import logging
+import threading
+import time
+from collections import deque
+import numpy as np
+
+from machine_learning_client import audio, config, metrics, pitch, streaming
+
+
+live_streams = {}
+live_streams_lock = threading.Lock()
+recording_sessions = {}
+recording_sessions_lock = threading.Lock()
+idle_reaper_threads = []
+
+
+class RecordingSession:  # pylint: disable=too-many-instance-attributes
+    """
+    A recording uploaded in segments while the user is still singing.
+    Pitch detection runs on each segment as it arrives, so finishing only
+    costs the last segment plus MIDI assembly.
+    """
+
+    def __init__(self, sr=44100, step_size=10):
+        self.sr = sr
+        self.step_size = step_size
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+        self.closed = False
+        self._decoder = None
+        self._chunks = []
+        self._samples = 0
+        self._activations = []
+        self._framer = streaming.PitchFramer(sr, step_size=step_size)
+
+    @property
+    def audio(self):
+        """All audio received so far at the session sample rate."""
+        if not self._chunks:
+            return np.zeros(0, dtype=np.float32)
+        return np.concatenate(self._chunks)
+
+    @property
+    def duration(self):
+        """Seconds of audio received so far."""
+        return self._samples / self.sr
+
+    @property
+    def frames_done(self):
+        """CREPE frames already run through the model."""
+        return self._framer.frames_done
+
+    def add_webm(self, segment):
+        """
+        Add a MediaRecorder WebM segment. Only the first segment carries the
+        WebM header, so all segments go through one ffmpeg process for the
+        session, and whatever audio it has decoded so far is analysed.
+        """
+        with self.lock:
+            self._touch()
+            if self._decoder is None:
+                self._decoder = audio.WebmStreamDecoder(sr=self.sr)
+            self._add_samples(self._decoder.write(segment))
+
+    def add_pcm(self, samples):
+        """Add raw mono float32 samples at the session sample rate."""
+        with self.lock:
+            self._touch()
+            self._add_samples(samples)
+
+    def close(self):
+        """Release the session's ffmpeg process without finishing it."""
+        with self.lock:
+            self.closed = True
+            if self._decoder is not None:
+                self._decoder.kill()
+                self._decoder = None
+
+    def _touch(self):
+        if self.closed:
+            raise ValueError("Session has expired")
+        self.last_used = time.monotonic()
+
+    def _add_samples(self, samples):
+        samples = np.asarray(samples, dtype=np.float32)
+        if samples.size == 0:
+            return
+        self._chunks.append(samples)
+        self._samples += len(samples)
+        self._activations.append(pitch.run_pitch_model(self._framer.push(samples)))
+
+    def finish(self):
+        """
+        Flush the remaining audio through the pitch model and return the
+        time, frequency and confidence arrays for the whole recording.
+        """
+        with self.lock:
+            if self._decoder is not None:
+                decoder, self._decoder = self._decoder, None
+                self._add_samples(decoder.finish())
+            if self._samples == 0:
+                raise ValueError("No audio received for this session")
+
+            self._activations.append(pitch.run_pitch_model(self._framer.flush()))
+            return pitch.pitch_from_activation(
+                np.concatenate(self._activations), step_size=self.step_size
+            )
+
+
+class LivePitchStream:  # pylint: disable=too-many-instance-attributes
+    """
+    Live pitch detection for PCM frames pushed by a client. A bounded buffer
+    holds audio waiting for inference; a worker thread turns it into note
+    events with the same fields process_audio_chunks emits. Frames are
+    decoded one by one without Viterbi smoothing to keep latency low.
+    """
+
+    def __init__(self, sr=16000, max_buffer_seconds=2.0, step_size=10):
+        self.sr = sr
+        self.step_size = step_size
+        self.max_pending = int(max_buffer_seconds * sr)
+        self.events = queue.Queue()
+        self.last_used = time.monotonic()
+        self._framer = streaming.PitchFramer(sr, step_size=step_size)
+        self._pending = deque()
+        self._pending_samples = 0
+        self._closed = False
+        self._ready = threading.Condition()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    @property
+    def pending_samples(self):
+        """Samples received but not yet run through the model."""
+        with self._ready:
+            return self._pending_samples
+
+    def push(self, samples):
+        """
+        Queue PCM samples for inference. Returns False without queueing when
+        the buffer is full, so the caller can tell the client to slow down.
+        """
+        samples = np.asarray(samples, dtype=np.float32)
+        with self._ready:
+            if self._closed:
+                raise ValueError("Stream is closed")
+            self.last_used = time.monotonic()
+            if self._pending_samples + len(samples) > self.max_pending:
+                return False
+            self._pending.append((time.perf_counter(), samples))
+            self._pending_samples += len(samples)
+            self._ready.notify()
+        return True
+
+    def close(self):
+        """Stop accepting audio; remaining frames are flushed, then the events end."""
+        with self._ready:
+            self._closed = True
+            self._ready.notify()
+
+    def _run(self):
+        # Whatever happens, listeners get the end of the events, and a failed
+        # stream stops taking audio instead of answering 429 forever
+        try:
+            self._detect()
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logging.error("Live stream failed: %s", e)
+            metrics.error_count.inc(label=type(e).__name__)
+            with self._ready:
+                self._closed = True
+                self._pending.clear()
+                self._pending_samples = 0
+            self.events.put({"error": str(e)})
+        finally:
+            self.events.put(None)
+
+    def _detect(self):
+        while True:
+            with self._ready:
+                while not self._pending and not self._closed:
+                    self._ready.wait()
+                if not self._pending:
+                    break
+                arrived, samples = self._pending.popleft()
+            self._emit(self._framer.push(samples), arrived)
+            with self._ready:
+                self._pending_samples -= len(samples)
+
+        self._emit(self._framer.flush(), time.perf_counter())
+
+    def _emit(self, frames, arrived):
+        first_frame = self._framer.frames_done - len(frames)
+        times, frequency, confidence = pitch.pitch_from_activation(
+            pitch.run_pitch_model(frames), step_size=self.step_size, viterbi=False
+        )
+        times = times + first_frame * self.step_size / 1000.0
+        for note in pitch.pitch_to_notes_data(
+            times, frequency, confidence, confidence_threshold=config.min_confidence
+        ):
+            self.events.put(note)
+        metrics.stream_latency.observe(time.perf_counter() - arrived)
+
+
+def expire_idle_sessions(now=None):
+    """Close and drop recording sessions that have been idle for too long."""
+    now = time.monotonic() if now is None else now
+    with recording_sessions_lock:
+        expired = [
+            session_id
+            for session_id, recording in recording_sessions.items()
+            if now - recording.last_used > config.session_idle_seconds
+        ]
+        closing = [recording_sessions.pop(session_id) for session_id in expired]
+    for recording in closing:
+        recording.close()
+    if expired:
+        logging.info("Expired %d idle recording sessions", len(expired))
+    return expired
+
+
+def expire_idle_streams(now=None):
+    """Close and drop live streams that have not received audio for too long."""
+    now = time.monotonic() if now is None else now
+    with live_streams_lock:
+        expired = [
+            stream_id
+            for stream_id, stream in live_streams.items()
+            if now - stream.last_used > config.stream_idle_seconds
+        ]
+        closing = [live_streams.pop(stream_id) for stream_id in expired]
+    for stream in closing:
+        stream.close()
+    if expired:
+        logging.info("Expired %d idle live streams", len(expired))
+    return expired
+
+
+def idle_reaper():
+    """Background loop expiring idle recording sessions and live streams."""
+    while True:
+        time.sleep(
+            max(1.0, min(config.session_idle_seconds, config.stream_idle_seconds) / 4)
+        )
+        expire_idle_sessions()
+        expire_idle_streams()
+
+
+def start_idle_reaper():
+    """Start the idle reaper thread if it is not running yet."""
+    with recording_sessions_lock:
+        if not idle_reaper_threads:
+            thread = threading.Thread(
+                target=idle_reaper, name="idle-reaper", daemon=True
+            )
+            thread.start()
+            idle_reaper_threads.append(thread)
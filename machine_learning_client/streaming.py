@@ -0,0 +1,311 @@
+"""Streaming analysis: pitch, onsets and tempo computed block by block."""
+import itertools
+import logging
+import librosa
+import numpy as np
+import soxr
+
+from machine_learning_client import config, pitch, rhythm
+
+
+class PitchFramer:
+    """
+    Incremental version of frame_audio: takes audio in pieces and hands back
+    each normalized CREPE frame as soon as all of its samples have arrived.
+    The resampler state and the unconsumed 16 kHz tail carry over between
+    pieces, so the frames match framing the whole signal at once. With
+    normalize=False it hands back the raw frames instead.
+    """
+
+    def __init__(self, sr, step_size=10, normalize=True):
+        self.hop_length = int(pitch.PITCH_SAMPLE_RATE * step_size / 1000)
+        self.normalize = normalize
+        self.frames_done = 0
+        self._resampler = soxr.ResampleStream(
+            sr, pitch.PITCH_SAMPLE_RATE, 1, dtype="float32"
+        )
+        # Starts with CREPE's centering pad
+        self._buffer = np.zeros(512, dtype=np.float32)
+
+    def push(self, samples):
+        """Add audio and return the frames it completes."""
+        resampled = self._resampler.resample_chunk(
+            np.asarray(samples, dtype=np.float32)
+        )
+        return self._take_ready(resampled)
+
+    def flush(self):
+        """Pad the end of the signal and return the remaining frames."""
+        tail = self._resampler.resample_chunk(np.zeros(0, dtype=np.float32), last=True)
+        return self._take_ready(np.append(tail, np.zeros(512, dtype=np.float32)))
+
+    def _take_ready(self, resampled):
+        self._buffer = np.concatenate([self._buffer, resampled])
+        if len(self._buffer) < 1024:
+            return np.zeros((0, 1024), dtype=np.float32)
+        n_ready = (len(self._buffer) - 1024) // self.hop_length + 1
+        frames = np.lib.stride_tricks.sliding_window_view(self._buffer, 1024)
+        frames = frames[:: self.hop_length][:n_ready]
+        if self.normalize:
+            frames = pitch.normalize_frames(frames)
+        self._buffer = self._buffer[n_ready * self.hop_length :]
+        self.frames_done += n_ready
+        return frames
+
+
+class VoicedRegionDecoder:  # pylint: disable=too-many-instance-attributes
+    """
+    Incremental version of decode_voiced_regions. Takes the activation of
+    each block's active frames along with the block's mask, and decodes a
+    voiced region as soon as it ends. Regions longer than window_seconds are
+    decoded a window at a time with context_seconds of activation on either
+    side, so memory stays bounded even without pauses. The path usually
+    settles back onto the whole-region path within the context, but ties can
+    be broken differently near window edges.
+    """
+
+    def __init__(
+        self, step_size=10, viterbi=True, window_seconds=None, context_seconds=5
+    ):
+        self.step_size = step_size
+        self.viterbi = viterbi
+        window_seconds = window_seconds or config.viterbi_window_seconds
+        self.window = int(window_seconds * 1000 / step_size)
+        self.context = int(context_seconds * 1000 / step_size)
+        self._region = np.zeros((0, 360), dtype=np.float32)
+        # Frames at the start of _region already decoded, kept as context
+        self._decoded = 0
+        self._frequency = []
+        self._confidence = []
+
+    def push(self, activation, active):
+        """Add the activation of a block's active frames and the block's mask."""
+        position = offset = 0
+        for start, stop in pitch.voiced_regions(active):
+            if start > position:
+                self._close_region()
+                self._add_silence(start - position)
+            self._extend_region(activation[offset : offset + stop - start])
+            offset += stop - start
+            position = stop
+        if len(active) > position:
+            self._close_region()
+            self._add_silence(len(active) - position)
+
+    def finish(self):
+        """Decode the last region; return frequency and confidence of every frame."""
+        self._close_region()
+        self._add_silence(0)
+        return np.concatenate(self._frequency), np.concatenate(self._confidence)
+
+    def _add_silence(self, frames):
+        self._frequency.append(np.zeros(frames))
+        self._confidence.append(np.zeros(frames, dtype=np.float32))
+
+    def _extend_region(self, activation):
+        self._region = np.concatenate([self._region, activation])
+        # Decode a window once the context after it has arrived
+        while len(self._region) - self._decoded >= self.window + self.context:
+            end = self._decoded + self.window
+            self._decode(self._region[: end + self.context], end)
+            keep = max(0, end - self.context)
+            self._region = self._region[keep:]
+            self._decoded = end - keep
+
+    def _close_region(self):
+        if len(self._region) > self._decoded:
+            self._decode(self._region, len(self._region))
+        self._region = self._region[:0]
+        self._decoded = 0
+
+    def _decode(self, activation, end):
+        _, frequency, confidence = pitch.pitch_from_activation(
+            activation, step_size=self.step_size, viterbi=self.viterbi
+        )
+        self._frequency.append(frequency[self._decoded : end])
+        self._confidence.append(confidence[self._decoded : end])
+
+
+def stream_pitch_frames(audio_file, step_size=10, normalize=True):
+    """The CREPE frames of an AudioFile, one block's worth at a time."""
+    framer = PitchFramer(audio_file.sr, step_size=step_size, normalize=normalize)
+    for block in audio_file.blocks():
+        yield framer.push(block)
+    yield framer.flush()
+
+
+def stream_pitch(audio_file, step_size=None, batch_size=None, viterbi=True):
+    """
+    predict_pitch for an AudioFile, in two passes over the blocks. The first
+    measures frame levels for the voice-activity mask, which is relative to
+    the loudest frame; the second runs the model on each block's voiced
+    frames. Adaptive mode picks its coarse frames within each block.
+    """
+    step_size = step_size or config.pitch_step_size
+    active = pitch.vad_mask(
+        np.concatenate(
+            [
+                pitch.frame_rms(frames)
+                for frames in stream_pitch_frames(
+                    audio_file, step_size, normalize=False
+                )
+            ]
+        ),
+        step_size=step_size,
+    )
+
+    decoder = VoicedRegionDecoder(step_size=step_size, viterbi=viterbi)
+    done = 0
+    for frames in stream_pitch_frames(audio_file, step_size, normalize=False):
+        block_active = active[done : done + len(frames)]
+        done += len(frames)
+        if config.pitch_step_mode == "adaptive":
+            activation = pitch.adaptive_activation(
+                frames, block_active, step_size, batch_size
+            )
+        else:
+            activation = pitch.run_pitch_model(
+                pitch.normalize_frames(frames, block_active), batch_size=batch_size
+            )
+        decoder.push(activation, block_active)
+
+    frequency, confidence = decoder.finish()
+    return np.arange(len(frequency)) * step_size / 1000.0, frequency, confidence
+
+
+def stream_audio_notes(audio_file, backend=None):
+    """process_audio_chunks for an AudioFile."""
+    backend = backend or config.pitch_backend
+    if backend == "crepe":
+        track = stream_pitch(audio_file)
+    else:
+        # pYIN and YIN decode the whole track at once; at 16 kHz mono float32
+        # their input is a small fraction of what the in-memory path holds
+        sr = pitch.PITCH_SAMPLE_RATE
+        track = pitch.detect_pitch(
+            np.concatenate(list(audio_file.blocks(sr))), sr, backend=backend
+        )
+    return pitch.pitch_to_notes_data(*track, confidence_threshold=config.min_confidence)
+
+
+def stream_amplitude_envelope(audio_file, sr=44100, hop_length=512):
+    """
+    calculate_amplitude_envelope over an AudioFile at sr, with sr-sample
+    frames as estimate_note_durations uses. Only the samples of the frames
+    still open are kept between blocks. Returns the envelope and the number
+    of samples at sr.
+    """
+    frame_size = sr
+    squares = np.zeros(0)
+    envelope = []
+    n_samples = 0
+    for block in audio_file.blocks(sr):
+        n_samples += len(block)
+        squares = np.append(squares, np.square(block.astype(np.float64)))
+        # Frames whose samples have all arrived
+        complete = max(0, (len(squares) - frame_size) // hop_length + 1)
+        if complete:
+            frames = np.lib.stride_tricks.sliding_window_view(squares, frame_size)
+            envelope.append(
+                np.sqrt(frames[::hop_length][:complete].sum(axis=1) / frame_size)
+            )
+            squares = squares[complete * hop_length :]
+
+    envelope.append(rhythm.envelope_from_squares(squares, frame_size, hop_length))
+    return np.concatenate(envelope), n_samples
+
+
+def stream_mel_power(audio_file, sr=22050, n_fft=2048, hop_length=512):
+    """
+    Mel power spectrogram of an AudioFile at sr, a block of frames at a time,
+    framed like librosa.feature.melspectrogram with its default centering.
+    """
+    mel_basis = librosa.filters.mel(sr=sr, n_fft=n_fft, fmax=0.5 * sr)
+    buffer = np.zeros(n_fft // 2, dtype=np.float32)
+    centering = np.zeros(n_fft // 2, dtype=np.float32)
+    for block in itertools.chain(audio_file.blocks(sr), [centering]):
+        buffer = np.concatenate([buffer, block])
+        n_frames = (len(buffer) - n_fft) // hop_length + 1
+        if n_frames <= 0:
+            continue
+        spectrum = (
+            np.abs(
+                librosa.stft(
+                    buffer[: (n_frames - 1) * hop_length + n_fft],
+                    n_fft=n_fft,
+                    hop_length=hop_length,
+                    center=False,
+                )
+            )
+            ** 2
+        )
+        yield np.einsum("...ft,mf->...mt", spectrum, mel_basis, optimize=True)
+        buffer = buffer[n_frames * hop_length :]
+
+
+def stream_onset_envelopes(audio_file, sr=22050, top_db=80.0):
+    """
+    The onset strength envelopes of an AudioFile that onset_detect (mean
+    over mel bands) and beat_track (median) compute. power_to_db floors the
+    spectrogram top_db below its loudest bin, so a first pass finds that
+    bin and a second takes the spectral flux block by block.
+    """
+    log_max = max(
+        (
+            librosa.power_to_db(mel, top_db=None).max()
+            for mel in stream_mel_power(audio_file, sr)
+        ),
+        default=0.0,
+    )
+    mean_flux, median_flux = [], []
+    previous = None
+    n_frames = 0
+    for mel in stream_mel_power(audio_file, sr):
+        log_spec = np.maximum(librosa.power_to_db(mel, top_db=None), log_max - top_db)
+        frames = log_spec if previous is None else np.hstack([previous, log_spec])
+        flux = np.maximum(0.0, frames[:, 1:] - frames[:, :-1])
+        mean_flux.append(np.mean(flux, axis=0))
+        median_flux.append(np.median(flux, axis=0))
+        previous = log_spec[:, -1:]
+        n_frames += log_spec.shape[1]
+
+    # As onset_strength: shift by the lag and half a window, then trim
+    padding = [np.zeros(1 + 2048 // (2 * 512), dtype=np.float32)]
+    return tuple(
+        np.concatenate(padding + flux)[:n_frames] for flux in (mean_flux, median_flux)
+    )
+
+
+def tempo_from_envelope(onset_env, sr=22050, hop_length=512, block_frames=2048):
+    """
+    The tempo beat_track estimates from an onset envelope. Its tempogram holds
+    an autocorrelation window per frame, so the frames are averaged a block
+    at a time instead of all at once.
+    """
+    if not onset_env.any():
+        return 0
+    win_length = librosa.time_to_frames(8.0, sr=sr, hop_length=hop_length).item()
+    # Centred as tempogram does, so frame i covers padded[i : i + win_length]
+    padded = np.pad(onset_env, win_length // 2, mode="linear_ramp", end_values=0)
+    total = np.zeros(win_length)
+    for start in range(0, len(onset_env), block_frames):
+        stop = min(start + block_frames, len(onset_env))
+        total += librosa.feature.tempogram(
+            onset_envelope=padded[start : stop + win_length - 1],
+            sr=sr,
+            hop_length=hop_length,
+            win_length=win_length,
+            center=False,
+        ).sum(axis=1)
+    mean_tempogram = (total / len(onset_env))[:, np.newaxis]
+    return librosa.feature.tempo(tg=mean_tempogram, sr=sr, hop_length=hop_length)[0]
+
+
+def stream_onsets_and_tempo(audio_file, sr=22050):
+    """detect_note_onsets and estimate_tempo for an AudioFile, in one go."""
+    onset_env, beat_env = stream_onset_envelopes(audio_file, sr=sr)
+    onsets = librosa.onset.onset_detect(onset_envelope=onset_env, sr=sr, units="time")
+    tempo = tempo_from_envelope(beat_env, sr=sr)
+    logging.info("onsets: %s", onsets)
+    logging.info("tempo: %s", tempo)
+    return onsets, tempo
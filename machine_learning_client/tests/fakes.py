@@ -0,0 +1,12 @@
+"""Stand-ins shared by the tests"""
+import numpy as np
+
+CENTS_MAPPING = np.linspace(0, 7180, 360) + 1997.3794084376191
+
+
+def zero_crossing_model(frames, **_):
+    """Stand-in pitch model: activation peaks at the zero-crossing pitch."""
+    crossings = np.sum(np.diff(np.sign(frames), axis=1) != 0, axis=1)
+    cents = 1200 * np.log2(np.maximum(crossings, 1) * 16000 / 2048 / 10)
+    bins = np.abs(cents[:, None] - CENTS_MAPPING).argmin(axis=1)
+    return 0.9 * np.exp(-((np.arange(360) - bins[:, None]) ** 2) / 8)
@@ -0,0 +1,276 @@
+"""Tests for pitch detection, smoothing and note durations"""
+from unittest.mock import patch
+import pytest
+import numpy as np
+from .. import midi, pitch, rhythm
+from ..ml import app
+from .fakes import zero_crossing_model
+
+
+class TestAnalysis:
+    """Pitch, smoothing and envelope tests"""
+
+    @pytest.fixture
+    def client(self):
+        """Test client for web app"""
+        app.config["TESTING"] = True
+        with app.test_client() as test_client:
+            yield test_client
+
+    @patch("machine_learning_client.pitch.crepe.predict")
+    @patch("machine_learning_client.pitch.crepe.core.build_and_load_model")
+    def test_load_pitch_model(self, mock_build, mock_predict, client):
+        """The model is loaded and warmed up once before reporting ready."""
+        was_ready = pitch.model_ready.is_set()
+        pitch.model_ready.clear()
+        try:
+            assert client.get("/ready").status_code == 503
+
+            load_time, warmup_time = pitch.load_pitch_model("tiny")
+
+            mock_build.assert_called_once_with("tiny")
+            assert mock_predict.call_args[1]["model_capacity"] == "tiny"
+            assert load_time >= 0 and warmup_time >= 0
+            assert client.get("/ready").status_code == 200
+        finally:
+            if not was_ready:
+                pitch.model_ready.clear()
+
+        with pytest.raises(ValueError):
+            pitch.load_pitch_model("huge")
+
+    @patch("machine_learning_client.pitch.crepe.core.build_and_load_model")
+    def test_predict_pitch_single_batched_pass(self, mock_build):
+        """The whole signal is framed once and timestamps never restart."""
+        activation = np.zeros((201, 360))
+        activation[:, 100] = 0.9
+        mock_build.return_value.predict.return_value = activation
+        audio = np.random.randn(32000)  # two seconds at 16 kHz
+
+        times, frequency, confidence = pitch.predict_pitch(
+            audio, 16000, batch_size=64, viterbi=False
+        )
+
+        mock_build.return_value.predict.assert_called_once()
+        frames = mock_build.return_value.predict.call_args[0][0]
+        assert frames.shape == (201, 1024)
+        assert mock_build.return_value.predict.call_args[1]["batch_size"] == 64
+        assert np.allclose(frames.mean(axis=1), 0, atol=1e-4)
+        assert np.allclose(np.diff(times), 0.01) and times[-1] == 2.0
+        assert np.allclose(confidence, 0.9)
+        assert np.all(frequency > 0)
+
+    def test_pitch_to_notes_data_matches_per_frame(self):
+        """The vectorized path gives the same notes as the per-frame loop."""
+        rng = np.random.default_rng(0)
+        times = np.arange(500) * 0.01
+        frequency = rng.uniform(50, 2000, 500)
+        frequency[:4] = [0.0, 1.0, 5000.0, 30000.0]  # outside the 0-127 table
+        confidence = rng.uniform(0, 1, 500).astype(np.float32)
+        confidence[:4] = 1.0
+
+        expected = [
+            {
+                "time": float(t),
+                "note": pitch.frequency_to_note_name(f),
+                "confidence": round(float(c), 2),
+            }
+            for t, f, c in zip(times, frequency, confidence)
+            if c >= 0.74 and f > 0
+        ]
+
+        assert pitch.pitch_to_notes_data(times, frequency, confidence) == expected
+
+    def test_smooth_pitch_data_matches_window_loop(self):
+        """The prefix-count filter gives the same output as rebuilding each window."""
+
+        def reference(notes_data, window_size):
+            smoothed_data = []
+            for i in range(len(notes_data)):
+                start = max(i - window_size // 2, 0)
+                end = min(i + window_size // 2 + 1, len(notes_data))
+                window = notes_data[start:end]
+                note_counts = {}
+                for note in window:
+                    note_counts[note["note"]] = note_counts.get(note["note"], 0) + 1
+                smoothed_data.append(
+                    {
+                        "time": sum(note["time"] for note in window) / len(window),
+                        "note": max(note_counts, key=note_counts.get),
+                    }
+                )
+            return smoothed_data
+
+        rng = np.random.default_rng(7)
+        names = ["C4", "D4", "E4", None]
+        notes_data = [
+            {"time": float(t), "note": names[rng.integers(0, 4)]}
+            for t in np.cumsum(rng.uniform(0.005, 0.02, 400))
+        ]
+
+        for window_size in (1, 2, 5, 8, 11):
+            assert midi.smooth_pitch_data(notes_data, window_size) == reference(
+                notes_data, window_size
+            )
+        assert not midi.smooth_pitch_data([])
+
+    def test_sliding_mode_chunks(self):
+        """Splitting the rows into chunks does not change any window's mode."""
+        values = np.random.default_rng(3).integers(40, 50, 1000)
+        for window_size in (3, 5, 21):
+            whole = midi.sliding_mode(values, window_size, chunk_elements=10**9)
+            for chunk_elements in (1, 100, 5000):
+                np.testing.assert_array_equal(
+                    midi.sliding_mode(values, window_size, chunk_elements), whole
+                )
+
+    def test_envelope_and_durations_match_loops(self):
+        """Array versions agree with the original per-hop loops."""
+
+        def reference_envelope(y, frame_size, hop_length):
+            return np.array(
+                [
+                    np.sqrt(np.mean(y[i : i + frame_size] ** 2))
+                    for i in range(0, len(y), hop_length)
+                ]
+            )
+
+        def reference_end(amp_env, onset_sample, end_sample):
+            for j in range(onset_sample, end_sample, 512):
+                if amp_env[j // 512] < 0.025:
+                    return j
+            return end_sample
+
+        sr = 8000
+        rng = np.random.default_rng(3)
+        y = rng.normal(0, 0.2, sr * 4)
+        y[5000:9000] = 0
+        y[20000:26000] *= 0.01
+        onsets = [0.1, 0.3, 0.5, 1.7, 2.0, 3.9]
+
+        for frame_size, hop_length in ((1024, 512), (3, 3), (300, 512)):
+            np.testing.assert_allclose(
+                rhythm.calculate_amplitude_envelope(y, frame_size, hop_length),
+                reference_envelope(y, frame_size, hop_length),
+                rtol=1e-10,
+            )
+
+        amp_env = reference_envelope(y, 1024, 512)
+        samples = np.array([int(onset * sr) for onset in onsets] + [len(y)])
+        expected = [
+            reference_end(amp_env, start, end)
+            for start, end in zip(samples[:-1], samples[1:])
+        ]
+        ends = rhythm.find_note_ends(amp_env, samples[:-1], samples[1:], 0.025)
+        assert ends.tolist() == expected
+        assert ends.tolist() != samples[1:].tolist()
+
+        amp_env = reference_envelope(y, sr, 512)
+        expected = [
+            max((reference_end(amp_env, start, end) - start) / sr, 0.05)
+            for start, end in zip(samples[:-1], samples[1:])
+        ]
+        assert rhythm.estimate_note_durations(onsets, y, sr=sr) == expected
+
+    @pytest.mark.parametrize("backend", ["pyin", "yin"])
+    def test_dsp_pitch_backends(self, backend):
+        """The DSP trackers return CREPE-shaped arrays that find a tone."""
+        sr = 44100
+        t = np.arange(sr) / sr
+        tone = 0.5 * np.sin(2 * np.pi * 440 * t)
+
+        # They must not need crepe, or TensorFlow, to be installed
+        with patch("machine_learning_client.pitch.crepe", new=object()):
+            times, frequency, confidence = pitch.detect_pitch(tone, sr, backend=backend)
+
+        assert len(times) == len(frequency) == len(confidence) == 101
+        assert np.allclose(np.diff(times), 0.01)
+        voiced = confidence >= 0.74
+        assert voiced.mean() > 0.9
+        assert np.allclose(frequency[voiced], 440, rtol=0.01)
+
+        _, _, silent = pitch.detect_pitch(np.zeros(sr), sr, backend=backend)
+        assert silent.max() < 0.5
+
+    def test_pyin_unvoiced_frames_make_no_notes(self):
+        """Frames pYIN calls unvoiced never reach the MIDI file as notes."""
+        frequency = np.array([440.0, np.nan, np.nan, 440.0])
+        voiced = np.array([True, False, True, True])
+        probability = np.array([0.9, 0.95, 0.9, 0.9])
+        with patch(
+            "machine_learning_client.pitch.librosa.pyin",
+            return_value=(frequency, voiced, probability),
+        ):
+            times, frequency, confidence = pitch.predict_pitch_pyin(
+                np.ones(16000), 16000
+            )
+        assert frequency.tolist() == [440.0, 0.0, 0.0, 440.0]
+        assert confidence.tolist() == [0.9, 0.0, 0.0, 0.9]
+
+        # A pitchless frame that passes the threshold is dropped as well
+        notes_data = pitch.pitch_to_notes_data(
+            times, [440.0, 0.0, 0.0, 440.0], [0.9] * 4
+        )
+        assert [note["note"] for note in notes_data] == ["A4", "A4"]
+        midi.midi_to_bytes(midi.process_notes(notes_data), [0.0], [0.04], 120)
+
+    def test_voiced_frames_keep_quiet_singing(self):
+        """Silence is skipped, while quiet singing above the floor is kept."""
+        sr = 16000
+        t = np.arange(sr) / sr
+        loud = 0.5 * np.sin(2 * np.pi * 440 * t)
+        quiet = 0.0015 * np.sin(2 * np.pi * 440 * t)  # about -57 dBFS RMS
+        audio = np.concatenate([np.zeros(sr), loud, np.zeros(sr), quiet])
+
+        active = pitch.voiced_frames(audio)
+
+        assert len(active) == len(audio) // 160 + 1
+        assert not active[20:80].any()  # leading silence, beyond the padding
+        assert active[110:190].all() and active[310:390].all()
+        with patch("machine_learning_client.config.vad_floor_db", -40):
+            assert not pitch.voiced_frames(audio)[310:390].any()
+
+    @patch("machine_learning_client.pitch.crepe.core.build_and_load_model")
+    def test_predict_pitch_skips_silent_frames(self, mock_build):
+        """Only voiced frames reach the model and timestamps stay absolute."""
+        mock_build.return_value.predict.side_effect = lambda frames, **kwargs: (
+            np.tile(np.eye(360)[100], (len(frames), 1)) * 0.9
+        )
+        t = np.arange(16000) / 16000
+        audio = np.concatenate([np.zeros(32000), np.sin(2 * np.pi * 440 * t)])
+
+        times, frequency, confidence = pitch.predict_pitch(audio, 16000)
+
+        sent = mock_build.return_value.predict.call_args[0][0]
+        assert len(sent) < len(times) / 2
+        # Only the voiced windows are normalized, with the same result
+        np.testing.assert_array_equal(
+            sent, pitch.frame_audio(audio, 16000)[pitch.voiced_frames(audio)]
+        )
+        assert len(times) == 301 and times[-1] == pytest.approx(3.0)
+        assert (confidence[:150] == 0).all() and (frequency[:150] == 0).all()
+        assert np.allclose(confidence[220:], 0.9)
+
+    @patch("machine_learning_client.pitch.crepe.core.build_and_load_model")
+    def test_adaptive_pitch_step(self, mock_build):
+        """Adaptive mode evaluates far fewer frames and keeps the pitch track."""
+        mock_build.return_value.predict.side_effect = zero_crossing_model
+        t = np.arange(16000) / 16000
+        audio = np.concatenate(
+            [np.sin(2 * np.pi * frequency * t) for frequency in (440, 523.25, 392)]
+        )
+
+        baseline = pitch.predict_pitch(audio, 16000)
+        baseline_frames = mock_build.return_value.predict.call_args[0][0].shape[0]
+        mock_build.return_value.predict.reset_mock()
+        with patch("machine_learning_client.config.pitch_step_mode", "adaptive"):
+            times, frequency, _ = pitch.predict_pitch(audio, 16000)
+
+        evaluated = sum(
+            call[0][0].shape[0]
+            for call in mock_build.return_value.predict.call_args_list
+        )
+        assert np.array_equal(times, baseline[0])
+        assert evaluated < 0.4 * baseline_frames
+        cents = np.abs(1200 * np.log2(frequency / baseline[1]))
+        assert np.mean(cents < 50) > 0.97
@@ -0,0 +1,117 @@
+"""Tests for decoding uploads into shared audio"""
+import io
+import os
+from unittest.mock import MagicMock, patch
+import pytest
+import numpy as np
+import soundfile as sf
+from .. import audio, config, ml, rhythm
+
+
+class TestAudio:
+    """Audio decoding and AudioContext tests"""
+
+    def test_audio_context_matches_librosa_load(self):
+        """Decoding once should give the same signal librosa.load returns."""
+        test_dir = os.path.dirname(__file__)
+        sample_audio_file = os.path.join(test_dir, "test_audio.wav")
+
+        audio_ctx = audio.AudioContext.from_file(sample_audio_file)
+        expected, _ = audio.librosa.load(sample_audio_file, sr=44100)
+
+        np.testing.assert_allclose(audio_ctx.at_rate(44100), expected, atol=1e-6)
+        assert audio_ctx.at_rate(44100) is audio_ctx.at_rate(44100)
+        assert np.isclose(audio_ctx.duration, 5.042, atol=1e-3)
+
+    def test_analysis_accepts_audio_context(self):
+        """Onsets and tempo from a context should match the path-based calls."""
+        test_dir = os.path.dirname(__file__)
+        sample_audio_file = os.path.join(test_dir, "test_audio.wav")
+        audio_ctx = audio.AudioContext.from_file(sample_audio_file)
+
+        with patch("machine_learning_client.audio.librosa.load") as mock_load:
+            onsets = rhythm.detect_note_onsets(audio_ctx)
+            tempo = rhythm.estimate_tempo(audio_ctx)
+            durations = rhythm.estimate_note_durations(onsets, audio_ctx, sr=44100)
+            mock_load.assert_not_called()
+
+        np.testing.assert_allclose(onsets, rhythm.detect_note_onsets(sample_audio_file))
+        assert np.allclose(tempo, 105.46875, rtol=1e-5)
+        assert len(durations) == len(onsets)
+
+    @patch("machine_learning_client.audio.subprocess.run")
+    def test_decode_webm_to_pcm(self, mock_run):
+        """Uploaded bytes go to ffmpeg's stdin and PCM comes back on stdout."""
+        pcm = np.array([0.0, 0.5, -0.5], dtype=np.float32)
+        mock_run.return_value = MagicMock(returncode=0, stdout=pcm.tobytes())
+
+        samples = audio.decode_webm_to_pcm(b"webm bytes", sr=16000)
+
+        np.testing.assert_array_equal(samples, pcm)
+        args, kwargs = mock_run.call_args
+        assert args[0][args[0].index("-i") + 1] == "pipe:0"
+        assert args[0][args[0].index("-ar") + 1] == "16000"
+        assert args[0][-1] == "pipe:1"
+        assert kwargs["input"] == b"webm bytes"
+
+    @patch("machine_learning_client.audio.subprocess.run")
+    def test_decode_upload_pipe_mode(self, mock_run):
+        """Pipe mode builds the context in memory without temporary files."""
+        pcm = np.zeros(44100, dtype=np.float32)
+        mock_run.return_value = MagicMock(returncode=0, stdout=pcm.tobytes())
+        audio_stream = MagicMock()
+        audio_stream.read.return_value = b"webm bytes"
+
+        with patch("machine_learning_client.audio.write_audio_to_file") as mock_write:
+            audio_ctx = audio.decode_upload(audio_stream)
+            mock_write.assert_not_called()
+
+        assert audio_ctx.sr == config.decode_sample_rate
+        assert len(audio_ctx.audio) == 44100
+
+        mock_run.return_value = MagicMock(returncode=1, stderr=b"bad input")
+        with pytest.raises(ValueError):
+            audio.decode_webm_to_pcm(b"not webm")
+
+    def test_decode_upload_file_mode_is_isolated(self):
+        """Concurrent file-mode decodes must not overwrite each other's files."""
+
+        def fake_convert(webm_file, wav_file):
+            with open(webm_file, "rb") as file:
+                level = len(file.read()) / 10
+            sf.write(wav_file, np.full(100, level), 16000)
+
+        payloads = [b"x" * size for size in range(1, 9)]
+        with patch("machine_learning_client.config.decode_mode", "file"), patch(
+            "machine_learning_client.audio.convert_webm_to_wav",
+            side_effect=fake_convert,
+        ):
+            contexts = list(
+                ml.worker_pool.map(
+                    lambda data: audio.decode_upload(io.BytesIO(data)), payloads
+                )
+            )
+
+        for payload, audio_ctx in zip(payloads, contexts):
+            assert np.allclose(audio_ctx.audio, len(payload) / 10, atol=1e-4)
+        assert not os.path.exists("temp_recording.webm")
+
+    def test_each_analysis_rate_resampled_once(self):
+        """Pitch gets 16 kHz audio and onset/tempo work the analysis rate."""
+        audio_ctx = audio.AudioContext(np.random.randn(44100).astype(np.float32), 44100)
+        resample = audio.librosa.resample
+        empty = (np.zeros(0), np.zeros(0), np.zeros(0))
+        with patch(
+            "machine_learning_client.audio.librosa.resample", side_effect=resample
+        ) as mock_resample, patch(
+            "machine_learning_client.pitch.predict_pitch", return_value=empty
+        ) as mock_pitch, patch(
+            "machine_learning_client.config.analysis_sample_rate", 22050
+        ):
+            ml.analyze_transcription(audio_ctx)
+
+        pitch_audio, pitch_sr = mock_pitch.call_args[0]
+        assert pitch_sr == 16000 and len(pitch_audio) == 16000
+        targets = sorted(call[1]["target_sr"] for call in mock_resample.call_args_list)
+        assert targets == [16000, 22050]
+        assert audio_ctx.at_rate(22050) is audio_ctx.at_rate(22050)
@@ -0,0 +1,76 @@
+"""Tests for pipeline metrics and the benchmark"""
+from unittest.mock import patch
+import pytest
+import numpy as np
+from .. import audio, benchmark, metrics, ml
+from ..ml import app
+
+
+class TestMetrics:
+    """Metrics and benchmark tests"""
+
+    @pytest.fixture
+    def client(self):
+        """Test client for web app"""
+        app.config["TESTING"] = True
+        with app.test_client() as test_client:
+            yield test_client
+
+    def test_histogram_buckets(self):
+        """Observations land in cumulative upper-bound buckets."""
+        histogram = metrics.Histogram(buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value)
+
+        snapshot = histogram.snapshot()
+        assert snapshot["buckets"] == {"0.1": 2, "1": 3, "+Inf": 4}
+        assert snapshot["count"] == 4 and np.isclose(snapshot["sum"], 3.65)
+
+    def test_metrics_endpoint(self, client):
+        """Stage timings, counters and gauges are exposed for Prometheus."""
+        with metrics.jobs_in_flight.track():
+            with metrics.stage_timer("unit_test_stage"):
+                pass
+            metrics.error_count.inc(label="UnitTestError")
+            client.get("/ready")
+            body = client.get("/metrics").get_data(as_text=True)
+
+        assert "# TYPE ml_stage_seconds histogram" in body
+        assert 'ml_stage_seconds_bucket{stage="unit_test_stage",le="+Inf"} 1' in body
+        assert 'ml_stage_seconds_count{stage="unit_test_stage"} 1' in body
+        assert 'ml_requests_total{endpoint="ready"}' in body
+        assert 'ml_errors_total{type="UnitTestError"} 1' in body
+        assert "ml_jobs_in_flight 1" in body
+        assert "ml_audio_seconds_total" in body
+        assert metrics.jobs_in_flight.value == 0
+
+    def test_pipeline_stages_are_timed(self):
+        """Running the analysis fills the per-stage histograms."""
+        audio_ctx = audio.AudioContext(np.zeros(44100), 44100)
+        before = metrics.audio_seconds.snapshot().get(None, 0)
+        with patch(
+            "machine_learning_client.rhythm.detect_note_onsets", return_value=[0.0]
+        ), patch("machine_learning_client.rhythm.estimate_tempo", return_value=120):
+            ml.analyze_transcription(
+                audio_ctx, [{"time": 0.0, "note": "A4", "confidence": 0.9}]
+            )
+
+        for stage in ("onsets", "tempo", "durations", "smoothing"):
+            assert metrics.stage_latency[stage].snapshot()["count"] >= 1
+        assert metrics.audio_seconds.snapshot()[None] == before + 1.0
+
+    def test_benchmark_compare_reports(self):
+        """Benchmark runs are compared stage by stage against a baseline."""
+        baseline = {"signals": {"a": {"stages": {"decode": {"seconds": 1.0}}}}}
+        report = {
+            "signals": {
+                "a": {"stages": {"decode": {"seconds": 1.5}, "create_midi": {}}},
+                "b": {"stages": {"decode": {"seconds": 0.1}}},
+            }
+        }
+        rows = benchmark.compare_reports(baseline, report, tolerance=0.1)
+        assert rows == [("a", "decode", 1.0, 1.5, 1.5, True)]
+
+        melody = benchmark.generate_melody(2)
+        assert len(melody) == 2 * benchmark.SAMPLE_RATE
+        assert np.abs(melody).max() < 1
@@ -9,8 +9,9 @@ import tempfile
 import pytest
 import numpy as np
 import pretty_midi
-from .. import ml
-from ..ml import s3, app
+from .. import audio, midi, ml, pitch, rhythm
+from ..ml import app
+from ..uploads import s3
 
 # Mocking AWS S3
 s3 = MagicMock()
@@ -34,7 +35,7 @@ class TestsClass1:
     # Test for frequency_to_note_name
     def test_frequency_to_note_name(self):
         """Provided valid frequency, return note name."""
-        actual = ml.frequency_to_note_name(random.uniform(8.1758, 12543.854))
+        actual = pitch.frequency_to_note_name(random.uniform(8.1758, 12543.854))
         midi_note_names = [
             "C0",
             "C#0",
@@ -156,12 +157,12 @@ class TestsClass1:
         assert actual in midi_note_names
 
     # Test for successful convert_webm_to_wav
-    @patch("machine_learning_client.ml.subprocess.run")
+    @patch("machine_learning_client.audio.subprocess.run")
     def test_convert_webm_to_wav_success(self, mock_run):
         """Given WebM audio file, convert to WAV format."""
         mock_run.return_value.returncode = 0
 
-        ml.convert_webm_to_wav("test_input.webm", "test_output.wav")
+        audio.convert_webm_to_wav("test_input.webm", "test_output.wav")
 
         mock_run.assert_called_with(
             ["ffmpeg", "-i", "test_input.webm", "test_output.wav"],
@@ -171,14 +172,14 @@ class TestsClass1:
         )
 
     # Test for failure convert_webm_to_wav
-    @patch("machine_learning_client.ml.subprocess.run")
+    @patch("machine_learning_client.audio.subprocess.run")
     def test_convert_webm_to_wav_failure(self, mocker):
         """Test failure scenario for convert_webm_to_wav."""
         mocker.return_value = MagicMock(returncode=1, stderr=MagicMock())
         mocker.return_value.stderr.decode.return_value = "ffmpeg error message"
 
         with pytest.raises(ValueError) as exc_info:
-            ml.convert_webm_to_wav("test_input.webm", "test_output.wav")
+            audio.convert_webm_to_wav("test_input.webm", "test_output.wav")
 
         assert "Error converting WebM to WAV" in str(exc_info.value)
 
@@ -190,15 +191,15 @@ class TestsClass1:
         )
 
     # Test for process_audio_chunks
-    @patch("machine_learning_client.ml.sf.read")
-    @patch("machine_learning_client.ml.crepe.predict")
-    @patch("machine_learning_client.ml.pretty_midi.hz_to_note_number")
-    @patch("machine_learning_client.ml.pretty_midi.note_number_to_name")
+    @patch("machine_learning_client.audio.sf.read")
+    @patch("machine_learning_client.pitch.predict_pitch")
+    @patch("machine_learning_client.midi.pretty_midi.hz_to_note_number")
+    @patch("machine_learning_client.midi.pretty_midi.note_number_to_name")
     def test_process_audio_chunks(
         self,
         mock_note_number_to_name,
         mock_hz_to_note_number,
-        mock_crepe_predict,
+        mock_predict_pitch,
         mock_soundfile_read,
     ):
         """Mock audio processing"""
@@ -206,11 +207,10 @@ class TestsClass1:
         sr = 22050  # Example sampling rate
         mock_soundfile_read.return_value = (fake_audio, sr)
 
-        mock_crepe_predict.return_value = (
+        mock_predict_pitch.return_value = (
             np.array([0.1, 0.2]),  # time
             np.array([440, 880]),  # frequency
             np.array([0.8, 0.75]),  # confidence
-            None,  # additional return value
         )
 
         mock_hz_to_note_number.side_effect = (
@@ -218,7 +218,7 @@ class TestsClass1:
         )  # A4 and A5 note numbers
         mock_note_number_to_name.side_effect = lambda n: "A4" if n == 69 else "A5"
 
-        notes_data = ml.process_audio_chunks(fake_audio, sr)
+        notes_data = pitch.process_audio_chunks(fake_audio, sr)
         assert len(notes_data) >= 2, "Should at least identify two notes"
         assert notes_data[0]["note"] == "A4", "First note should be A4"
         assert notes_data[1]["note"] == "A5", "Second note should be A5"
@@ -227,13 +227,13 @@ class TestsClass1:
         ), "Confidence should be above threshold"
 
     # Test for clean_up_files
-    @patch("machine_learning_client.ml.os.remove")
+    @patch("machine_learning_client.audio.os.remove")
     def test_clean_up_files(self, mock_remove):
         """Mock remove temporary audio files."""
         webm_file = "test_audio.webm"
         wav_file = "test_audio.wav"
 
-        ml.clean_up_files(webm_file, wav_file)
+        audio.clean_up_files(webm_file, wav_file)
 
         mock_remove.assert_any_call(webm_file)
         mock_remove.assert_any_call(wav_file)
@@ -251,7 +251,7 @@ class TestsClass1:
         test_file_name = "test_audio_file.webm"
 
         # Call the function with the mock stream
-        ml.write_audio_to_file(test_file_name, mocker)
+        audio.write_audio_to_file(test_file_name, mocker)
 
         # Read back the file and assert its contents
         with open(test_file_name, "rb") as file:
@@ -282,7 +282,7 @@ class TestsClass1:
             {"note": "C", "time": 1.0},
         ]
 
-        sorted_notes = ml.sort_notes_data(notes_data)
+        sorted_notes = midi.sort_notes_data(notes_data)
 
         assert (
             sorted_notes == expected_sorted_notes
@@ -299,13 +299,17 @@ class TestsClass1:
             {"note": "E", "time": 0.5},
         ]
 
-        expected_processed_notes = [{"note": "C"}, {"note": "E"}]
+        processed_notes = midi.process_notes(notes_data)
 
-        processed_notes = ml.process_notes(notes_data)
-
-        assert (
-            processed_notes == expected_processed_notes
-        ), "The sorted notes do not match the expected result"
+        assert [note["note"] for note in processed_notes] == [
+            "C",
+            "E",
+        ], "The sorted notes do not match the expected result"
+        # Segments keep the smoothed times of their first and last frames
+        assert np.allclose(
+            [[note["start_time"], note["end_time"]] for note in processed_notes],
+            [[0.2, 0.3], [0.35, 0.4]],
+        )
 
     # Test for generate_midi_url
     @patch("machine_learning_client.ml.create_midi")
@@ -359,7 +363,7 @@ class TestsClass1:
         ]
 
         # Call the function
-        result = ml.smooth_pitch_data(notes_data)
+        result = midi.smooth_pitch_data(notes_data)
 
         assert (
             result == expected_smoothed_data
@@ -377,10 +381,14 @@ class TestsClass1:
             {"note": "E", "time": 0.5},
         ]
 
-        expected_filtered_notes = [{"note": "C"}, {"note": "D"}, {"note": "E"}]
+        expected_filtered_notes = [
+            {"note": "C", "start_time": 0.1, "end_time": 0.2},
+            {"note": "D", "start_time": 0.3, "end_time": 0.3},
+            {"note": "E", "start_time": 0.4, "end_time": 0.5},
+        ]
 
         # Call the function
-        result = ml.filter_and_combine_notes(test_notes_data)
+        result = midi.filter_and_combine_notes(test_notes_data)
 
         # Assertions to check if the function behaves as expected
         assert (
@@ -388,8 +396,8 @@ class TestsClass1:
         ), "The filtered notes do not match the expected result"
 
     # Test for detect_note_onsets
-    @patch("machine_learning_client.ml.librosa.onset.onset_detect")
-    @patch("machine_learning_client.ml.librosa.load")
+    @patch("machine_learning_client.rhythm.librosa.onset.onset_detect")
+    @patch("machine_learning_client.audio.librosa.load")
     def test_detect_note_onsets(self, mock_load, mock_onset_detect):
         """Test to detect when notes begin or onset."""
         mock_load.return_value = (
@@ -403,7 +411,7 @@ class TestsClass1:
         audio_file = "test_audio.wav"
 
         # Call the function
-        result_onsets = ml.detect_note_onsets(audio_file)
+        result_onsets = rhythm.detect_note_onsets(audio_file)
 
         # Assertions to check if the function behaves as expected
         assert (
@@ -422,7 +430,7 @@ class TestsClass1:
         """
         test_dir = os.path.dirname(__file__)
         sample_audio_file = os.path.join(test_dir, "test_audio.wav")
-        tempo = ml.estimate_tempo(sample_audio_file)
+        tempo = rhythm.estimate_tempo(sample_audio_file)
         print(tempo)
 
         assert isinstance(tempo, (int, float)), "Tempo should be a numeric value"
@@ -435,7 +443,7 @@ class TestsClass1:
         test_signal = np.array([1, 2, 3, 4, 5, 4, 3, 2, 1])
 
         # Call the function with the test signal
-        envelope = ml.calculate_amplitude_envelope(
+        envelope = rhythm.calculate_amplitude_envelope(
             test_signal, frame_size=3, hop_length=3
         )
 
@@ -458,7 +466,7 @@ class TestsClass1:
         y = np.random.randn(44100)  # Mock audio signal with 1-second duration
 
         # Call the function with the mock data and print the duration to see expected values
-        durations = ml.estimate_note_durations(onsets, y, sr=44100, threshold=0.025)
+        durations = rhythm.estimate_note_durations(onsets, y, sr=44100, threshold=0.025)
         print("Calculated Durations:", durations)
 
         # Assertions are based on if the values are an int/float
@@ -473,7 +481,11 @@ class TestsClass1:
         """
 
         # Mock input data for testing
-        filtered_notes = [{"note": "C4"}, {"note": "E4"}, {"note": "G4"}]
+        filtered_notes = [
+            {"note": "C4", "start_time": 0.1, "end_time": 0.28},
+            {"note": "E4", "start_time": 0.3, "end_time": 0.58},
+            {"note": "G4", "start_time": 0.6, "end_time": 0.98},
+        ]
         onsets = [0.1, 0.3, 0.6]
         durations = [0.2, 0.3, 0.4]
 
@@ -484,13 +496,34 @@ class TestsClass1:
         )
 
         # Call the function with the mock data
-        instrument = ml.create_midi_instrument(filtered_notes, onsets, durations)
+        instrument = midi.create_midi_instrument(filtered_notes, onsets, durations)
 
         # Assert that the instrument is an instrument of pretty_midi
         # Asset that the length of the notes of the instrument is the same as the input
         assert isinstance(instrument, pretty_midi.Instrument)
         assert len(instrument.notes) == len(filtered_notes)
 
+    def test_assemble_note_events_by_time(self):
+        """Pitches go to the onsets they overlap, whatever the counts."""
+        filtered_notes = [
+            {"note": "C4", "start_time": 0.0, "end_time": 0.25},
+            {"note": "E4", "start_time": 0.3, "end_time": 0.55},
+            {"note": "F4", "start_time": 0.56, "end_time": 0.58},
+            {"note": "G4", "start_time": 0.6, "end_time": 1.0},
+        ]
+        # No onset for E4, two for G4 and one over a silence
+        onsets = [0.02, 0.59, 0.8, 1.5]
+        durations = [0.2, 0.2, 0.2, 0.1]
+
+        events = midi.assemble_note_events(filtered_notes, onsets, durations)
+
+        assert [event["note"] for event in events] == ["C4", "G4", "G4"]
+        assert np.allclose(
+            [[event["start_time"], event["end_time"]] for event in events],
+            [[0.02, 0.22], [0.59, 0.79], [0.8, 1.0]],
+        )
+        assert not midi.assemble_note_events([], onsets, durations)
+
     def test_create_midi(self, mocker):
         """
         This ensures the file is named output.mid
@@ -498,7 +531,11 @@ class TestsClass1:
         """
 
         # Mock input data for testing
-        filtered_notes = [{"note": "C4"}, {"note": "E4"}, {"note": "G4"}]
+        filtered_notes = [
+            {"note": "C4", "start_time": 0.1, "end_time": 0.28},
+            {"note": "E4", "start_time": 0.3, "end_time": 0.58},
+            {"note": "G4", "start_time": 0.6, "end_time": 0.98},
+        ]
         onsets = [0.1, 0.3, 0.6]
         durations = [0.2, 0.3, 0.4]
         tempo = 120
@@ -535,7 +572,7 @@ class TestsClass1:
         onsets = []  # Empty list of onsets
         y = np.random.randn(44100)  # Mock audio signal with 1-second duration
 
-        durations = ml.estimate_note_durations(onsets, y, sr=44100, threshold=0.025)
+        durations = rhythm.estimate_note_durations(onsets, y, sr=44100, threshold=0.025)
 
         assert not durations, "Durations should be an empty list with no onsets."
 
@@ -543,7 +580,7 @@ class TestsClass1:
         """Test calculating amplitude envelope for signal with all zero values."""
         test_signal = np.zeros(10)  # Signal with all zero values
 
-        envelope = ml.calculate_amplitude_envelope(
+        envelope = rhythm.calculate_amplitude_envelope(
             test_signal, frame_size=3, hop_length=3
         )
 
@@ -562,7 +599,7 @@ class TestsClass2:
     @pytest.fixture
     def mock_s3(self):
         """Fixture for receiving the s3 values"""
-        with patch("machine_learning_client.ml.s3", s3):
+        with patch("machine_learning_client.uploads.s3", s3):
             yield s3
 
     def test_create_and_store_midi_in_s3(self, mock_s3):
@@ -598,7 +635,7 @@ class TestsClass2:
 
             # Asserts the upload path is the same.
             s3.upload_file.assert_called_once_with(
-                f"static/output_{test_unique_id}.mid",
+                os.path.join(app.root_path, "static", f"output_{test_unique_id}.mid"),
                 s3_bucket_name,
                 f"output_{test_unique_id}.mid",
             )
@@ -617,9 +654,8 @@ class TestsClass2:
             )
 
             # Check if upload_file was called with the correct local file path
-            assert (
-                mock_s3.upload_file.call_args[0][0]
-                == f"static/output_{test_unique_id}.mid"
+            assert mock_s3.upload_file.call_args[0][0] == os.path.join(
+                app.root_path, "static", f"output_{test_unique_id}.mid"
             )
 
     def test_store_in_db(self, caplog):
@@ -0,0 +1,250 @@
+"""Tests for the transcription pipeline, jobs and result cache"""
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+import pytest
+from botocore.exceptions import ClientError
+import numpy as np
+from .. import audio, ml, pitch, uploads
+from ..ml import app
+
+
+class TestPipeline:
+    """Pipeline, job and cache tests"""
+
+    @pytest.fixture
+    def client(self):
+        """Test client for web app"""
+        app.config["TESTING"] = True
+        with app.test_client() as test_client:
+            yield test_client
+
+    def test_concurrent_process_requests(self):
+        """Simultaneous /process calls each get their own result."""
+
+        def fake_transcribe(audio_bytes, backend=None):
+            assert backend == "crepe"
+            return f"https://bucket/{audio_bytes.decode()}.mid"
+
+        def post(index):
+            data = {"audio": (io.BytesIO(str(index).encode()), "a.webm", "audio/webm")}
+            response = app.test_client().post("/process", data=data)
+            return response.get_json()["midi_url"]
+
+        with patch(
+            "machine_learning_client.ml.transcribe_audio", side_effect=fake_transcribe
+        ):
+            with ThreadPoolExecutor(max_workers=4) as pool:
+                urls = list(pool.map(post, range(8)))
+
+        assert urls == [f"https://bucket/{index}.mid" for index in range(8)]
+
+    def test_async_process_job(self, client):
+        """Async /process returns 202 and the job can be polled to completion."""
+        with patch(
+            "machine_learning_client.ml.transcribe_audio",
+            return_value="https://bucket/output.mid",
+        ):
+            response = client.post(
+                "/process?mode=async",
+                data={"audio": (io.BytesIO(b"webm"), "a.webm", "audio/webm")},
+            )
+            assert response.status_code == 202
+            job_id = response.get_json()["job_id"]
+
+            for _ in range(100):
+                job = client.get(f"/jobs/{job_id}").get_json()
+                if job["status"] in ("done", "failed"):
+                    break
+                time.sleep(0.01)
+
+        assert job["status"] == "done"
+        assert job["midi_url"] == "https://bucket/output.mid"
+        assert client.get("/jobs/unknown").status_code == 404
+
+    def test_failed_job_reports_error(self):
+        """An exception in the worker marks the job as failed."""
+        job_id = ml.create_job()
+        with patch(
+            "machine_learning_client.audio.decode_upload",
+            side_effect=ValueError("Error decoding WebM audio"),
+        ):
+            future = ml.worker_pool.submit(ml.run_job, job_id, b"webm", None)
+            future.add_done_callback(lambda done: ml.finish_job(job_id, done))
+            with pytest.raises(ValueError):
+                future.result()
+
+        for _ in range(100):
+            if ml.get_job(job_id)["status"] == "failed":
+                break
+            time.sleep(0.01)
+        job = ml.get_job(job_id)
+        assert job["status"] == "failed" and job["stage"] == "decode"
+        assert "Error decoding" in job["error"]
+
+    def test_result_cache_reuses_identical_uploads(self):
+        """A duplicate upload returns the stored URL without re-running the pipeline."""
+        ml.result_cache.clear()
+        urls = iter(["https://bucket/a.mid", "https://bucket/b.mid"])
+
+        def stored_midi(*_, on_stored):
+            midi_url = next(urls)
+            on_stored(midi_url)
+            return midi_url
+
+        with patch("machine_learning_client.audio.decode_upload") as mock_decode, patch(
+            "machine_learning_client.pitch.process_audio_chunks", return_value=[]
+        ), patch(
+            "machine_learning_client.rhythm.detect_note_onsets", return_value=[]
+        ), patch(
+            "machine_learning_client.rhythm.estimate_note_durations", return_value=[]
+        ), patch(
+            "machine_learning_client.rhythm.estimate_tempo", return_value=120
+        ), patch(
+            "machine_learning_client.ml.store_midi", side_effect=stored_midi
+        ):
+            hits = ml.result_cache_stats["hits"]
+            first = ml.transcribe_audio(b"same recording")
+            second = ml.transcribe_audio(b"same recording")
+            other = ml.transcribe_audio(b"other recording")
+
+        assert first == second == "https://bucket/a.mid"
+        assert other == "https://bucket/b.mid"
+        assert mock_decode.call_count == 2
+        assert ml.result_cache_stats["hits"] == hits + 1
+
+        key = ml.result_cache_key(b"same recording")
+        for setting, value in [
+            ("crepe_model_capacity", "tiny"),
+            ("decode_mode", "file"),
+            ("analysis_sample_rate", 16000),
+            ("pitch_fmin", 100.0),
+            ("pitch_fmax", 1000.0),
+            ("analysis_mode", "stream"),
+        ]:
+            with patch(f"machine_learning_client.config.{setting}", value):
+                assert ml.result_cache_key(b"same recording") != key, setting
+
+    def test_result_cache_waits_for_upload(self):
+        """Only uploads that reach S3 are cached; failed ones are tried again."""
+        ml.result_cache.clear()
+        error = ClientError({"Error": {"Code": "InternalError"}}, "PutObject")
+        with patch("machine_learning_client.audio.decode_upload") as mock_decode, patch(
+            "machine_learning_client.pitch.process_audio_chunks", return_value=[]
+        ), patch(
+            "machine_learning_client.rhythm.detect_note_onsets", return_value=[]
+        ), patch(
+            "machine_learning_client.rhythm.estimate_note_durations", return_value=[]
+        ), patch(
+            "machine_learning_client.rhythm.estimate_tempo", return_value=120
+        ), patch(
+            "machine_learning_client.uploads.s3"
+        ) as mock_s3_client, patch(
+            "machine_learning_client.config.s3_upload_retries", 1
+        ):
+            mock_s3_client.put_object.side_effect = error
+            midi_url = ml.transcribe_audio(b"unlucky recording")
+            uploads.s3_upload_queue.join()
+            key = midi_url.rsplit("/", 1)[1]
+            assert uploads.get_upload_status(key)["status"] == "failed"
+            assert not ml.result_cache
+
+            mock_s3_client.put_object.side_effect = None
+            assert ml.transcribe_audio(b"unlucky recording") == midi_url
+            uploads.s3_upload_queue.join()
+            assert uploads.get_upload_status(key)["status"] == "uploaded"
+            assert ml.transcribe_audio(b"unlucky recording") == midi_url
+
+        assert mock_decode.call_count == 2
+        assert mock_s3_client.put_object.call_count == 2
+
+    def test_result_cache_lru_and_persistent_tier(self, client):
+        """The memory tier is size-bounded and Mongo backs it up when enabled."""
+        ml.result_cache.clear()
+        with patch("machine_learning_client.config.result_cache_size", 2):
+            for key in ("a", "b", "c"):
+                ml.remember_result(key, f"https://bucket/{key}.mid")
+        assert list(ml.result_cache) == ["b", "c"]
+
+        with patch("machine_learning_client.config.result_cache_persist", True), patch(
+            "machine_learning_client.ml.cache_collection"
+        ) as mock_collection:
+            mock_collection.find_one.return_value = {"midi_url": "https://bucket/a.mid"}
+            assert ml.lookup_cached_result("a") == "https://bucket/a.mid"
+            mock_collection.find_one.return_value = None
+            assert ml.lookup_cached_result("z") is None
+            ml.store_cached_result("z", "https://bucket/z.mid")
+            assert mock_collection.update_one.call_args[0][0] == {"_id": "z"}
+
+        stats = client.get("/cache/stats").get_json()
+        assert stats["persistent_hits"] >= 1 and stats["misses"] >= 1
+        assert stats["size"] == len(ml.result_cache)
+
+    def test_process_returns_inline_midi(self, client):
+        """Clients asking for audio/midi get the file instead of a URL."""
+        data = {"audio": (io.BytesIO(b"recording"), "a.webm", "audio/webm")}
+        with patch(
+            "machine_learning_client.ml.transcribe_audio_to_midi",
+            return_value=b"MThd",
+        ) as mock_transcribe:
+            response = client.post(
+                "/process", data=data, headers={"Accept": "audio/midi"}
+            )
+
+        mock_transcribe.assert_called_once_with(b"recording", backend="crepe")
+        assert response.status_code == 200
+        assert response.mimetype == "audio/midi"
+        assert response.data == b"MThd"
+
+    def test_process_rejects_unknown_pitch_backend(self, client):
+        """Requests can pick a backend, and unknown ones are rejected."""
+        data = {"audio": (io.BytesIO(b"recording"), "a.webm", "audio/webm")}
+        response = client.post("/process", data={**data, "pitch_backend": "nope"})
+        assert response.status_code == 400
+
+        with pytest.raises(ValueError):
+            pitch.detect_pitch(np.zeros(16000), 16000, backend="nope")
+        assert ml.result_cache_key(b"a", backend="yin") != ml.result_cache_key(
+            b"a", backend="crepe"
+        )
+
+    def test_run_stages_concurrently(self):
+        """Independent stages overlap and each one's time is recorded."""
+
+        def slow_stage(value):
+            time.sleep(0.2)
+            return value
+
+        timings = {}
+        start = time.perf_counter()
+        results = ml.run_stages(
+            {"pitch": lambda: slow_stage(1), "tempo": lambda: slow_stage(2)}, timings
+        )
+
+        assert results == {"pitch": 1, "tempo": 2}
+        assert time.perf_counter() - start < 0.35
+        assert set(timings) == {"pitch", "tempo"}
+        assert all(seconds >= 0.2 for seconds in timings.values())
+
+    def test_analyze_transcription_joins_stages(self):
+        """Durations and MIDI notes wait for the concurrent stages."""
+        audio_ctx = audio.AudioContext(np.zeros(44100), 44100)
+        notes_data = [{"time": 0.0, "note": "A4", "confidence": 0.9}]
+        timings = {}
+        with patch(
+            "machine_learning_client.rhythm.detect_note_onsets", return_value=[0.0]
+        ), patch(
+            "machine_learning_client.rhythm.estimate_tempo", return_value=120
+        ), patch(
+            "machine_learning_client.pitch.process_audio_chunks",
+            return_value=notes_data,
+        ) as mock_pitch:
+            notes, onsets, durations, tempo = ml.analyze_transcription(
+                audio_ctx, timings=timings
+            )
+
+        mock_pitch.assert_called_once_with(audio_ctx, backend=None)
+        assert [note["note"] for note in notes] == ["A4"]
+        assert onsets == [0.0] and len(durations) == 1 and tempo == 120
+        assert {"pitch", "onsets", "tempo", "durations", "analysis"} <= set(timings)
@@ -0,0 +1,116 @@
+"""Tests for serving, autotuning and lazy imports"""
+import io
+import os
+import subprocess
+import sys
+from unittest.mock import MagicMock, patch
+import pytest
+from .. import lazy, ml, serving
+from ..ml import app
+
+
+class TestServing:
+    """Serving and import tests"""
+
+    @pytest.fixture
+    def client(self):
+        """Test client for web app"""
+        app.config["TESTING"] = True
+        with app.test_client() as test_client:
+            yield test_client
+
+    def test_autotune_topology(self, tmp_path):
+        """The fastest layout wins and is reused from the cache."""
+        assert serving.candidate_layouts(8) == [(1, 8), (2, 4), (4, 2), (8, 1)]
+        assert serving.candidate_layouts(1) == [(1, 1)]
+
+        cache = str(tmp_path / "topology.json")
+        speeds = {(1, 4): 3.0, (2, 2): 5.0, (4, 1): 4.0}
+        with patch("machine_learning_client.config.topology_cache", cache), patch(
+            "machine_learning_client.serving.measure_layout",
+            side_effect=lambda workers, threads: speeds[(workers, threads)],
+        ) as mock_measure:
+            assert serving.autotune_topology(cores=4) == (2, 2)
+            assert serving.autotune_topology(cores=4) == (2, 2)
+        assert mock_measure.call_count == 3
+
+        with patch("machine_learning_client.config.server_workers", "3"), patch(
+            "machine_learning_client.serving.os.cpu_count", return_value=12
+        ):
+            with pytest.raises(ValueError):
+                serving.serving_topology()
+            for mode in ("sticky", "false"):
+                with patch("machine_learning_client.config.stateful_routes", mode):
+                    assert serving.serving_topology() == (3, 4)
+
+    def test_stateful_routes_stay_in_one_process(self, client):
+        """Per-process state means one worker, unless those routes are off."""
+        with patch("machine_learning_client.config.server_workers", "auto"), patch(
+            "machine_learning_client.serving.os.cpu_count", return_value=8
+        ), patch("machine_learning_client.serving.measure_layout") as mock_measure:
+            assert serving.serving_topology() == (1, 8)
+        mock_measure.assert_not_called()
+
+        with patch("machine_learning_client.config.stateful_routes", "false"):
+            assert client.post("/sessions").status_code == 404
+            assert client.get("/jobs/abc").status_code == 404
+            response = client.post(
+                "/process",
+                data={"audio": (io.BytesIO(b"webm"), "a.webm", "audio/webm")},
+                query_string={"mode": "async"},
+            )
+            assert response.status_code == 400
+
+    def test_ml_workers_follow_topology(self):
+        """One process keeps a worker per core; several get one worker each."""
+        for topology, expected in [((1, 8), 8), ((4, 2), 1)]:
+            with patch("machine_learning_client.config.server_mode", "gunicorn"), patch(
+                "machine_learning_client.config.ml_workers", 0
+            ), patch(
+                "machine_learning_client.serving.serving_topology",
+                return_value=topology,
+            ), patch(
+                "machine_learning_client.ml.os.cpu_count", return_value=8
+            ), patch(
+                "machine_learning_client.serving.pitch_server"
+            ), patch(
+                "machine_learning_client.serving.preload_modules"
+            ):
+                serving.serve()
+                assert ml.pipeline_workers() == expected
+
+    def test_configure_tensorflow_threads(self):
+        """Thread budgets are passed to TensorFlow, and 0 keeps its default."""
+        with patch(
+            "machine_learning_client.serving.tf.config.threading"
+        ) as threading_api:
+            serving.configure_tensorflow_threads(2, 0)
+        threading_api.set_intra_op_parallelism_threads.assert_called_once_with(2)
+        threading_api.set_inter_op_parallelism_threads.assert_not_called()
+
+    def test_import_defers_heavy_modules(self):
+        """Importing the server neither loads TensorFlow nor opens a MongoDB client."""
+        script = (
+            "import sys\n"
+            "from machine_learning_client import ml, serving, uploads\n"
+            "for name in ('tensorflow', 'boto3', 'pretty_midi', 'gunicorn'):\n"
+            "    assert name not in sys.modules, name\n"
+            "assert ml.client.__dict__['_target'] is None\n"
+            "assert uploads.s3.__dict__['_target'] is None\n"
+        )
+        root = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join([root] + sys.path))
+        subprocess.run([sys.executable, "-c", script], env=env, check=True)
+
+    def test_lazy_object(self):
+        """The real object is created once, on first use, and can be patched."""
+        factory = MagicMock(return_value=MagicMock(value=1))
+        proxy = lazy.LazyObject(factory)
+        factory.assert_not_called()
+
+        assert proxy.value == 1
+        with patch.object(proxy, "value", 2):
+            assert proxy.value == 2
+        assert proxy.value == 1
+        assert proxy["key"] is factory.return_value["key"]
+        factory.assert_called_once()
@@ -0,0 +1,215 @@
+"""Tests for recording sessions and live pitch streams"""
+import io
+import json
+import sys
+from unittest.mock import patch
+import pytest
+import numpy as np
+from .. import config, metrics, pitch, sessions
+from ..ml import app
+
+
+class TestSessions:
+    """Recording session and live stream tests"""
+
+    @pytest.fixture
+    def client(self):
+        """Test client for web app"""
+        app.config["TESTING"] = True
+        with app.test_client() as test_client:
+            yield test_client
+
+    @patch("machine_learning_client.pitch.run_pitch_model")
+    def test_recording_session_matches_whole_clip(self, mock_run_model):
+        """Segment-by-segment pitch frames match framing the whole clip at once."""
+        # Echo part of each frame back so the frames themselves can be compared
+        mock_run_model.side_effect = lambda frames, batch_size=None: frames[:, :360]
+        sr = 44100
+        t = np.arange(int(sr * 1.37)) / sr
+        audio = (0.5 * np.sin(2 * np.pi * 220 * t)).astype(np.float32)
+
+        recording = sessions.RecordingSession(sr=sr)
+        for start in range(0, len(audio), 9000):
+            recording.add_pcm(audio[start : start + 9000])
+        frames_before_finish = recording.frames_done
+        with patch(
+            "machine_learning_client.pitch.pitch_from_activation"
+        ) as mock_decode:
+            recording.finish()
+        incremental = mock_decode.call_args[0][0]
+
+        expected = pitch.frame_audio(audio, sr)[:, :360]
+        assert frames_before_finish > 0.9 * len(expected)
+        assert incremental.shape == expected.shape
+        np.testing.assert_allclose(incremental, expected, atol=2e-3)
+        np.testing.assert_array_equal(recording.audio, audio)
+
+    def test_recording_session_routes(self, client):
+        """Sessions accept PCM segments and finish with a MIDI URL."""
+        session_id = client.post("/sessions").get_json()["session_id"]
+        segment = np.zeros(4410, dtype=np.float32).tobytes()
+
+        with patch("machine_learning_client.pitch.run_pitch_model") as mock_run_model:
+            mock_run_model.side_effect = lambda frames, batch_size=None: np.full(
+                (len(frames), 360), 0.1
+            )
+            for _ in range(3):
+                response = client.post(
+                    f"/sessions/{session_id}/segments",
+                    data={"audio": (io.BytesIO(segment), "s.pcm", "audio/pcm")},
+                )
+                assert response.status_code == 200
+            assert np.isclose(response.get_json()["seconds"], 0.3)
+
+            with patch(
+                "machine_learning_client.ml.complete_transcription",
+                return_value="https://bucket/session.mid",
+            ):
+                response = client.post(f"/sessions/{session_id}/finish")
+
+        assert response.get_json()["midi_url"] == "https://bucket/session.mid"
+        assert client.post(f"/sessions/{session_id}/finish").status_code == 404
+
+    def test_recording_session_browser_webm_and_discard(self, client):
+        """Segments labelled with a codec are WebM; discarding frees the session."""
+        session_id = client.post("/sessions").get_json()["session_id"]
+        segment = (io.BytesIO(b"webm"), "s.webm", "audio/webm;codecs=opus")
+        with patch.object(sessions.RecordingSession, "add_webm") as mock_add:
+            response = client.post(
+                f"/sessions/{session_id}/segments", data={"audio": segment}
+            )
+        assert response.status_code == 200
+        mock_add.assert_called_once_with(b"webm")
+
+        recording = sessions.recording_sessions[session_id]
+        assert client.delete(f"/sessions/{session_id}").status_code == 200
+        assert recording.closed
+        assert client.delete(f"/sessions/{session_id}").status_code == 404
+
+    @patch("machine_learning_client.pitch.run_pitch_model")
+    def test_recording_session_keeps_one_decoder(self, mock_run_model):
+        """WebM segments stream through one decoder process per session."""
+        mock_run_model.side_effect = lambda frames, batch_size=None: frames[:, :360]
+        # Stand-in for ffmpeg that passes its input straight through as PCM,
+        # logging more than a pipe holds so an undrained stderr would block it
+        echo = [
+            sys.executable,
+            "-c",
+            "import sys\n"
+            "while data := sys.stdin.buffer.read1(65536):\n"
+            "    sys.stderr.buffer.write(b'log line\\n' * 100000)\n"
+            "    sys.stdout.buffer.write(data)\n"
+            "    sys.stdout.buffer.flush()",
+        ]
+        audio = np.random.default_rng(0).uniform(-1, 1, 30000).astype(np.float32)
+        data = audio.tobytes()
+
+        recording = sessions.RecordingSession(sr=16000)
+        with patch(
+            "machine_learning_client.audio.ffmpeg_pcm_command", return_value=echo
+        ) as mock_command:
+            for start in range(0, len(data), 10001):
+                recording.add_webm(data[start : start + 10001])
+            recording.finish()
+
+        mock_command.assert_called_once_with(16000)
+        np.testing.assert_array_equal(recording.audio, audio)
+
+    def test_recording_sessions_are_capped_and_expire(self, client):
+        """Idle sessions are closed by the reaper and new ones wait for room."""
+        sessions.recording_sessions.clear()
+        with patch("machine_learning_client.config.max_recording_sessions", 2):
+            first = client.post("/sessions").get_json()["session_id"]
+            client.post("/sessions")
+            response = client.post("/sessions")
+            assert response.status_code == 503
+            assert response.headers["Retry-After"]
+
+            recording = sessions.recording_sessions[first]
+            recording.last_used -= config.session_idle_seconds + 1
+            assert sessions.expire_idle_sessions() == [first]
+            assert recording.closed
+            with pytest.raises(ValueError):
+                recording.add_pcm(np.zeros(10, dtype=np.float32))
+            assert client.post("/sessions").status_code == 201
+        sessions.recording_sessions.clear()
+
+    @patch("machine_learning_client.pitch.run_pitch_model")
+    def test_live_stream_events_and_backpressure(self, mock_run_model, client):
+        """Frames pushed to a stream come back as timed note events."""
+        activation = np.zeros(360)
+        activation[150] = 0.9
+        mock_run_model.side_effect = lambda frames, batch_size=None: np.tile(
+            activation, (len(frames), 1)
+        )
+        stream_id = client.post("/streams").get_json()["stream_id"]
+        chunk = np.zeros(1600, dtype=np.float32).tobytes()  # 100 ms at 16 kHz
+
+        for _ in range(5):
+            response = client.post(f"/streams/{stream_id}/frames", data=chunk)
+            assert response.status_code == 202
+        client.post(f"/streams/{stream_id}/close")
+        body = client.get(f"/streams/{stream_id}/events").get_data(as_text=True)
+
+        events = [
+            json.loads(line[len("data: ") :])
+            for line in body.splitlines()
+            if line.startswith('data: {"')
+        ]
+        assert len(events) == 51
+        assert [event["time"] for event in events[:3]] == [0.0, 0.01, 0.02]
+        assert events[0]["confidence"] == 0.9 and events[0]["note"]
+        assert body.rstrip().endswith("event: end\ndata: {}")
+        assert metrics.stream_latency.snapshot()["count"] >= 5
+
+        stream = sessions.LivePitchStream(sr=16000, max_buffer_seconds=0.1)
+        assert not stream.push(np.zeros(3200))
+        stream.close()
+        with pytest.raises(ValueError):
+            stream.push(np.zeros(10))
+        while stream.events.get(timeout=5) is not None:
+            pass
+
+    @patch("machine_learning_client.pitch.run_pitch_model")
+    def test_live_streams_are_released(self, mock_run_model, client):
+        """Streams are capped, closed when idle and dropped when the client leaves."""
+        activation = np.zeros(360)
+        activation[150] = 0.9
+        mock_run_model.side_effect = lambda frames, batch_size=None: np.tile(
+            activation, (len(frames), 1)
+        )
+        sessions.live_streams.clear()
+        with patch("machine_learning_client.config.max_live_streams", 2):
+            first = client.post("/streams").get_json()["stream_id"]
+            second = client.post("/streams").get_json()["stream_id"]
+            assert client.post("/streams").status_code == 503
+
+        stream = sessions.live_streams[first]
+        stream.last_used -= config.stream_idle_seconds + 1
+        assert sessions.expire_idle_streams() == [first]
+        assert client.post(f"/streams/{first}/frames", data=b"").status_code == 404
+        while stream.events.get(timeout=5) is not None:
+            pass
+
+        stream = sessions.live_streams[second]
+        stream.push(np.zeros(1600))
+        response = client.get(f"/streams/{second}/events")
+        response.response.close()  # the client disconnects mid-stream
+        assert second not in sessions.live_streams
+        with pytest.raises(ValueError):
+            stream.push(np.zeros(10))
+        while stream.events.get(timeout=5) is not None:
+            pass
+
+    @patch("machine_learning_client.pitch.run_pitch_model")
+    def test_live_stream_reports_model_errors(self, mock_run_model):
+        """A failing model ends the events with an error and closes the stream."""
+        mock_run_model.side_effect = RuntimeError("model failed")
+        stream = sessions.LivePitchStream(sr=16000)
+        assert stream.push(np.zeros(1600))
+
+        assert stream.events.get(timeout=5) == {"error": "model failed"}
+        assert stream.events.get(timeout=5) is None
+        assert stream.pending_samples == 0
+        with pytest.raises(ValueError):
+            stream.push(np.zeros(10))
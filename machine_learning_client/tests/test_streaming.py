@@ -0,0 +1,94 @@
+"""Tests for block-by-block streaming analysis"""
+from unittest.mock import patch
+import pytest
+import numpy as np
+import soundfile as sf
+from .. import benchmark, midi, ml, pitch, rhythm, streaming
+from ..audio import AudioContext, AudioFile
+from .fakes import zero_crossing_model
+
+
+class TestStreaming:
+    """Streaming analysis tests"""
+
+    @pytest.fixture
+    def long_recording(self, tmp_path):
+        """A melody with a long pause, saved as the float32 WAV streaming reads."""
+        audio = np.concatenate(
+            [
+                benchmark.generate_melody(6),
+                np.zeros(44100),
+                benchmark.generate_melody(4, seed=1),
+            ]
+        )
+        path = str(tmp_path / "recording.wav")
+        sf.write(path, audio, 44100, subtype="FLOAT")
+        return audio, path
+
+    @patch("machine_learning_client.pitch.crepe.core.build_and_load_model")
+    def test_stream_stages_match_memory(self, mock_build, long_recording):
+        """Block by block, every stage gives what the whole signal gives."""
+        mock_build.return_value.predict.side_effect = zero_crossing_model
+        audio, path = long_recording
+        audio_ctx = AudioContext(audio, 44100)
+        audio_file = AudioFile(path, block_seconds=0.7)
+        y = audio_ctx.at_rate(22050)
+
+        stream_track = streaming.stream_pitch(audio_file)
+        for streamed, whole in zip(
+            stream_track, pitch.predict_pitch(audio_ctx.at_rate(16000), 16000)
+        ):
+            assert np.array_equal(streamed, whole)
+        assert (stream_track[2] == 0).any()
+
+        onsets, tempo = streaming.stream_onsets_and_tempo(audio_file, sr=22050)
+        assert np.array_equal(onsets, rhythm.detect_note_onsets(audio_ctx, sr=22050))
+        assert tempo == rhythm.estimate_tempo(audio_ctx, sr=22050)
+
+        envelope, n_samples = streaming.stream_amplitude_envelope(audio_file, sr=22050)
+        assert n_samples == len(y)
+        assert np.array_equal(envelope, rhythm.calculate_amplitude_envelope(y, 22050))
+
+    def test_voiced_region_decoder_windows(self):
+        """Long regions decoded a window at a time give the whole-region notes."""
+        activation = zero_crossing_model(
+            pitch.frame_audio(benchmark.generate_melody(40, sr=16000), 16000)
+        )
+        active = np.ones(len(activation), dtype=bool)
+        decoder = streaming.VoicedRegionDecoder(window_seconds=10, context_seconds=5)
+        for start in range(0, len(activation), 70):
+            decoder.push(activation[start : start + 70], active[start : start + 70])
+        frequency, confidence = decoder.finish()
+        times, whole_frequency, whole_confidence = pitch.pitch_from_activation(
+            activation
+        )
+
+        assert np.array_equal(confidence, whole_confidence)
+        assert midi.process_notes(
+            pitch.pitch_to_notes_data(times, frequency, confidence)
+        ) == midi.process_notes(
+            pitch.pitch_to_notes_data(times, whole_frequency, whole_confidence)
+        )
+
+    @patch("machine_learning_client.pitch.crepe.core.build_and_load_model")
+    def test_stream_analysis_mode(self, mock_build, long_recording):
+        """ANALYSIS_MODE=stream decodes to a file and finds the same notes."""
+        mock_build.return_value.predict.side_effect = zero_crossing_model
+        audio, path = long_recording
+
+        def fake_decode(_, wav_file, sr):
+            sf.write(wav_file, sf.read(path, dtype="float32")[0], sr, subtype="FLOAT")
+
+        with patch(
+            "machine_learning_client.audio.decode_upload",
+            return_value=AudioContext(audio, 44100),
+        ):
+            expected = ml.analyze_upload(b"webm")
+        with patch("machine_learning_client.config.analysis_mode", "stream"), patch(
+            "machine_learning_client.audio.decode_webm_to_wav", side_effect=fake_decode
+        ), patch("machine_learning_client.config.stream_block_seconds", 1.0):
+            notes, onsets, durations, tempo = ml.analyze_upload(b"webm")
+
+        assert notes and notes == expected[0]
+        assert np.array_equal(onsets, expected[1])
+        assert durations == expected[2] and tempo == expected[3]
@@ -0,0 +1,100 @@
+"""Tests for MIDI uploads to S3"""
+import io
+import os
+import threading
+from unittest.mock import patch
+import pytest
+import boto3
+from botocore.exceptions import ClientError
+from moto import mock_aws
+import pretty_midi
+from .. import midi, uploads
+from ..ml import app
+
+
+class TestUploads:
+    """S3 upload tests"""
+
+    @pytest.fixture
+    def client(self):
+        """Test client for web app"""
+        app.config["TESTING"] = True
+        with app.test_client() as test_client:
+            yield test_client
+
+    def test_background_upload_to_local_s3(self, client):
+        """MIDI bytes are uploaded off the request path under a content key."""
+        with mock_aws():
+            local_s3 = boto3.client("s3", region_name="us-east-1")
+            local_s3.create_bucket(Bucket="voice2midi")
+            with patch("machine_learning_client.uploads.s3", local_s3), patch(
+                "machine_learning_client.config.s3_bucket_name", "voice2midi"
+            ):
+                midi_url = uploads.queue_midi_upload(b"MThd midi bytes")
+                assert uploads.queue_midi_upload(b"MThd midi bytes") == midi_url
+                uploads.s3_upload_queue.join()
+
+                key = midi_url.rsplit("/", 1)[1]
+                stored = local_s3.get_object(Bucket="voice2midi", Key=key)
+
+        assert midi_url == f"https://voice2midi.s3.amazonaws.com/{key}"
+        assert stored["Body"].read() == b"MThd midi bytes"
+        assert stored["ContentType"] == "audio/midi"
+        status = client.get(f"/uploads/{key}").get_json()
+        assert status["status"] == "uploaded" and status["attempts"] == 1
+
+    def test_upload_retries_with_backoff(self):
+        """Failed uploads are retried and reported as failed after the last try."""
+        error = ClientError({"Error": {"Code": "SlowDown"}}, "PutObject")
+        # time.sleep is patched process-wide, so ignore threads left by other tests
+        test_thread = threading.get_ident()
+        sleeps = []
+
+        def record_sleep(seconds):
+            if threading.get_ident() == test_thread:
+                sleeps.append(seconds)
+
+        with patch("machine_learning_client.uploads.s3") as mock_s3_client, patch(
+            "machine_learning_client.uploads.time.sleep", side_effect=record_sleep
+        ), patch("machine_learning_client.config.s3_upload_retries", 3):
+            mock_s3_client.put_object.side_effect = [error, None]
+            assert uploads.upload_midi_bytes("retry.mid", b"data")
+
+            mock_s3_client.put_object.side_effect = error
+            assert not uploads.upload_midi_bytes("fail.mid", b"data")
+
+            # Sync uploads go through the same retries
+            mock_s3_client.upload_fileobj.side_effect = [error, None]
+            url = uploads.upload_midi_fileobj(b"sync data")
+
+        assert uploads.get_upload_status("retry.mid")["attempts"] == 2
+        assert uploads.get_upload_status("fail.mid")["status"] == "failed"
+        key = uploads.midi_object_key(b"sync data")
+        assert url.endswith(key)
+        assert uploads.get_upload_status(key)["attempts"] == 2
+        assert sleeps == [0.5, 0.5, 1.0, 0.5]
+
+    def test_midi_to_bytes_without_disk(self, tmp_path):
+        """MIDI is serialized in memory and uploaded from a file object."""
+        notes = [
+            {"note": "C4", "start_time": 0.0, "end_time": 0.45},
+            {"note": "E4", "start_time": 0.5, "end_time": 0.95},
+        ]
+        with patch.object(app, "root_path", str(tmp_path)):
+            data = midi.midi_to_bytes(notes, [0.0, 0.5], [0.5, 0.5], 120)
+        assert not os.listdir(tmp_path)
+
+        midi_file = pretty_midi.PrettyMIDI(io.BytesIO(data))
+        assert [note.pitch for note in midi_file.instruments[0].notes] == [60, 64]
+
+        with mock_aws():
+            local_s3 = boto3.client("s3", region_name="us-east-1")
+            local_s3.create_bucket(Bucket="voice2midi")
+            with patch("machine_learning_client.uploads.s3", local_s3), patch(
+                "machine_learning_client.config.s3_bucket_name", "voice2midi"
+            ):
+                midi_url = uploads.upload_midi_fileobj(data)
+            key = midi_url.rsplit("/", 1)[1]
+            stored = local_s3.get_object(Bucket="voice2midi", Key=key)
+        assert stored["Body"].read() == data
+        assert stored["ContentType"] == "audio/midi"
@@ -0,0 +1,203 @@
+"""Background uploads of MIDI files to S3 and their status."""
+import io
+import hashlib
+import importlib
+import queue
+import logging
+import threading
+import time
+from collections import OrderedDict
+from functools import partial
+
+from machine_learning_client import config, lazy, metrics
+
+
+# boto3 takes a few hundred ms to import and only uploads need it
+boto3 = lazy.LazyObject(partial(importlib.import_module, "boto3"))
+botocore_config = lazy.LazyObject(partial(importlib.import_module, "botocore.config"))
+botocore_exceptions = lazy.LazyObject(
+    partial(importlib.import_module, "botocore.exceptions")
+)
+
+s3 = lazy.LazyObject(
+    lambda: boto3.client(
+        "s3",
+        aws_access_key_id=config.aws_access_key_id,
+        aws_secret_access_key=config.aws_secret_access_key,
+        endpoint_url=config.s3_endpoint_url,
+        config=botocore_config.Config(
+            max_pool_connections=config.s3_max_pool_connections,
+            # retry_upload does the retrying, so each attempt is counted
+            # and backed off once instead of botocore retrying inside it
+            retries={"max_attempts": 1, "mode": "standard"},
+        ),
+    )
+)
+s3_upload_queue = queue.Queue(maxsize=config.s3_upload_queue_size)
+s3_uploads = OrderedDict()
+s3_uploads_lock = threading.Lock()
+# Functions waiting for an upload to finish, called with the object's URL
+s3_upload_callbacks = {}
+s3_uploader_threads = []
+
+
+def s3_object_url(key):
+    """Public URL of an object in the MIDI bucket."""
+    if config.s3_endpoint_url:
+        return f"{config.s3_endpoint_url.rstrip('/')}/{config.s3_bucket_name}/{key}"
+    return f"https://{config.s3_bucket_name}.s3.amazonaws.com/{key}"
+
+
+def set_upload_status(key, **fields):
+    """Update the tracked status of a background upload."""
+    with s3_uploads_lock:
+        s3_uploads.setdefault(key, {"key": key}).update(fields)
+        while len(s3_uploads) > config.job_history:
+            s3_uploads.popitem(last=False)
+
+
+def get_upload_status(key):
+    """Return a copy of an upload's status, or None if it is unknown."""
+    with s3_uploads_lock:
+        status = s3_uploads.get(key)
+        return dict(status) if status else None
+
+
+def finish_upload(key, **fields):
+    """
+    Record an upload's final status and return the functions waiting for
+    it, in one step so none can be added after they have been collected.
+    """
+    with s3_uploads_lock:
+        s3_uploads.setdefault(key, {"key": key}).update(fields)
+        return s3_upload_callbacks.pop(key, [])
+
+
+def retry_upload(key, upload):
+    """
+    Call upload() up to S3_UPLOAD_RETRIES times with exponential backoff,
+    recording each attempt in the key's status. Raises the last error.
+    """
+    retries = max(1, config.s3_upload_retries)
+    for attempt in range(1, retries + 1):
+        set_upload_status(key, status="uploading", attempts=attempt)
+        try:
+            with metrics.stage_timer("s3_upload"):
+                return upload()
+        except (
+            botocore_exceptions.BotoCoreError,
+            botocore_exceptions.ClientError,
+        ) as e:
+            logging.warning("S3 upload of %s failed (attempt %d): %s", key, attempt, e)
+            set_upload_status(key, error=str(e))
+            if attempt == retries:
+                raise
+            time.sleep(config.s3_upload_backoff * 2 ** (attempt - 1))
+    return None
+
+
+def upload_midi_bytes(key, data):
+    """
+    Upload MIDI bytes to S3, retrying with exponential backoff. Functions
+    waiting for the upload are called with its URL once it succeeds.
+    """
+    try:
+        retry_upload(
+            key,
+            partial(
+                s3.put_object,
+                Bucket=config.s3_bucket_name,
+                Key=key,
+                Body=data,
+                ContentType="audio/midi",
+            ),
+        )
+    except (botocore_exceptions.BotoCoreError, botocore_exceptions.ClientError):
+        logging.error("Giving up on S3 upload of %s", key)
+        finish_upload(key, status="failed")
+        return False
+    for callback in finish_upload(key, status="uploaded", error=None):
+        callback(s3_object_url(key))
+    return True
+
+
+def s3_upload_worker():
+    """Background thread that drains the S3 upload queue."""
+    while True:
+        key, data = s3_upload_queue.get()
+        try:
+            upload_midi_bytes(key, data)
+        finally:
+            s3_upload_queue.task_done()
+
+
+def start_s3_uploaders():
+    """Start the background uploader threads if they are not running yet."""
+    with s3_uploads_lock:
+        while len(s3_uploader_threads) < config.s3_upload_workers:
+            thread = threading.Thread(
+                target=s3_upload_worker, name="s3-uploader", daemon=True
+            )
+            thread.start()
+            s3_uploader_threads.append(thread)
+
+
+def queue_midi_upload(data, on_uploaded=None):
+    """
+    Queue MIDI bytes for upload under a key derived from their content and
+    return the object's URL straight away. Identical files share one upload.
+    on_uploaded is called with the URL once the object is in S3.
+    """
+    key = midi_object_key(data)
+    with s3_uploads_lock:
+        status = s3_uploads.get(key, {}).get("status")
+        if status != "uploaded":
+            if on_uploaded is not None:
+                s3_upload_callbacks.setdefault(key, []).append(on_uploaded)
+            if status in ("queued", "uploading"):
+                return s3_object_url(key)
+            s3_uploads[key] = {"key": key, "status": "queued", "attempts": 0}
+    if status == "uploaded":
+        if on_uploaded is not None:
+            on_uploaded(s3_object_url(key))
+        return s3_object_url(key)
+
+    start_s3_uploaders()
+    try:
+        s3_upload_queue.put_nowait((key, data))
+    except queue.Full:
+        logging.warning("S3 upload queue full, uploading %s inline", key)
+        upload_midi_bytes(key, data)
+    return s3_object_url(key)
+
+
+def midi_object_key(data):
+    """S3 key for a MIDI file, derived from its content."""
+    return f"midi_{hashlib.sha256(data).hexdigest()[:32]}.mid"
+
+
+def upload_midi_fileobj(data):
+    """Upload MIDI bytes straight from memory and return the object's URL."""
+    key = midi_object_key(data)
+    # A fresh file object per attempt, since a failed one may have been read
+    retry_upload(
+        key,
+        lambda: s3.upload_fileobj(
+            io.BytesIO(data),
+            config.s3_bucket_name,
+            key,
+            ExtraArgs={"ContentType": "audio/midi"},
+        ),
+    )
+    set_upload_status(key, status="uploaded", error=None)
+    return s3_object_url(key)
+
+
+def store_midi_bytes(data, on_stored=None):
+    """Store serialized MIDI bytes in S3 and return the object's URL."""
+    if config.s3_upload_mode == "background":
+        return queue_midi_upload(data, on_uploaded=on_stored)
+    midi_url = upload_midi_fileobj(data)
+    if on_stored is not None:
+        on_stored(midi_url)
+    return midi_url
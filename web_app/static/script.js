@@ -1,20 +1,30 @@
 let mediaRecorder;
 let audioChunks = [];
 let isRecording = false;
+// Segmented upload: each timeslice is sent while the user is still recording
+let sessionID = null;
+let segmentUploads = Promise.resolve();
+const segmentMs = 1000;
 
 const host = "159.65.44.240";
 
 function startRecording() {
   navigator.mediaDevices
     .getUserMedia({ audio: true })
-    .then((stream) => {
-      const options = { mimeType: "audio/webm" };
-      mediaRecorder = new MediaRecorder(stream, options);
-      mediaRecorder.ondataavailable = handleDataAvailable;
-      mediaRecorder.onstop = handleStop;
-      mediaRecorder.start();
-      audioChunks = [];
-    })
+    .then((stream) =>
+      startSession().then(() => {
+        const options = { mimeType: "audio/webm" };
+        mediaRecorder = new MediaRecorder(stream, options);
+        mediaRecorder.ondataavailable = handleDataAvailable;
+        mediaRecorder.onstop = handleStop;
+        audioChunks = [];
+        if (sessionID) {
+          mediaRecorder.start(segmentMs);
+        } else {
+          mediaRecorder.start();
+        }
+      })
+    )
     .catch((error) => {
       console.error("Error accessing the microphone: ", error);
     });
@@ -24,14 +34,84 @@ function stopRecording() {
   mediaRecorder.stop();
 }
 
+function startSession() {
+  sessionID = null;
+  segmentUploads = Promise.resolve();
+  return fetch(`http://${host}:5002/sessions`, { method: "POST" })
+    .then((response) => (response.ok ? response.json() : {}))
+    .then((data) => {
+      sessionID = data.session_id || null;
+    })
+    .catch((error) => {
+      // Fall back to uploading the whole recording when it stops
+      console.error("Could not start a recording session: ", error);
+    });
+}
+
+function sendSegment(segment) {
+  let formData = new FormData();
+  // Browsers label MediaRecorder blobs "audio/webm;codecs=opus"
+  const webm = new Blob([segment], { type: "audio/webm" });
+  formData.append("audio", webm, "segment.webm");
+  return fetch(`http://${host}:5002/sessions/${sessionID}/segments`, {
+    method: "POST",
+    body: formData,
+  }).then((response) => {
+    if (!response.ok) {
+      throw new Error(`Server returned status: ${response.status}`);
+    }
+  });
+}
+
 function handleDataAvailable(event) {
   audioChunks.push(event.data);
+  if (sessionID && event.data.size > 0) {
+    // Chain uploads so segments arrive in recording order
+    segmentUploads = segmentUploads.then(() => sendSegment(event.data));
+  }
 }
 
 function handleStop() {
   const audioBlob = new Blob(audioChunks, { type: "audio/webm" });
   const userID = getCurrentUserID();
-  sendAudioToServer(audioBlob, userID);
+  if (sessionID) {
+    finishSession(audioBlob, userID);
+  } else {
+    sendAudioToServer(audioBlob, userID);
+  }
+}
+
+function finishSession(audioBlob, userID) {
+  let formData = new FormData();
+  formData.append("user_id", userID);
+  showLoader();
+
+  segmentUploads
+    .then(() =>
+      fetch(`http://${host}:5002/sessions/${sessionID}/finish`, {
+        method: "POST",
+        body: formData,
+      })
+    )
+    .then((response) => {
+      if (!response.ok) {
+        throw new Error(`Server returned status: ${response.status}`);
+      }
+      return response.json();
+    })
+    .then((data) => {
+      displayMidiLink(data.midi_url);
+      hideLoader();
+    })
+    .catch((error) => {
+      // Any failed segment: send the whole recording the old way instead
+      console.error("Segmented upload failed, sending whole recording: ", error);
+      hideLoader();
+      // Release the server's session and its ffmpeg process first
+      fetch(`http://${host}:5002/sessions/${sessionID}`, { method: "DELETE" })
+        .catch(() => {})
+        .then(() => sendAudioToServer(audioBlob, userID));
+    });
 }
 
 function sendAudioToServer(audioBlob, userID) {